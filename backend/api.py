@@ -0,0 +1,136 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import AsyncIterator, Dict, List
+from loguru import logger
+import asyncio
+
+import jobs
+import protocol
+
+STREAM_POLL_INTERVAL = 0.5  # seconds between checks for finished jobs
+MAX_WAIT = 60  # seconds a result request can wait for its job
+
+class SubmitRequest(BaseModel):
+    url: str
+
+class BulkSubmitRequest(BaseModel):
+    urls: List[str]
+    stream: bool = False  # answer with the results as NDJSON
+
+class StreamRequest(BaseModel):
+    ids: List[str]
+
+def job_status(scheduler: jobs.JobScheduler, job: jobs.Job, positions: Dict[str, int] = None) -> dict:
+    # For many jobs, pass a scheduler.positions() snapshot instead of scanning the queue for each one
+    position = positions.get(job.id, 0) if positions is not None else scheduler.position(job.id)
+    return {**job.to_dict(), "position": position}
+
+def job_result(job: jobs.Job) -> dict:
+    return {"job": job.to_dict(), "result": job.result}
+
+async def stream_results(pending: List[jobs.Job], rejected: List[dict] = None) -> AsyncIterator[str]:
+    """
+    Yield one NDJSON line per job, in the order they finish.
+
+    Args:
+        pending (List[Job]): The jobs to wait for.
+        rejected (List[dict]): URLs that couldn't be queued, reported first.
+    """
+    for item in rejected or []:
+        yield protocol.encode(item) + "\n"
+
+    while pending:
+        waiting = []
+        for job in pending:
+            if job.done.is_set():
+                yield protocol.encode(job_result(job)) + "\n"
+            else:
+                waiting.append(job)
+
+        pending = waiting
+        if pending:
+            await asyncio.sleep(STREAM_POLL_INTERVAL)
+
+def build_router(scheduler: jobs.JobScheduler) -> APIRouter:
+    """
+    Build the HTTP API, which shares the job scheduler with the websocket.
+
+    Args:
+        scheduler (JobScheduler): The scheduler that runs the jobs.
+
+    Returns:
+        APIRouter: The routes under /jobs.
+    """
+    router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+    def get_job(job_id: str) -> jobs.Job:
+        job = scheduler.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown job.")
+        return job
+
+    @router.post("", status_code=202)
+    async def submit(request: SubmitRequest):
+        try:
+            job = scheduler.submit(request.url)
+        except jobs.QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+        return job_status(scheduler, job)
+
+    @router.post("/bulk", status_code=202)
+    async def submit_bulk(request: BulkSubmitRequest):
+        submitted: List[jobs.Job] = []
+        rejected: List[dict] = []
+
+        # Bulk jobs only run when no interactive job is waiting
+        for url in request.urls:
+            try:
+                submitted.append(scheduler.submit(url, priority="bulk"))
+            except jobs.QueueFullError as e:
+                rejected.append({"url": url, "error": str(e)})
+
+        logger.info(f"Bulk submission: {len(submitted)} queued, {len(rejected)} rejected")
+
+        if request.stream:
+            return StreamingResponse(stream_results(submitted, rejected), media_type="application/x-ndjson")
+
+        positions = scheduler.positions()
+        return {
+            "jobs": [job_status(scheduler, job, positions) for job in submitted],
+            "rejected": rejected,
+        }
+
+    @router.post("/stream")
+    async def stream(request: StreamRequest):
+        pending = [get_job(job_id) for job_id in request.ids]
+        return StreamingResponse(stream_results(pending), media_type="application/x-ndjson")
+
+    @router.get("/{job_id}")
+    async def status(job_id: str):
+        return job_status(scheduler, get_job(job_id))
+
+    @router.get("/{job_id}/result")
+    async def result(job_id: str, wait: float = 0):
+        job = get_job(job_id)
+
+        # Long polling, without blocking the server loop
+        if wait > 0 and not job.done.is_set():
+            await asyncio.to_thread(job.done.wait, min(wait, MAX_WAIT))
+
+        if not job.done.is_set():
+            raise HTTPException(status_code=409, detail=f"The job is {job.status}.")
+
+        return job_result(job)
+
+    @router.delete("/{job_id}")
+    async def cancel(job_id: str):
+        job = get_job(job_id)
+
+        if not scheduler.cancel(job.id):
+            raise HTTPException(status_code=409, detail=f"The job is already {job.status}.")
+
+        return job_status(scheduler, job)
+
+    return router
@@ -2,91 +2,127 @@ from fastapi import FastAPI, WebSocket
 from loguru import logger
 import json
 import asyncio
-import threading
 import uvicorn
 import sys
 import os
-import queue
-import time
 
 # Ensure the path to the library is included
 sys.path.append("./libreria/")
 
-import mock
+from fake_news_detector import debug
 
-from fake_news_detector.fake_news_detector import FakeNewsDetector
+import jobs
+import progress
+import api
+import metrics
 
 app = FastAPI()
-clients = set()
 
-fnd = FakeNewsDetector()
+debug.setup()
 
-# Handle status updates for all clients
-def handle_status(msg_queue: queue.Queue):
-    fnd.register_callback(status_callback)
-    logger.info("Callback registered for status updates.")
+hub = progress.ProgressHub()
+
+def progress_callback(job: jobs.Job, data: dict):
+    # Called from the worker threads
+    hub.publish(job.id, data)
     
-    while True:
-        if not msg_queue.empty():
-            url = msg_queue.get()
-            logger.info(f"Received analysis request from queue: {url}")
-            
-            if url != "mock":
-                try:
-                    fnd.run(url)
-                except Exception as e:
-                    logger.error(f"Error during analysis: {e}")
-            else:
-                logger.info("Using mock data for testing.")
-                mock.run_mocks(fnd, status_callback)
-        else:
-            time.sleep(1)  # Sleep to avoid busy waiting
+def finish_callback(job: jobs.Job):
+    metrics.observe_job(job)
+    
+    # Let the clients know about jobs that ended without a result
+    if job.result is None:
+        error = "The analysis was cancelled." if job.status == "cancelled" else "The analysis failed."
+        hub.publish(job.id, {"url": job.url, "phase": job.status, "error": error})
+    
+    hub.close(job.id)
+
+scheduler = jobs.JobScheduler(on_progress=progress_callback, on_finish=finish_callback)
+scheduler.start()
+
+# HTTP access to the same workers
+app.include_router(api.build_router(scheduler))
+
+# Prometheus metrics
+app.include_router(metrics.build_router(scheduler, hub))
+
+def attach(job: jobs.Job, subscriber: progress.Subscriber):
+    """
+    Send the current state of a job to a client and subscribe it to the rest.
+    A client follows a single job, so it stops receiving its previous one.
+    """
+    hub.unsubscribe(subscriber)
+    
+    finished = job.status in jobs.DONE_STATUSES
     
-def status_callback(data: str =None):
-    if len(clients) == 0:
-        logger.warning("No clients connected to send status updates.")
+    if finished and job.result is None:
+        error = "The analysis was cancelled." if job.status == "cancelled" else "The analysis failed."
+        subscriber.send({"type": "error", "job_id": job.id, "url": job.url, "error": error}, job.id)
         return
     
-    for c in list(clients):
-        try:
-            logger.info(f"Sending status update to client.")
-            asyncio.run(c.send_json(data))
-        except Exception as e:
-            logger.error(f"Error while sending status to client: {e}")
+    hub.resync(job.id, subscriber, state=job.result if finished else None)
 
-msg_queue = queue.Queue()
-thread = threading.Thread(target=handle_status, args=(msg_queue,))
-thread.start()
+@app.on_event("startup")
+async def startup():
+    # Updates are handed to uvicorn's loop, which owns the websockets
+    hub.bind(asyncio.get_running_loop())
 
 # Handle requests
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    # Accept the WebSocket connection and add it to the clients set
+    # Accept the WebSocket connection and start its sender
     await websocket.accept()
-    clients.add(websocket)
+    
+    subscriber = progress.Subscriber(websocket)
+    subscriber.start()
     
     logger.info(f"New WebSocket connection: {websocket.client}")
     
     try:
         while True:
-            if fnd.is_running():
-                await asyncio.sleep(1)
-                continue
-            
             data_raw = await websocket.receive_text()
             data = json.loads(data_raw)
             
             logger.info(f"Received data from client: {data}")
             
+            # A reconnected client asking for the current state of its job
+            if data.get("resync"):
+                job = scheduler.get(data["resync"])
+                
+                if job is None:
+                    subscriber.send({"type": "error", "job_id": data["resync"], "error": "Unknown job."})
+                    continue
+                
+                attach(job, subscriber)
+                continue
+            
             url = data.get("url")
-            msg_queue.put(url)
+            
+            try:
+                job = scheduler.submit(url)
+            except jobs.QueueFullError as e:
+                subscriber.send({"type": "error", "url": url, "error": str(e)})
+                continue
+            
+            # Let the client know where its job is
+            subscriber.send({
+                "type": "queued",
+                "job_id": job.id,
+                "url": url,
+                "position": scheduler.position(job.id),
+                "cached": job.cached,
+            }, job.id)
+            
+            # Only the clients that submitted the URL receive the job's updates.
+            # Repeated URLs attach to the running job or get the cached result
+            attach(job, subscriber)
             
             logger.debug(f"URL added to queue.")
             
     except Exception as e:
         print(f"WebSocket connection closed with error: {e}")
     finally:
-        clients.remove(websocket)
+        hub.unsubscribe(subscriber)
+        subscriber.stop()
         #await websocket.close()
         
 @app.get("/")
@@ -0,0 +1,413 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Literal
+from loguru import logger
+import multiprocessing
+import threading
+import time
+import uuid
+import os
+
+import mock
+import results
+
+from fake_news_detector.fake_news_detector import FakeNewsDetector
+from fake_news_detector import debug
+from fake_news_detector import telemetry
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUE = 100
+DEFAULT_MAX_BULK_QUEUE = 10000
+DEFAULT_JOB_RETENTION = 60 * 60  # seconds finished jobs stay available
+EVENTS_DRAIN_TIMEOUT = 5  # seconds waiting for the last updates of a child process
+
+# Sent by the child processes after their last update
+EVENTS_END = "__end__"
+
+WorkerMode = Literal["thread", "process"]
+JobStatus = Literal["queued", "running", "finished", "failed", "cancelled"]
+JobPriority = Literal["interactive", "bulk"]
+
+DONE_STATUSES = ("finished", "failed", "cancelled")
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is full."""
+    pass
+
+@dataclass
+class Job:
+    id: str
+    url: str
+    status: JobStatus = "queued"
+
+    created: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    started: datetime = None
+    finished: datetime = None
+
+    result: dict = None
+
+    key: str = None  # result cache key
+    cached: bool = False
+    priority: JobPriority = "interactive"
+
+    cancel_event: threading.Event = field(default=None, repr=False)
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+    drained: threading.Event = field(default_factory=threading.Event, repr=False)  # process mode
+
+    def to_dict(self) -> dict:
+        """
+        Get the job's status, without its result.
+        """
+        return {
+            "id": self.id,
+            "url": self.url,
+            "status": self.status,
+            "priority": self.priority,
+            "cached": self.cached,
+            "created": self.created.isoformat(),
+            "started": self.started.isoformat() if self.started else None,
+            "finished": self.finished.isoformat() if self.finished else None,
+        }
+
+def run_job(url: str, callback: Callable[[dict], None], cancel_event: threading.Event = None) -> dict:
+    """
+    Run a single analysis with its own detector.
+
+    Args:
+        url (str): The URL to analyze ("mock" replays the mocked pipe).
+        callback (Callable): Called with the serialized analysis on every update.
+        cancel_event (threading.Event): Stops the analysis before its next phase when set.
+
+    Returns:
+        dict: The serialized final analysis, or None if it was cancelled.
+    """
+    # Each job gets its own detector, so concurrent jobs never share a pipe
+    fnd = FakeNewsDetector(custom_logger=True)
+    fnd.register_callback(callback)
+    fnd.set_cancel_event(cancel_event)
+
+    if url == "mock":
+        logger.info("Using mock data for testing.")
+        mock.run_mocks(fnd, callback)
+        return fnd.get_serialized_analysis(fnd.get_pipe())
+
+    analysis = fnd.run(url)
+
+    if analysis is None:
+        return None
+
+    return fnd.serialize_analysis(analysis)
+
+def _init_process():
+    # Child processes don't inherit the parent's loguru sinks
+    debug.setup(skip_checks=True)
+
+def _run_job_in_process(job_id: str, url: str, events: "multiprocessing.Queue", cancel_event) -> dict:
+    try:
+        return run_job(url, lambda data: events.put((job_id, data)), cancel_event)
+    finally:
+        # Lets the parent know every update of the job has been queued
+        events.put((job_id, EVENTS_END))
+
+class JobScheduler:
+    """
+    Runs analyses on a pool of workers, in threads or in processes.
+
+    Jobs wait in bounded FIFO queues. Interactive jobs always run before bulk
+    ones, so large submissions don't hold up the UI. Submitting while a queue
+    is full raises QueueFullError, so callers can push back on their clients.
+    """
+    def __init__(self,
+                 workers: int = None,
+                 max_queue: int = None,
+                 max_bulk_queue: int = None,
+                 mode: WorkerMode = None,
+                 on_progress: Callable[[Job, dict], None] = None,
+                 on_finish: Callable[[Job], None] = None,
+                 cache: results.ResultCache = None):
+        self.workers = workers or int(os.getenv("BACKEND_WORKERS", DEFAULT_WORKERS))
+        self.max_queue = max_queue or int(os.getenv("BACKEND_MAX_QUEUE", DEFAULT_MAX_QUEUE))
+        self.max_bulk_queue = max_bulk_queue or int(os.getenv("BACKEND_MAX_BULK_QUEUE", DEFAULT_MAX_BULK_QUEUE))
+        self.retention = float(os.getenv("BACKEND_JOB_RETENTION", DEFAULT_JOB_RETENTION))
+        self.mode = mode or os.getenv("BACKEND_WORKER_MODE", "thread")
+        self.on_progress = on_progress
+        self.on_finish = on_finish
+        self.cache = cache or results.ResultCache()
+
+        assert self.mode in ("thread", "process"), f"Unknown worker mode: {self.mode}"
+
+        self.jobs: Dict[str, Job] = {}
+        self.pending: deque[Job] = deque()
+        self.bulk_pending: deque[Job] = deque()
+        self.running = 0
+
+        # Finished jobs, oldest first, to forget them after a while
+        self.done_jobs: deque[tuple[float, str]] = deque()
+        self.condition = threading.Condition()
+
+        # Unfinished jobs, by result cache key
+        self.inflight: Dict[str, Job] = {}
+
+        self.threads: List[threading.Thread] = []
+
+        self.pool: ProcessPoolExecutor = None
+        self.manager: "multiprocessing.managers.SyncManager" = None
+        self.events: "multiprocessing.Queue" = None
+
+    def start(self):
+        """
+        Start the workers.
+        """
+        if self.mode == "process":
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_process)
+            self.manager = multiprocessing.Manager()
+            self.events = self.manager.Queue()
+
+            # Forward progress from the child processes
+            pump = threading.Thread(target=self._pump_events, daemon=True)
+            pump.start()
+            self.threads.append(pump)
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        logger.info(f"Started {self.workers} {self.mode} workers (max queue: {self.max_queue}, bulk: {self.max_bulk_queue})")
+
+    def submit(self, url: str, priority: JobPriority = "interactive") -> Job:
+        """
+        Queue a new analysis.
+
+        Recent analyses of the same URL are reused, and submitting a URL that is
+        already queued or running returns the existing job.
+
+        Args:
+            url (str): The URL to analyze.
+            priority (JobPriority): "interactive" for the UI, "bulk" for large submissions.
+
+        Returns:
+            Job: The queued, running or (if cached) finished job.
+
+        Raises:
+            QueueFullError: If the queue is full.
+        """
+        key = self.cache.key(url)
+
+        cached = self.cache.get(key)
+        if key:
+            telemetry.cache_lookup("results", cached is not None)
+
+        if cached is not None:
+            now = datetime.now(timezone.utc)
+            job = Job(id=uuid.uuid4().hex, url=url, status="finished", created=now, started=now, finished=now,
+                      result=cached, key=key, cached=True, priority=priority)
+            job.done.set()
+
+            with self.condition:
+                self.jobs[job.id] = job
+                self.done_jobs.append((time.monotonic(), job.id))
+
+            logger.info(f"Reusing the cached analysis of {url} (job {job.id})")
+            return job
+
+        with self.condition:
+            job = self.inflight.get(key) if key else None
+            if job is not None:
+                logger.info(f"Attaching to job {job.id} for {url}")
+
+                # An interactive user shouldn't wait behind the bulk queue
+                if priority == "interactive" and job.priority == "bulk" and job.status == "queued":
+                    self.bulk_pending.remove(job)
+                    self.pending.append(job)
+                    job.priority = "interactive"
+                    logger.info(f"Moved job {job.id} to the interactive queue")
+
+                return job
+
+            queue, limit = self._queue(priority)
+            if len(queue) >= limit:
+                raise QueueFullError(f"The {priority} queue is full ({limit} jobs). Try again later.")
+
+            # Manager events can be shared with the worker processes
+            cancel_event = self.manager.Event() if self.manager else threading.Event()
+            job = Job(id=uuid.uuid4().hex, url=url, key=key, priority=priority, cancel_event=cancel_event)
+
+            self.jobs[job.id] = job
+            queue.append(job)
+            if key:
+                self.inflight[key] = job
+            self.condition.notify()
+
+        logger.info(f"Queued {priority} job {job.id} for {url}")
+
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """
+        Get a job by its ID.
+        """
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a job. Queued jobs are removed from the queue and running ones
+        stop before their next phase.
+
+        Returns:
+            bool: False if the job doesn't exist or has already finished.
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in DONE_STATUSES:
+                return False
+
+            if job.status == "running":
+                job.cancel_event.set()
+                logger.info(f"Cancelling running job {job.id}")
+                return True
+
+            queue, _ = self._queue(job.priority)
+            queue.remove(job)
+
+            job.status = "cancelled"
+            job.finished = datetime.now(timezone.utc)
+            self._done(job)
+
+        logger.info(f"Cancelled queued job {job.id}")
+        self._finish(job)
+
+        return True
+
+    def position(self, job_id: str) -> int:
+        """
+        Get the position of a job in the queue.
+
+        Returns:
+            int: 1 for the next job to run, 0 if the job is not queued.
+        """
+        with self.condition:
+            for i, job in enumerate(self.pending):
+                if job.id == job_id:
+                    return i + 1
+
+            for i, job in enumerate(self.bulk_pending):
+                if job.id == job_id:
+                    return len(self.pending) + i + 1
+        return 0
+
+    def positions(self) -> Dict[str, int]:
+        """
+        Get the position of every queued job, in a single pass over the queues.
+
+        Returns:
+            Dict[str, int]: The position of each queued job, by ID. 1 for the next job to run.
+        """
+        with self.condition:
+            queued = list(self.pending) + list(self.bulk_pending)
+        return {job.id: i + 1 for i, job in enumerate(queued)}
+
+    def queue_length(self) -> int:
+        return len(self.pending) + len(self.bulk_pending)
+
+    def active_jobs(self) -> int:
+        return self.running
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.bulk_pending:
+                    self.condition.wait()
+
+                job = self.pending.popleft() if self.pending else self.bulk_pending.popleft()
+                job.status = "running"
+                self.running += 1
+
+            job.started = datetime.now(timezone.utc)
+
+            logger.info(f"Running job {job.id}: {job.url}")
+
+            try:
+                if self.mode == "process":
+                    future = self.pool.submit(_run_job_in_process, job.id, job.url, self.events, job.cancel_event)
+                    job.result = future.result()
+                    
+                    # Updates from the child may arrive after the result, so
+                    # wait until they are forwarded before reporting the final state
+                    if not job.drained.wait(EVENTS_DRAIN_TIMEOUT):
+                        logger.warning(f"Job {job.id} may still get updates from its process")
+                    self._emit(job, job.result)
+                else:
+                    job.result = run_job(job.url, lambda data, job=job: self._emit(job, data), job.cancel_event)
+
+                if job.cancel_event.is_set():
+                    job.status = "cancelled"
+                else:
+                    job.status = "failed" if results.is_failed(job.result) else "finished"
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                job.status = "failed"
+            finally:
+                job.finished = datetime.now(timezone.utc)
+
+                if job.status == "finished":
+                    self.cache.put(job.key, job.result)
+
+                with self.condition:
+                    self.running -= 1
+                    self._done(job)
+
+            logger.info(f"Job {job.id} {job.status} in {job.finished - job.started}")
+            
+            self._finish(job)
+
+    def _queue(self, priority: JobPriority) -> tuple[deque, int]:
+        if priority == "bulk":
+            return self.bulk_pending, self.max_bulk_queue
+        return self.pending, self.max_queue
+
+    def _done(self, job: Job):
+        # Must hold the condition
+        if self.inflight.get(job.key) is job:
+            del self.inflight[job.key]
+
+        now = time.monotonic()
+        self.done_jobs.append((now, job.id))
+
+        # Forget the jobs nobody asked about for a while
+        while self.done_jobs and now - self.done_jobs[0][0] > self.retention:
+            _, job_id = self.done_jobs.popleft()
+            self.jobs.pop(job_id, None)
+
+    def _finish(self, job: Job):
+        job.done.set()
+
+        if self.on_finish:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                logger.error(f"Error while finishing job {job.id}: {e}")
+
+    def _pump_events(self):
+        while True:
+            job_id, data = self.events.get()
+
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+
+            if data == EVENTS_END:
+                job.drained.set()
+            else:
+                self._emit(job, data)
+
+    def _emit(self, job: Job, data: dict):
+        if data is None or not self.on_progress:
+            return
+
+        try:
+            self.on_progress(job, data)
+        except Exception as e:
+            logger.error(f"Error while reporting progress for job {job.id}: {e}")
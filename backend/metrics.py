@@ -0,0 +1,99 @@
+from fastapi import APIRouter, Response
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from typing import Iterator
+import prometheus_client as prom
+import os
+
+import jobs
+import progress
+
+JOB_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+JOBS = prom.Counter(
+    "fnd_jobs", "Finished jobs, by status and priority.",
+    ["status", "priority"],
+)
+JOB_DURATION = prom.Histogram(
+    "fnd_job_duration_seconds", "Time the jobs spent running.",
+    ["priority"], buckets=JOB_BUCKETS,
+)
+JOB_WAIT = prom.Histogram(
+    "fnd_job_queue_wait_seconds", "Time the jobs spent in the queue.",
+    ["priority"], buckets=JOB_BUCKETS,
+)
+
+def observe_job(job: jobs.Job):
+    """
+    Count a finished job. Reused analyses are counted by the "results" cache lookups.
+    """
+    JOBS.labels(job.status, job.priority).inc()
+
+    if job.started:
+        JOB_WAIT.labels(job.priority).observe((job.started - job.created).total_seconds())
+        if job.finished:
+            JOB_DURATION.labels(job.priority).observe((job.finished - job.started).total_seconds())
+
+class SchedulerCollector(Collector):
+    """
+    Gauges read from the scheduler and the progress hub on every scrape.
+    """
+    def __init__(self, scheduler: jobs.JobScheduler, hub: progress.ProgressHub = None):
+        self.scheduler = scheduler
+        self.hub = hub
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        scheduler = self.scheduler
+
+        queue = GaugeMetricFamily("fnd_queue_length", "Jobs waiting to run.", labels=["priority"])
+        queue.add_metric(["interactive"], len(scheduler.pending))
+        queue.add_metric(["bulk"], len(scheduler.bulk_pending))
+        yield queue
+
+        yield GaugeMetricFamily("fnd_active_jobs", "Jobs running.", value=scheduler.active_jobs())
+        yield GaugeMetricFamily("fnd_workers", "Size of the worker pool.", value=scheduler.workers)
+        yield GaugeMetricFamily("fnd_pool_utilization", "Share of the workers that are busy.",
+                                value=scheduler.active_jobs() / scheduler.workers if scheduler.workers else 0)
+        yield GaugeMetricFamily("fnd_inflight_urls", "URLs being analyzed or waiting.", value=len(scheduler.inflight))
+        yield GaugeMetricFamily("fnd_result_cache_entries", "Analyses in the result cache.", value=len(scheduler.cache.entries))
+
+        if self.hub is not None:
+            yield GaugeMetricFamily("fnd_subscribed_jobs", "Jobs with websocket clients.", value=len(self.hub.subscribers))
+
+def build_registry(scheduler: jobs.JobScheduler, hub: progress.ProgressHub = None) -> prom.CollectorRegistry:
+    """
+    Get the registry to serve.
+
+    With PROMETHEUS_MULTIPROC_DIR set (process workers), the metrics of every
+    process are read from that folder. Otherwise the default registry is used.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = prom.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prom.REGISTRY
+
+    registry.register(SchedulerCollector(scheduler, hub))
+    return registry
+
+def build_router(scheduler: jobs.JobScheduler, hub: progress.ProgressHub = None) -> APIRouter:
+    """
+    Build the /metrics route, in the Prometheus text format.
+
+    Args:
+        scheduler (JobScheduler): The scheduler to report on.
+        hub (ProgressHub): The websocket hub, if any.
+
+    Returns:
+        APIRouter: The route.
+    """
+    router = APIRouter(tags=["metrics"])
+    registry = build_registry(scheduler, hub)
+
+    @router.get("/metrics")
+    def metrics():
+        return Response(prom.generate_latest(registry), media_type=prom.CONTENT_TYPE_LATEST)
+
+    return router
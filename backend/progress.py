@@ -0,0 +1,186 @@
+from typing import Callable, Deque, Dict, Set, Tuple
+from collections import deque
+from loguru import logger
+from fastapi import WebSocket
+import threading
+import asyncio
+
+import protocol
+
+SUBSCRIBER_MAX_PENDING = 8  # messages waiting to be sent to a single client
+CLOSED_JOBS_MAX = 10000  # finished jobs remembered to drop their late updates
+
+class Subscriber:
+    """
+    A websocket client waiting for progress updates.
+
+    Messages are queued and sent by a single task on the server loop. If the
+    client can't keep up, the pending patches of the job are replaced by a single
+    snapshot, since patches are only valid on top of the previous version.
+    """
+    def __init__(self, websocket: WebSocket, max_pending: int = SUBSCRIBER_MAX_PENDING):
+        self.websocket = websocket
+        self.max_pending = max_pending
+        self.pending: Deque[Tuple[str, str]] = deque()
+        self.ready = asyncio.Event()
+        self.task: asyncio.Task = None
+        self.dropped = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self._send_loop())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def send(self, data: dict, job_id: str = None):
+        """
+        Queue a control message (queue position, errors...). Must be called from the server loop.
+        """
+        self.push(protocol.encode(data), job_id)
+
+    def push(self, message: str, job_id: str = None, resync: Callable[[], str] = None):
+        """
+        Queue an encoded message. Must be called from the server loop.
+
+        Args:
+            message (str): The encoded message.
+            job_id (str): The job the message belongs to.
+            resync (Callable): Builds a snapshot of the job, used instead of the
+                message when the client is falling behind.
+        """
+        if len(self.pending) >= self.max_pending and resync is not None:
+            # Coalesce: a snapshot supersedes every pending patch of the job
+            kept = deque(item for item in self.pending if item[0] != job_id)
+            self.dropped += len(self.pending) - len(kept)
+            self.pending = kept
+            message = resync() or message
+
+            logger.debug(f"Client {self.websocket.client} is slow. Dropped {self.dropped} updates so far.")
+
+        if len(self.pending) >= self.max_pending:
+            # Other jobs' patches. Their clients will ask for a resync
+            self.pending.popleft()
+            self.dropped += 1
+
+        self.pending.append((job_id, message))
+        self.ready.set()
+
+    async def _send_loop(self):
+        while True:
+            if not self.pending:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+
+            _, message = self.pending.popleft()
+
+            try:
+                await self.websocket.send_text(message)
+            except Exception as e:
+                logger.error(f"Error while sending status to client: {e}")
+                return
+
+class ProgressHub:
+    """
+    Routes progress updates from the worker threads to the clients that
+    submitted each job, as versioned patches.
+    """
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop = None
+        self.subscribers: Dict[str, Set[Subscriber]] = {}
+
+        self.streams: Dict[str, protocol.ProgressStream] = {}
+        self.streams_lock = threading.Lock()
+
+        # Finished jobs, oldest first. Late updates must not recreate their streams
+        self.closed: Set[str] = set()
+        self.closed_order: Deque[str] = deque()
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """
+        Set the server loop that owns the websockets.
+        """
+        self.loop = loop
+
+    def subscribe(self, job_id: str, subscriber: Subscriber):
+        self.subscribers.setdefault(job_id, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        for job_id in list(self.subscribers):
+            self.subscribers[job_id].discard(subscriber)
+
+            if not self.subscribers[job_id]:
+                del self.subscribers[job_id]
+
+    def resync(self, job_id: str, subscriber: Subscriber, state: dict = None):
+        """
+        Send the latest snapshot of a job and keep the client subscribed to it.
+        Must be called from the server loop.
+
+        Args:
+            job_id (str): The job to resync.
+            subscriber (Subscriber): The (possibly reconnected) client.
+            state (dict): The final analysis, for jobs that have already finished.
+        """
+        if state is not None:
+            subscriber.push(protocol.snapshot(job_id, 0, state), job_id)
+            return
+
+        self.subscribe(job_id, subscriber)
+
+        with self.streams_lock:
+            stream = self.streams.get(job_id)
+
+        # Queued jobs have nothing to show yet
+        message = stream.snapshot() if stream else None
+        if message:
+            subscriber.push(message, job_id)
+
+    def publish(self, job_id: str, data: dict):
+        """
+        Send an update to every subscriber of a job. Safe to call from any thread.
+        """
+        if self.loop is None:
+            logger.warning("Progress hub is not bound to a loop. Dropping update.")
+            return
+
+        with self.streams_lock:
+            if job_id in self.closed:
+                logger.debug(f"Dropping an update of finished job {job_id}.")
+                return
+
+            stream = self.streams.setdefault(job_id, protocol.ProgressStream(job_id))
+
+        # Diff and schedule under the same lock, so versions are delivered in order
+        with stream.lock:
+            message = stream.update(data)
+
+            if message is not None:
+                self.loop.call_soon_threadsafe(self._deliver, job_id, message, stream.snapshot)
+
+    def close(self, job_id: str):
+        """
+        Forget a job's state and subscribers once it has finished. Safe to call from any thread.
+        """
+        with self.streams_lock:
+            self.streams.pop(job_id, None)
+
+            if job_id not in self.closed:
+                self.closed.add(job_id)
+                self.closed_order.append(job_id)
+                if len(self.closed_order) > CLOSED_JOBS_MAX:
+                    self.closed.discard(self.closed_order.popleft())
+
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.subscribers.pop, job_id, None)
+
+    def _deliver(self, job_id: str, message: str, resync: Callable[[], str]):
+        subscribers = self.subscribers.get(job_id)
+
+        if not subscribers:
+            logger.debug(f"No clients subscribed to job {job_id}.")
+            return
+
+        for subscriber in subscribers:
+            subscriber.push(message, job_id, resync)
@@ -0,0 +1,139 @@
+from typing import Any, List
+import threading
+import orjson
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def encode(message: dict) -> str:
+    """
+    Serialize a message for the websocket.
+
+    Args:
+        message (dict): The message to serialize.
+
+    Returns:
+        str: The JSON text.
+    """
+    return orjson.dumps(message, option=ORJSON_OPTIONS).decode("utf-8")
+
+def _escape(key: str) -> str:
+    # JSON pointer escaping (RFC 6901)
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+def diff(old: Any, new: Any, path: str = "") -> List[dict]:
+    """
+    Compute the JSON-patch operations that turn one value into another.
+
+    Dicts are compared key by key and lists that only grew get "add" operations
+    for the new items, so the usual updates (a new phase, a new search result)
+    are a handful of small operations instead of the whole analysis.
+
+    Args:
+        old (Any): The previous value.
+        new (Any): The current value.
+        path (str): The JSON pointer of the values.
+
+    Returns:
+        List[dict]: The operations, empty if both values are equal.
+    """
+    if old is new or old == new:
+        return []
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+            else:
+                ops.extend(diff(old[key], value, f"{path}/{_escape(key)}"))
+
+        return ops
+
+    if isinstance(old, list) and isinstance(new, list) and len(new) >= len(old):
+        ops = []
+        for i, (a, b) in enumerate(zip(old, new)):
+            ops.extend(diff(a, b, f"{path}/{i}"))
+
+        for value in new[len(old):]:
+            ops.append({"op": "add", "path": f"{path}/-", "value": value})
+
+        return ops
+
+    return [{"op": "replace", "path": path, "value": new}]
+
+def snapshot(job_id: str, version: int, data: dict) -> str:
+    """
+    Build a full snapshot message.
+    """
+    return encode({"type": "snapshot", "job_id": job_id, "version": version, "data": data})
+
+def patch(job_id: str, version: int, ops: List[dict]) -> str:
+    """
+    Build a patch message, which applies on top of the previous version.
+    """
+    return encode({"type": "patch", "job_id": job_id, "version": version, "base": version - 1, "ops": ops})
+
+class ProgressStream:
+    """
+    The versioned state of a job, as seen by its clients.
+
+    Every update is turned into a patch against the previous state. Clients
+    that miss a patch (slow or reconnecting) ask for a snapshot instead.
+    """
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.version = 0
+        self.state: dict = None
+        self.lock = threading.Lock()
+
+    def update(self, data: dict) -> str | None:
+        """
+        Move to a new state. The caller must hold the lock.
+
+        Args:
+            data (dict): The serialized analysis.
+
+        Returns:
+            str | None: The message for the clients, None if nothing changed.
+        """
+        if self.state is None:
+            self.version += 1
+            self.state = data
+            return snapshot(self.job_id, self.version, data)
+
+        ops = diff(self.state, data)
+        if not ops:
+            return None
+
+        self.version += 1
+        self.state = data
+
+        return patch(self.job_id, self.version, ops)
+
+    def snapshot(self) -> str | None:
+        """
+        Get the current state as a snapshot message.
+        """
+        with self.lock:
+            if self.state is None:
+                return None
+
+            return snapshot(self.job_id, self.version, self.state)
+
+if __name__ == "__main__":
+    def test_diff():
+        old = {"phase": "search", "summary": "A", "search_results": [{"url": "a"}]}
+        new = {"phase": "process_search", "summary": "A", "search_results": [{"url": "a"}, {"url": "b"}]}
+
+        ops = diff(old, new)
+        assert ops == [
+            {"op": "replace", "path": "/phase", "value": "process_search"},
+            {"op": "add", "path": "/search_results/-", "value": {"url": "b"}},
+        ], ops
+        assert diff(new, new) == []
+        print("Diff test passed")
+    #test_diff()
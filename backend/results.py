@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from typing import Tuple
+from loguru import logger
+import threading
+import hashlib
+import time
+import os
+
+from fake_news_detector import utils
+
+RESULT_CACHE_VERSION = "1"  # bump when the pipeline changes its results
+DEFAULT_RESULT_TTL = 6 * 60 * 60  # seconds
+DEFAULT_RESULT_CACHE_SIZE = 1000  # analyses
+
+# Settings that change the outcome of an analysis
+CONFIG_ENV = (
+    "PDF_MODEL", "PDF_SERVICE",
+    "TEXT_MODEL", "TEXT_SERVICE",
+    "EMBEDDINGS_MODEL", "EMBEDDINGS_SERVICE",
+)
+
+def config_version() -> str:
+    """
+    Get a short hash of the models and pipeline version in use.
+    """
+    config = [RESULT_CACHE_VERSION] + [os.getenv(name, "") for name in CONFIG_ENV]
+    return hashlib.blake2b("|".join(config).encode("utf-8"), digest_size=8).hexdigest()
+
+def is_cacheable(result: dict) -> bool:
+    """
+    Only complete analyses are reused. Errors may be transient.
+    """
+    return bool(result) and not result.get("error") and not result.get("exception")
+
+def is_failed(result: dict) -> bool:
+    """
+    Check if an analysis ended without a verdict: no result, an error, an exception or a refusal of the model.
+    """
+    return not result or any(result.get(field) for field in ("error", "exception", "refusal"))
+
+class ResultCache:
+    """
+    Completed analyses, by cleaned URL and configuration, kept for a freshness window.
+    """
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("RESULT_CACHE_TTL", DEFAULT_RESULT_TTL))
+        self.max_entries = max_entries or int(os.getenv("RESULT_CACHE_SIZE", DEFAULT_RESULT_CACHE_SIZE))
+        self.version = config_version()
+
+        self.entries: OrderedDict[str, Tuple[float, dict]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, url: str) -> str | None:
+        """
+        Get the cache key of a URL.
+
+        Returns:
+            str | None: The key, or None if the URL can't be cached (mocks, invalid URLs).
+        """
+        if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+            return None
+
+        return f"{self.version}:{utils.clean_url(url.strip()).rstrip('/')}"
+
+    def get(self, key: str) -> dict | None:
+        """
+        Get a fresh analysis, if any.
+        """
+        if key is None or self.ttl <= 0:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            stored, result = entry
+            if time.monotonic() - stored > self.ttl:
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+
+        logger.debug(f"Result cache hit for {key}")
+        return result
+
+    def put(self, key: str, result: dict):
+        """
+        Store a completed analysis.
+        """
+        if key is None or self.ttl <= 0 or not is_cacheable(result):
+            return
+
+        with self.lock:
+            self.entries[key] = (time.monotonic(), result)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
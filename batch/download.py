@@ -1,8 +1,14 @@
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, Future, wait
+from collections import Counter
+from datetime import datetime, timedelta
+import multiprocessing
+import threading
 import argparse
 from loguru import logger
 import pickle
-from typing import Tuple, List
+import signal
+import time
+from typing import Callable, Dict, Tuple, List
 import os
 
 # # Add the library
@@ -10,7 +16,10 @@ import sys
 sys.path.append("libreria/")
 
 from fake_news_detector import FakeNewsDetector
-from fake_news_detector import utils, debug
+from fake_news_detector import utils, debug, network, usage
+
+import manifest
+import sink
 
 URL_FILENAME_MAX = 80
 
@@ -24,11 +33,18 @@ ERROR_PATH = "error/"
 REFUSAL_PATH = "refusal/"
 EXCEPTION_PATH = "exception/"
 
-success_count = 0
-error_count = 0
-refusal_count = 0
-exception_count = 0
-skip_count = 0
+OUTCOMES = ["success", "error", "refusal", "exception", "skipped", "interrupted"]
+
+# Exceptions worth resuming the analysis for: rate limits, timeouts, dropped
+# connections... The completed phases (scrape, parse...) are not redone
+TRANSIENT_ERRORS = (
+    "RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError",
+    "ServerError", "RetryError", "ResourceExhausted", "ServiceUnavailable",
+    "Timeout", "ReadTimeout", "ConnectTimeout", "ConnectionError",
+)
+TRANSIENT_MARKERS = ("429", "RESOURCE_EXHAUSTED", "rate limit")
+MAX_RESUMES = 2
+RESUME_BACKOFF = 30  # seconds, doubled on every attempt
 
 TXT_BASE = """\
 Batch Analysis Results
@@ -41,7 +57,57 @@ Skip: {skip}
 
 Total: {total}"""
 
-fnd = None
+# One detector per process, so clients are only initialized once
+fnd: FakeNewsDetector = None
+
+class BatchStats:
+    """
+    Outcome counts and throughput of a batch. Safe to update from several threads.
+    """
+    def __init__(self, total: int):
+        self.total = total
+        self.counts = Counter()
+        self.cost = 0.0  # USD, of the analyses whose models have a price
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, outcome: str, cost: float = None):
+        with self.lock:
+            self.counts[outcome] += 1
+            self.cost += cost or 0
+
+    def done(self) -> int:
+        return sum(self.counts.values())
+
+    def report(self) -> str:
+        """
+        Get a one-line progress summary.
+        """
+        with self.lock:
+            done = self.done()
+            analyzed = done - self.counts["skipped"]
+            counts = ", ".join(f"{o}: {self.counts[o]}" for o in OUTCOMES if self.counts[o])
+
+        elapsed = time.monotonic() - self.start
+        rate = analyzed / elapsed * 60 if elapsed > 0 else 0  # URLs/min
+
+        eta = "?"
+        if rate > 0:
+            eta = str(timedelta(seconds=int((self.total - done) / rate * 60)))
+
+        cost = f"${self.cost:.2f}"
+        if self.cost > 0:
+            cost += f" ({self.counts['success'] / self.cost:.1f} successes/$)"
+
+        return f"Progress: {done}/{self.total} ({done / self.total:.0%}) | {rate:.1f} URLs/min | ETA {eta} | {cost} | {counts}"
+
+def get_detector() -> FakeNewsDetector:
+    global fnd
+
+    if fnd is None:
+        fnd = FakeNewsDetector(custom_logger=True)
+
+    return fnd
 
 def limit_path(path: str, max_length: int = URL_FILENAME_MAX) -> str:
     """
@@ -51,47 +117,109 @@ def limit_path(path: str, max_length: int = URL_FILENAME_MAX) -> str:
         return path[:max_length]
     return path
 
-def search_url(url: str) -> bool:
-    for dir in [SUCCESS_PATH, ERROR_PATH, REFUSAL_PATH, EXCEPTION_PATH]:
-        if os.path.exists(os.path.join(RESULTS_PATH, dir, limit_path(utils.url_to_filepath(url)) + PIPE_EXT)):
-            return True
+def result_filename(url: str) -> str:
+    """
+    Get a readable file name for a URL. The hash keeps long URLs that share
+    a prefix from overwriting each other.
+    """
+    return limit_path(utils.url_to_filepath(url)) + "_" + manifest.url_hash(url)[:16]
 
-def analyze(url: str, position: Tuple[int, int] = None):
+def is_transient(pipe) -> bool:
     """
-    Analyze the news article at the given URL.
+    Check if an analysis failed for a reason that may go away by itself.
     """
-    global success_count, error_count, refusal_count, exception_count, fnd,  skip_count
+    if not pipe.exception:
+        return False
     
+    name = (sink.error_class(pipe) or "").rsplit(".", 1)[-1]
+    message = pipe.exception.strip().splitlines()[-1] if pipe.exception.strip() else ""
+    
+    return name in TRANSIENT_ERRORS or any(marker in message for marker in TRANSIENT_MARKERS)
+
+def usage_columns(records: list) -> dict:
+    """
+    Add up the tokens and cost of some usage records into the manifest columns.
+    """
+    columns = {}
+    for role in ["pdf", "text"]:
+        totals = usage.summarize(records, role=role)
+        columns[f"{role}_input_tokens"] = totals["input_tokens"]
+        columns[f"{role}_output_tokens"] = totals["output_tokens"]
+        columns[f"{role}_cached_tokens"] = totals["cached_tokens"]
+
+    columns["embeddings_tokens"] = usage.summarize(records, role="embeddings")["input_tokens"]
+    columns["cost"] = usage.summarize(records)["cost"]
+    return columns
+
+def load_pipe(path: str):
+    """
+    Load the pipe of a previous attempt, if it is still there.
+    """
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        logger.warning(f"Could not load the previous pipe at {path}: {e}")
+        return None
+
+def analyze(url: str, position: Tuple[int, int] = None, resume_from: str = None) -> dict:
+    """
+    Analyze the news article at the given URL.
+    
+    Args:
+        url (str): The article.
+        position (Tuple[int, int]): Its index and the batch size, for the logs.
+        resume_from (str): The pipe of a failed attempt, to continue from its last completed phase.
+    
+    Returns:
+        dict: The manifest entry, with the outcome (one of OUTCOMES) as its status.
+    """
     index_str = ""
     if position:
         index_str = f"[{position[0]}/{position[1]}] "
         
     logger.info("-"*50)
     
-    url_file = limit_path(utils.url_to_filepath(url))
-    
-    if search_url(url):
-        logger.info(index_str + f"Already analyzed. Skipping: {url}")
-        skip_count += 1
-        return "skipped"
+    url_file = result_filename(url)
     
+    entry = {
+        "url_hash": manifest.url_hash(url),
+        "url": url,
+        "status": "interrupted",
+        "started": datetime.now().isoformat(),
+    }
     
     logger.info(index_str + f"Analyzing URL: {url}")
     
     result = None
-    fnd = FakeNewsDetector(custom_logger=True)
+    first = 0  # usage records of the previous attempt, already written by it
+    fnd = get_detector()
     try:
+        previous = load_pipe(resume_from) if resume_from else None
+        if previous is not None:
+            first = len(getattr(previous, "usage", None) or [])
         
-        result = fnd.run(url)
+        result = fnd.resume(previous) if previous else fnd.run(url)
+        
+        # Retry transient failures from the phase that failed
+        attempt = 0
+        while result is not None and is_transient(fnd.get_pipe()) and attempt < MAX_RESUMES:
+            attempt += 1
+            delay = RESUME_BACKOFF * 2 ** (attempt - 1)
+            
+            logger.warning(index_str + f"Transient failure in {fnd.get_pipe().phase}. Resuming in {delay}s ({attempt}/{MAX_RESUMES})...")
+            time.sleep(delay)
+            
+            result = fnd.resume(fnd.get_pipe())
         
         if result is None:
             logger.warning(index_str + "Stopping...")
-            return "interrupted"
+            return entry
     except Exception as e:
         logger.error(index_str + f"Analysis exception: {e}")
     finally:
         if result is None:
-            return "interrupted"
+            return entry
         
         pipe = fnd.get_pipe()
         
@@ -99,22 +227,22 @@ def analyze(url: str, position: Tuple[int, int] = None):
         if pipe.error:
             final_path = os.path.join(RESULTS_PATH, ERROR_PATH)
             logger.info(index_str + f"Analysis failed with error.")
-            error_count += 1
+            outcome = "error"
             
         elif pipe.refusal:
             final_path = os.path.join(RESULTS_PATH, REFUSAL_PATH)
             logger.info(index_str + f"Analysis failed with refusal.")
-            refusal_count += 1
+            outcome = "refusal"
             
         elif pipe.exception:
             final_path = os.path.join(RESULTS_PATH, EXCEPTION_PATH)
             logger.info(index_str + f"Analysis failed with exception.")
-            exception_count += 1
+            outcome = "exception"
             
         else:
             final_path = os.path.join(RESULTS_PATH, SUCCESS_PATH)
             logger.info(index_str + f"Analysis completed successfully.")
-            success_count += 1
+            outcome = "success"
             
         # Success
         pipe_path = os.path.join(final_path, url_file + PIPE_EXT)
@@ -133,36 +261,154 @@ def analyze(url: str, position: Tuple[int, int] = None):
         logger.debug(index_str + f"Analysis saved to: {analysis_path}")
         logger.debug(index_str + f"Pipe saved to: {pipe_path}")
         
-        return "ok"
+        # The files of the previous attempt, if it ended in another folder
+        if resume_from and os.path.abspath(resume_from) != os.path.abspath(pipe_path):
+            stale_analysis = resume_from[:-len(PIPE_EXT)] + ANALYSIS_EXT if resume_from.endswith(PIPE_EXT) else None
+            for stale in [resume_from, stale_analysis]:
+                if stale and os.path.exists(stale):
+                    os.remove(stale)
+            logger.debug(index_str + f"Removed the previous attempt at: {resume_from}")
+        
+        entry.update({
+            "status": outcome,
+            "path": pipe_path,
+            "finished": datetime.now().isoformat(),
+            "elapsed": getattr(pipe, "elapsed", None),
+            # Only this attempt, so retried URLs aren't counted twice
+            **usage_columns((getattr(pipe, "usage", None) or [])[first:]),
+        })
+        
+        # Columnar copy of the results, written by the parent
+        entry["row"] = sink.pipe_to_row(pipe, entry)
+        entry["embeddings"] = sink.pipe_to_embeddings(pipe, entry["url_hash"])
+        entry["usage"] = sink.pipe_to_usage(pipe, entry["url_hash"], first)
+        
+        return entry
+
+def _init_worker(results_path: str):
+    global RESULTS_PATH
+    RESULTS_PATH = results_path
+    
+    # The parent handles Ctrl-C, so running analyses can finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    debug.setup(log_file=os.path.join(results_path, f"worker-{os.getpid()}.log"), skip_checks=True)
     
-def analyze_batch(urls):
+    # Initialize the clients before the first URL arrives, so its latency
+    # doesn't include them. If it fails, the first analysis tries again
+    try:
+        get_detector().init()
+    except Exception as e:
+        logger.warning(f"Could not initialize the detector: {e}")
+
+def analyze_parallel(urls: List[str], workers: int, stats: BatchStats, on_entry: Callable[[dict], None], resume: Dict[str, str] = None):
     """
-    Analyze a batch of news articles at the given URLs.
+    Analyze the URLs on a pool of processes, each one with its own detector.
+    Failed attempts in resume (URL to pipe path) continue where they stopped.
+    
+    The first Ctrl-C stops queuing new URLs and waits for the running ones,
+    the second one stops right away.
     """
-    global success_count, error_count, refusal_count, exception_count
+    total = len(urls)
+    
+    def on_done(future: Future):
+        if future.cancelled():
+            return
+        
+        try:
+            entry = future.result()
+        except Exception as e:
+            logger.error(f"Worker failed: {e}")
+            return
+        
+        on_entry(entry)
+    
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(RESULTS_PATH,))
+    
+    futures = []
+    for i, url in enumerate(urls):
+        future = pool.submit(analyze, url, (i + 1, total), (resume or {}).get(url))
+        future.add_done_callback(on_done)
+        futures.append(future)
     
+    try:
+        wait(futures)
+        pool.shutdown()
+    except KeyboardInterrupt:
+        logger.warning("Interrupted. Waiting for the running analyses to finish (Ctrl-C again to stop now)...")
+        
+        try:
+            pool.shutdown(wait=True, cancel_futures=True)
+        except KeyboardInterrupt:
+            logger.warning("Stopping now.")
+            
+            pool.shutdown(wait=False, cancel_futures=True)
+            for child in multiprocessing.active_children():
+                child.terminate()
+    
+def analyze_batch(urls: List[str], workers: int = 1, retry_errors: bool = False):
+    """
+    Analyze a batch of news articles at the given URLs, skipping the ones the
+    manifest already has.
+    """
     total = len(urls)
-    logger.info(f"Starting batch analysis of {total} URLs...")
     
     start_time = datetime.now()
+    stats = BatchStats(total)
     
-    for i, url in enumerate(urls):
-        result = analyze(url, position=(i + 1, total))
+    # The manifest rows are committed with the Parquet files, so a crash
+    # doesn't leave analyses marked as done without their results
+    runs = manifest.Manifest(RESULTS_PATH)
+    dataset = sink.ResultsSink(RESULTS_PATH, on_flush=runs.commit)
+    
+    pending = runs.pending(urls, retry_errors=retry_errors)
+    stats.counts["skipped"] = total - len(pending)
+    urls = pending
+    
+    # Retried URLs continue from their last completed phase
+    resume = runs.failed_paths(urls) if retry_errors else {}
+    
+    logger.info(f"Starting batch analysis of {len(urls)} URLs ({stats.counts['skipped']} already analyzed) with {workers} worker(s)...")
+    
+    def on_entry(entry: dict):
+        if entry["status"] == "interrupted":
+            return
         
-        if result == "interrupted":
-            logger.warning("Batch analysis interrupted.")
-            break
+        runs.record(entry, commit=False)
+        dataset.add(entry["row"], entry["embeddings"], entry["usage"])
+        stats.add(entry["status"], entry.get("cost"))
+        logger.info(stats.report())
+    
+    # Resolve every article's domain up front to warm the DNS cache
+    # (inherited by the worker processes)
+    network.RESOLVER.resolve_many_sync(utils.get_domain(url) for url in urls)
+    
+    if workers > 1:
+        analyze_parallel(urls, workers, stats, on_entry, resume)
+    else:
+        for i, url in enumerate(urls):
+            entry = analyze(url, position=(i + 1, len(urls)), resume_from=resume.get(url))
+            
+            if entry["status"] == "interrupted":
+                logger.warning("Batch analysis interrupted.")
+                break
+            
+            on_entry(entry)
+    
+    dataset.close()
+    runs.close()
             
     # Save results to txt
+    counts = stats.counts
     results_path = RESULTS_PATH + "results.txt"
     with open(results_path, "w") as f:
         f.write(TXT_BASE.format(
-            success=success_count,
-            error=error_count,
-            refusal=refusal_count,
-            exception=exception_count,
+            success=counts["success"],
+            error=counts["error"],
+            refusal=counts["refusal"],
+            exception=counts["exception"],
             total=total,
-            skip=skip_count
+            skip=counts["skipped"]
         ))
         
     elapsed_time = datetime.now() - start_time
@@ -171,10 +417,11 @@ def analyze_batch(urls):
     logger.success("Finished analyzing batch.")
     logger.info(f"Results saved to: {results_path}")
     logger.info("")
-    logger.info(f"Success: {success_count}")
-    logger.info(f"Error: {error_count}")
-    logger.info(f"Refusal: {refusal_count}")
-    logger.info(f"Exception: {exception_count}")
+    logger.info(f"Success: {counts['success']}")
+    logger.info(f"Error: {counts['error']}")
+    logger.info(f"Refusal: {counts['refusal']}")
+    logger.info(f"Exception: {counts['exception']}")
+    logger.info(f"Skip: {counts['skipped']}")
     logger.info(f"Total: {total}")
     logger.info("")
     logger.info(f"Time elapsed: {elapsed_time_str}")
@@ -186,6 +433,8 @@ def main():
     parser.add_argument("-f", "--file", required=False, help="Path to file containing URLs (one per line)")
     parser.add_argument("-u", "--url", required=False, help="URL or file to analyze")
     parser.add_argument("-n", "--name", required=False, help="Name of the analysis")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--retry-errors", action="store_true", help="Analyze again the URLs that ended in an error or exception")
     args = parser.parse_args()
     
     if args.name:
@@ -204,7 +453,7 @@ def main():
     if args.url:
         url = args.url
     
-        analyze(url)
+        analyze_batch([url], retry_errors=args.retry_errors)
     if args.file:
         file = args.file
         
@@ -222,7 +471,7 @@ def main():
             logger.error("No URLs found in the file.")
             return
         
-        analyze_batch(urls)
+        analyze_batch(urls, workers=args.workers, retry_errors=args.retry_errors)
         
 if __name__ == "__main__":
     main()
\ No newline at end of file
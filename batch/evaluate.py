@@ -0,0 +1,269 @@
+from datetime import datetime
+from typing import Dict
+from loguru import logger
+import argparse
+import json
+import csv
+import os
+
+import pandas as pd
+
+# # Add the library
+import sys
+sys.path.append("libreria/")
+
+from fake_news_detector import debug
+
+import download
+import manifest
+import sink
+
+LABELS = ["True", "Fake"]
+PREDICTIONS = ["True", "Fake", "Unknown"]  # Unknown: not analyzed, error, refusal...
+
+PERCENTILES = [50, 90, 99]
+
+TOKEN_COLUMNS = [
+    "pdf_input_tokens", "pdf_output_tokens", "text_input_tokens", "text_output_tokens",
+    "pdf_cached_tokens", "text_cached_tokens", "embeddings_tokens",
+]
+CACHED_COLUMNS = ["pdf_cached_tokens", "text_cached_tokens"]  # Already counted in the input tokens
+
+EVALUATION_FILENAME = "evaluation.json"
+
+RUN_PATH = download.RESULTS_PATH  # batch/results/{name}/
+
+def _ratio(a: float, b: float) -> float | None:
+    return a / b if b else None
+
+def normalize_url(url: str) -> str | None:
+    """
+    Add the missing scheme to dataset URLs, and drop empty ones.
+    """
+    url = url.strip()
+    if not url or url.lower() == "nan":
+        return None
+
+    if not url.startswith(("http://", "https://")):
+        url = "http://" + url
+
+    return url
+
+def load_labels(path: str) -> pd.DataFrame:
+    """
+    Load a labelled dataset.
+
+    Supports the "url,...,label" files (FakeNewsCorpusSpanish splits,
+    FakeNewsDatasetGerman) and the FakeNewsNet CSVs, where the label comes
+    from the file name (politifact_fake.csv).
+
+    Returns:
+        pd.DataFrame: The url and label (True/Fake) columns, without duplicates.
+    """
+    # FakeNewsNet has huge tweet ID columns
+    csv.field_size_limit(sys.maxsize)
+
+    rows = []
+    with open(path, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+
+        if header and "news_url" in header:
+            column = header.index("news_url")
+            label = "Fake" if "fake" in os.path.basename(path) else "True"
+
+            rows = [(row[column], label) for row in reader if len(row) > column]
+        else:
+            for row in ([header] if header else []) + list(reader):
+                if len(row) >= 2 and row[-1] in LABELS:
+                    rows.append((row[0], row[-1]))
+
+    labels = pd.DataFrame(rows, columns=["url", "label"])
+    labels["url"] = labels["url"].map(normalize_url)
+
+    return labels.dropna().drop_duplicates("url").reset_index(drop=True)
+
+def predict(results: pd.DataFrame) -> pd.Series:
+    """
+    Turn the analyses into True/Fake/Unknown predictions.
+    """
+    prediction = results["verified"].map({True: "True", False: "Fake"})
+    prediction[results["status"] != "success"] = None
+
+    return prediction.fillna("Unknown")
+
+def evaluate(results_path: str, labels: pd.DataFrame) -> Dict:
+    """
+    Compute the accuracy, latency, throughput, token and cost metrics of a run.
+
+    Args:
+        results_path (str): The run folder.
+        labels (pd.DataFrame): The expected labels.
+
+    Returns:
+        Dict: The report.
+    """
+    results = sink.load(results_path)
+    results = results.reindex(columns=results.columns.union(TOKEN_COLUMNS + ["cost"], sort=False))
+
+    labels = labels.assign(url_hash=labels["url"].map(manifest.url_hash))
+    df = labels.merge(results.drop(columns=["url"]), on="url_hash", how="left")
+    df["prediction"] = predict(df)
+
+    confusion = (
+        pd.crosstab(df["label"], df["prediction"])
+        .reindex(index=LABELS, columns=PREDICTIONS, fill_value=0)
+    )
+
+    # Accuracy over the answered articles. Coverage tells how many those are
+    answered = df[df["prediction"] != "Unknown"]
+    tp = int(confusion.loc["Fake", "Fake"])
+    fp = int(confusion.loc["True", "Fake"])
+    fn = int(confusion.loc["Fake", "True"])
+
+    precision = _ratio(tp, tp + fp)
+    recall = _ratio(tp, tp + fn)
+    f1 = _ratio(2 * precision * recall, precision + recall) if precision and recall else None
+
+    analyzed = df[df["status"].notna()]
+
+    latency = {}
+    for column in ["elapsed"] + [f"time_{phase}" for phase in sink.PHASES]:
+        values = analyzed[column].dropna()
+        if values.empty:
+            continue
+
+        name = column.removeprefix("time_")
+        latency[name] = {f"p{p}": float(values.quantile(p / 100)) for p in PERCENTILES}
+
+    # Wall-clock throughput, including the parallelism of the run
+    span = (analyzed["finished"].max() - analyzed["started"].min()).total_seconds() if not analyzed.empty else 0
+    urls_per_minute = _ratio(len(analyzed) * 60, span)
+
+    tokens = {column: float(analyzed[column].fillna(0).mean()) for column in TOKEN_COLUMNS} if not analyzed.empty else {}
+    tokens["total"] = sum(value for column, value in tokens.items() if column not in CACHED_COLUMNS)
+
+    usage = sink.load_usage(results_path)
+    usage = usage[usage["url_hash"].isin(analyzed["url_hash"])]
+
+    # Estimated from usage.PRICES. Models without a price don't add up.
+    # The results only have the last attempt of every URL, the usage has all of them
+    total_cost = float((usage if not usage.empty else analyzed)["cost"].fillna(0).sum())
+    correct = int((answered["label"] == answered["prediction"]).sum())
+    phases = {
+        phase: {
+            "calls": int(len(group)),
+            "input_tokens": int(group["input_tokens"].sum()),
+            "output_tokens": int(group["output_tokens"].sum()),
+            "cached_tokens": int(group["cached_tokens"].sum()),
+            "cost": float(group["cost"].fillna(0).sum()),
+        }
+        for phase, group in usage.groupby(usage["phase"].fillna("-"))
+    }
+
+    return {
+        "results_path": results_path,
+        "articles": len(df),
+        "analyzed": len(analyzed),
+        "statuses": analyzed["status"].value_counts().to_dict(),
+        "confusion": {label: confusion.loc[label].astype(int).to_dict() for label in LABELS},
+        "coverage": _ratio(len(answered), len(df)),
+        "accuracy": _ratio(correct, len(answered)),
+        "precision_fake": precision,
+        "recall_fake": recall,
+        "f1_fake": f1,
+        "latency": latency,
+        "urls_per_minute": urls_per_minute,
+        "tokens_per_article": tokens,
+        "total_cost": total_cost,
+        "cost_per_article": _ratio(total_cost, len(analyzed)),
+        "urls_per_dollar": _ratio(len(analyzed), total_cost),
+        "correct_per_dollar": _ratio(correct, total_cost),
+        "usage_per_phase": phases,
+    }
+
+def _fmt(value, pattern: str = "{:.3f}") -> str:
+    return "-" if value is None else pattern.format(value)
+
+def print_report(report: Dict, baseline: Dict = None):
+    """
+    Log a report, with the change from a baseline if given.
+    """
+    def delta(key: str) -> str:
+        if not baseline or report.get(key) is None or baseline.get(key) is None:
+            return ""
+        return f" ({report[key] - baseline[key]:+.3f})"
+
+    logger.info(f"Articles: {report['articles']} (analyzed: {report['analyzed']}, {report['statuses']})")
+    logger.info("")
+    logger.info(f"{'':>8} " + " ".join(f"{p:>8}" for p in PREDICTIONS))
+    for label in LABELS:
+        logger.info(f"{label:>8} " + " ".join(f"{report['confusion'][label][p]:>8}" for p in PREDICTIONS))
+    logger.info("")
+
+    for key in ["coverage", "accuracy", "precision_fake", "recall_fake", "f1_fake", "urls_per_minute",
+                "total_cost", "cost_per_article", "urls_per_dollar", "correct_per_dollar"]:
+        logger.info(f"{key}: {_fmt(report[key])}{delta(key)}")
+
+    logger.info("")
+    logger.info(f"{'phase':>18} " + " ".join(f"{'p' + str(p):>8}" for p in PERCENTILES))
+    for name, values in report["latency"].items():
+        logger.info(f"{name:>18} " + " ".join(f"{values[f'p{p}']:>8.2f}" for p in PERCENTILES))
+
+    logger.info("")
+    for key, value in report["tokens_per_article"].items():
+        logger.info(f"tokens/article {key}: {value:.0f}")
+
+    if report.get("usage_per_phase"):
+        logger.info("")
+        logger.info(f"{'phase':>18} {'calls':>8} {'input':>10} {'output':>10} {'cached':>10} {'cost':>8}")
+        for name, values in report["usage_per_phase"].items():
+            logger.info(
+                f"{name:>18} {values['calls']:>8} {values['input_tokens']:>10} {values['output_tokens']:>10} "
+                f"{values['cached_tokens']:>10} {values['cost']:>8.3f}"
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the detector on a labelled dataset.")
+    parser.add_argument("-d", "--dataset", required=True, help="Labelled dataset (e.g. datasets/FakeNewsCorpusSpanish/split/200.csv)")
+    parser.add_argument("-n", "--name", required=False, help="Name of the run (batch/results/<name>/)")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--offline", action="store_true", help="Only evaluate the results already in the run")
+    parser.add_argument("--baseline", required=False, help="Name of a previous run to compare with")
+    parser.add_argument("--fixtures", choices=["record", "replay"], required=False, help="Record the external calls, or replay them without network (FIXTURES_PATH, FIXTURES_LATENCY)")
+    args = parser.parse_args()
+
+    name = args.name or datetime.now().strftime("%Y%m%d_%H%M%S")
+    results_path = RUN_PATH.format(name=name)
+
+    debug.setup(log_file=os.path.join(results_path, "evaluation.log"), skip_checks=args.offline or args.fixtures == "replay")
+
+    if args.fixtures:
+        # Read by every worker when its services are first called
+        os.environ["FIXTURES_MODE"] = args.fixtures
+
+    labels = load_labels(args.dataset)
+    logger.info(f"Loaded {len(labels)} labelled URLs from {args.dataset}")
+
+    if not args.offline:
+        # Run (or resume) the analyses through the batch runner
+        download.RESULTS_PATH = results_path
+        download.analyze_batch(labels["url"].tolist(), workers=args.workers)
+
+    report = evaluate(results_path, labels)
+    report["dataset"] = args.dataset
+
+    baseline = None
+    if args.baseline:
+        with open(os.path.join(RUN_PATH.format(name=args.baseline), EVALUATION_FILENAME), "r") as f:
+            baseline = json.load(f)
+
+    print_report(report, baseline)
+
+    with open(os.path.join(results_path, EVALUATION_FILENAME), "w") as f:
+        json.dump(report, f, indent=2, default=str)
+
+    logger.info(f"Report saved to: {os.path.join(results_path, EVALUATION_FILENAME)}")
+
+if __name__ == "__main__":
+    main()
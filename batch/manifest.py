@@ -0,0 +1,176 @@
+from typing import Dict, Iterable, List, Set
+from loguru import logger
+import hashlib
+import sqlite3
+import os
+
+MANIFEST_FILENAME = "manifest.sqlite"
+
+RETRYABLE_STATUSES = ("error", "exception")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    url_hash TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL,
+    path TEXT,
+    started TEXT,
+    finished TEXT,
+    elapsed REAL,
+    pdf_input_tokens INTEGER,
+    pdf_output_tokens INTEGER,
+    text_input_tokens INTEGER,
+    text_output_tokens INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 1
+)
+"""
+
+# Columns added later, created in older manifests when they are opened
+ADDED_COLUMNS = [
+    ("pdf_cached_tokens", "INTEGER"),
+    ("text_cached_tokens", "INTEGER"),
+    ("embeddings_tokens", "INTEGER"),
+    ("cost", "REAL"),
+]
+
+COLUMNS = [
+    "url_hash", "url", "status", "path", "started", "finished", "elapsed",
+    "pdf_input_tokens", "pdf_output_tokens", "text_input_tokens", "text_output_tokens",
+] + [name for name, _ in ADDED_COLUMNS]
+
+def url_hash(url: str) -> str:
+    """
+    Get the stable ID of a URL.
+    """
+    return hashlib.sha256(url.strip().encode("utf-8")).hexdigest()
+
+class Manifest:
+    """
+    One row per analyzed URL, so a batch can resume without looking for its
+    result files. Only the parent process writes to it.
+    """
+    def __init__(self, results_path: str):
+        self.path = os.path.join(results_path, MANIFEST_FILENAME)
+        os.makedirs(results_path, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(analyses)")}
+        for name, kind in ADDED_COLUMNS:
+            if name not in existing:
+                self.conn.execute(f"ALTER TABLE analyses ADD COLUMN {name} {kind}")
+        self.conn.commit()
+
+        logger.debug(f"Opened manifest at {self.path}")
+
+    def done(self, retry_errors: bool = False) -> Set[str]:
+        """
+        Get the hashes of the URLs that don't have to be analyzed again.
+
+        Args:
+            retry_errors (bool): Analyze the URLs that ended in an error or exception again.
+        """
+        query = "SELECT url_hash FROM analyses"
+        if retry_errors:
+            query += f" WHERE status NOT IN ({', '.join('?' for _ in RETRYABLE_STATUSES)})"
+            rows = self.conn.execute(query, RETRYABLE_STATUSES)
+        else:
+            rows = self.conn.execute(query)
+
+        return {row[0] for row in rows}
+
+    def pending(self, urls: Iterable[str], retry_errors: bool = False) -> List[str]:
+        """
+        Filter out the URLs that were already analyzed, and duplicated ones.
+        """
+        done = self.done(retry_errors)
+
+        pending = []
+        for url in urls:
+            h = url_hash(url)
+            if h not in done:
+                done.add(h)
+                pending.append(url)
+
+        return pending
+
+    def failed_paths(self, urls: Iterable[str]) -> Dict[str, str]:
+        """
+        Get the saved pipes of the URLs that ended in an error or exception.
+
+        Returns:
+            Dict[str, str]: URL to pipe path.
+        """
+        by_hash = {url_hash(url): url for url in urls}
+
+        rows = self.conn.execute(
+            f"SELECT url_hash, path FROM analyses WHERE path IS NOT NULL "
+            f"AND status IN ({', '.join('?' for _ in RETRYABLE_STATUSES)})",
+            RETRYABLE_STATUSES,
+        )
+
+        return {by_hash[h]: path for h, path in rows if h in by_hash}
+
+    def record(self, entry: Dict, commit: bool = True):
+        """
+        Record the outcome of an analysis, replacing any previous attempt.
+
+        Args:
+            entry (Dict): The row, with (some of) the COLUMNS.
+            commit (bool): Commit now. Otherwise the row is lost (and the URL
+                analyzed again) unless commit() is called before closing.
+        """
+        values = [entry.get(column) for column in COLUMNS]
+
+        self.conn.execute(
+            f"INSERT INTO analyses ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)}) "
+            f"ON CONFLICT(url_hash) DO UPDATE SET "
+            + ", ".join(f"{c} = excluded.{c}" for c in COLUMNS[1:])
+            + ", attempts = attempts + 1",
+            values,
+        )
+        if commit:
+            self.conn.commit()
+
+    def commit(self):
+        """
+        Commit the rows recorded without committing them.
+        """
+        self.conn.commit()
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Get the number of URLs per status.
+        """
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM analyses GROUP BY status"))
+
+    def close(self):
+        # Uncommitted rows are rolled back
+        self.conn.close()
+
+if __name__ == "__main__":
+    import tempfile
+
+    def test_manifest():
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest = Manifest(tmp)
+            manifest.record({"url_hash": url_hash("a"), "url": "a", "status": "success"})
+            manifest.record({"url_hash": url_hash("b"), "url": "b", "status": "error"})
+
+            assert manifest.pending(["a", "b", "c", "c"]) == ["c"]
+            assert manifest.pending(["a", "b", "c"], retry_errors=True) == ["b", "c"]
+
+            manifest.record({"url_hash": url_hash("b"), "url": "b", "status": "success"})
+            assert manifest.counts() == {"success": 2}
+
+            # Not committed: analyzed again after a crash
+            manifest.record({"url_hash": url_hash("c"), "url": "c", "status": "success"}, commit=False)
+            manifest.close()
+
+            manifest = Manifest(tmp)
+            assert manifest.pending(["a", "b", "c"]) == ["c"]
+            manifest.close()
+        print("Manifest test passed")
+    #test_manifest()
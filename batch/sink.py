@@ -0,0 +1,285 @@
+from datetime import datetime
+from typing import Callable, Dict, List
+from loguru import logger
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pandas as pd
+import os
+
+RESULTS_DIR = "dataset/results/"
+EMBEDDINGS_DIR = "dataset/embeddings/"
+USAGE_DIR = "dataset/usage/"
+
+FLUSH_ROWS = 500  # analyses per Parquet file
+
+PHASES = [
+    "init", "check_domain", "download_article", "parse_article", "process_article", "search",
+    "process_search", "rank_results", "compare_results", "draw_conclusion", "last_checks",
+]
+
+FLAGS = ["has_author", "has_sources", "is_recent", "has_grammar_issues", "has_bad_reputation"]
+
+RESULTS_SCHEMA = pa.schema(
+    [
+        ("url_hash", pa.string()),
+        ("url", pa.string()),
+        ("domain", pa.string()),
+        ("title", pa.string()),
+        ("status", pa.string()),
+        ("error_class", pa.string()),
+        ("error_message", pa.string()),
+        ("last_phase", pa.string()),
+        ("verified", pa.bool_()),
+        ("verified_percentage", pa.float64()),
+        ("unverified_percentage", pa.float64()),
+        ("unrelated_percentage", pa.float64()),
+        ("sources", pa.int32()),
+    ]
+    + [(flag, pa.bool_()) for flag in FLAGS]
+    + [
+        ("elapsed", pa.float64()),
+    ]
+    + [(f"time_{phase}", pa.float64()) for phase in PHASES]
+    + [
+        ("pdf_input_tokens", pa.int64()),
+        ("pdf_output_tokens", pa.int64()),
+        ("text_input_tokens", pa.int64()),
+        ("text_output_tokens", pa.int64()),
+        ("pdf_cached_tokens", pa.int64()),
+        ("text_cached_tokens", pa.int64()),
+        ("embeddings_tokens", pa.int64()),
+        ("cost", pa.float64()),  # USD
+        ("started", pa.timestamp("us")),
+        ("finished", pa.timestamp("us")),
+    ]
+)
+
+EMBEDDINGS_SCHEMA = pa.schema([
+    ("url_hash", pa.string()),  # the analyzed article
+    ("kind", pa.string()),  # "article" or "source"
+    ("url", pa.string()),
+    ("embedding", pa.list_(pa.float32())),
+])
+
+# One row per LLM or embeddings call
+USAGE_SCHEMA = pa.schema([
+    ("url_hash", pa.string()),
+    ("phase", pa.string()),
+    ("role", pa.string()),  # pdf, text, embeddings
+    ("model", pa.string()),
+    ("input_tokens", pa.int64()),
+    ("output_tokens", pa.int64()),
+    ("cached_tokens", pa.int64()),
+    ("cost", pa.float64()),  # USD
+])
+
+def error_class(pipe) -> str | None:
+    """
+    Get the kind of failure of an analysis.
+    """
+    if pipe.error:
+        return "ErrorException"
+    if pipe.refusal:
+        return "RefusalException"
+    if pipe.exception:
+        # The exception is stored as a traceback, whose last line is "Class: message"
+        lines = [line for line in pipe.exception.splitlines() if line.strip()]
+        return lines[-1].split(":")[0].strip() if lines else "Exception"
+    return None
+
+def pipe_to_row(pipe, entry: Dict) -> Dict:
+    """
+    Flatten an analysis into a results row.
+
+    Args:
+        pipe (Pipe): The finished pipe.
+        entry (Dict): Its manifest entry.
+
+    Returns:
+        Dict: The row, following RESULTS_SCHEMA.
+    """
+    timings = getattr(pipe, "timings", None) or {}
+    message = pipe.error or pipe.refusal or pipe.exception
+
+    row = {
+        "url_hash": entry["url_hash"],
+        "url": entry["url"],
+        "domain": pipe.domain.name if pipe.domain else None,
+        "title": pipe.article.title if pipe.article else None,
+        "status": entry["status"],
+        "error_class": error_class(pipe),
+        "error_message": message.splitlines()[-1][:500] if message else None,
+        "last_phase": pipe.phase,
+        "verified": pipe.verified,
+        "verified_percentage": pipe.verified_percentage,
+        "unverified_percentage": pipe.unverified_percentage,
+        "unrelated_percentage": pipe.unrelated_percentage,
+        "sources": len(pipe.search_webpages_filtered or pipe.search_webpages or []),
+        "elapsed": entry.get("elapsed"),
+        "pdf_input_tokens": entry.get("pdf_input_tokens"),
+        "pdf_output_tokens": entry.get("pdf_output_tokens"),
+        "text_input_tokens": entry.get("text_input_tokens"),
+        "text_output_tokens": entry.get("text_output_tokens"),
+        "pdf_cached_tokens": entry.get("pdf_cached_tokens"),
+        "text_cached_tokens": entry.get("text_cached_tokens"),
+        "embeddings_tokens": entry.get("embeddings_tokens"),
+        "cost": entry.get("cost"),
+        "started": datetime.fromisoformat(entry["started"]) if entry.get("started") else None,
+        "finished": datetime.fromisoformat(entry["finished"]) if entry.get("finished") else None,
+    }
+
+    for flag in FLAGS:
+        row[flag] = getattr(pipe, flag, None)
+
+    for phase in PHASES:
+        row[f"time_{phase}"] = timings.get(phase)
+
+    return row
+
+def pipe_to_embeddings(pipe, url_hash: str) -> List[Dict]:
+    """
+    Get the embeddings of an article and its sources.
+
+    Returns:
+        List[Dict]: The rows, following EMBEDDINGS_SCHEMA.
+    """
+    rows = []
+
+    if pipe.article and pipe.article.summary_embeddings:
+        rows.append({"url_hash": url_hash, "kind": "article", "url": pipe.article.url,
+                     "embedding": list(pipe.article.summary_embeddings)})
+
+    for webpage in pipe.search_webpages or []:
+        if webpage.summary_embeddings:
+            rows.append({"url_hash": url_hash, "kind": "source", "url": webpage.url,
+                         "embedding": list(webpage.summary_embeddings)})
+
+    return rows
+
+def pipe_to_usage(pipe, url_hash: str, first: int = 0) -> List[Dict]:
+    """
+    Get the usage records of an analysis.
+
+    Args:
+        pipe (Pipe): The finished pipe.
+        url_hash (str): Its URL hash.
+        first (int): Skip the records before this one (written by a previous attempt).
+
+    Returns:
+        List[Dict]: The rows, following USAGE_SCHEMA.
+    """
+    return [
+        {
+            "url_hash": url_hash,
+            "phase": record.phase,
+            "role": record.role,
+            "model": record.model,
+            "input_tokens": record.input_tokens,
+            "output_tokens": record.output_tokens,
+            "cached_tokens": record.cached_tokens,
+            "cost": record.cost,
+        }
+        for record in (getattr(pipe, "usage", None) or [])[first:]
+    ]
+
+class ResultsSink:
+    """
+    Writes one row per analysis to a Parquet dataset, and the embeddings and
+    usage records to separate ones, so a whole run can be loaded with a single read.
+
+    Rows are buffered and written in files of FLUSH_ROWS analyses. Resumed
+    runs add new files next to the existing ones. on_flush is called after
+    every file, e.g. to commit the manifest rows of the written analyses.
+    """
+    def __init__(self, results_path: str, flush_rows: int = FLUSH_ROWS, on_flush: Callable[[], None] = None):
+        self.results_dir = os.path.join(results_path, RESULTS_DIR)
+        self.embeddings_dir = os.path.join(results_path, EMBEDDINGS_DIR)
+        self.usage_dir = os.path.join(results_path, USAGE_DIR)
+        self.flush_rows = flush_rows
+        self.on_flush = on_flush
+
+        os.makedirs(self.results_dir, exist_ok=True)
+        os.makedirs(self.embeddings_dir, exist_ok=True)
+        os.makedirs(self.usage_dir, exist_ok=True)
+
+        self.part = len([f for f in os.listdir(self.results_dir) if f.endswith(".parquet")])
+
+        self.rows: List[Dict] = []
+        self.embeddings: List[Dict] = []
+        self.usage: List[Dict] = []
+
+    def add(self, row: Dict, embeddings: List[Dict] = None, usage: List[Dict] = None):
+        self.rows.append(row)
+        self.embeddings.extend(embeddings or [])
+        self.usage.extend(usage or [])
+
+        if len(self.rows) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows to a new file.
+        """
+        if not self.rows:
+            return
+
+        filename = f"part-{self.part:05d}.parquet"
+
+        pq.write_table(pa.Table.from_pylist(self.rows, schema=RESULTS_SCHEMA), os.path.join(self.results_dir, filename))
+
+        if self.embeddings:
+            pq.write_table(pa.Table.from_pylist(self.embeddings, schema=EMBEDDINGS_SCHEMA), os.path.join(self.embeddings_dir, filename))
+
+        if self.usage:
+            pq.write_table(pa.Table.from_pylist(self.usage, schema=USAGE_SCHEMA), os.path.join(self.usage_dir, filename))
+
+        logger.debug(f"Wrote {len(self.rows)} analyses, {len(self.embeddings)} embeddings and {len(self.usage)} calls to {filename}")
+
+        self.part += 1
+        self.rows = []
+        self.embeddings = []
+        self.usage = []
+
+        if self.on_flush:
+            self.on_flush()
+
+    def close(self):
+        self.flush()
+
+def load(results_path: str) -> pd.DataFrame:
+    """
+    Load the results of a run, keeping only the last attempt of every URL.
+
+    Args:
+        results_path (str): The run folder (batch/results/<name>/).
+
+    Returns:
+        pd.DataFrame: One row per analyzed URL.
+    """
+    df = pd.read_parquet(os.path.join(results_path, RESULTS_DIR))
+    return df.sort_values("finished").drop_duplicates("url_hash", keep="last").reset_index(drop=True)
+
+def _has_parts(path: str) -> bool:
+    return os.path.isdir(path) and any(f.endswith(".parquet") for f in os.listdir(path))
+
+def load_embeddings(results_path: str) -> pd.DataFrame:
+    """
+    Load the embeddings of a run.
+    """
+    path = os.path.join(results_path, EMBEDDINGS_DIR)
+    if not _has_parts(path):
+        return pd.DataFrame(columns=EMBEDDINGS_SCHEMA.names)
+
+    return pd.read_parquet(path)
+
+def load_usage(results_path: str) -> pd.DataFrame:
+    """
+    Load the usage records of a run, one row per LLM or embeddings call.
+    Every call is stored once, by the attempt that made it, so retried URLs
+    add up the calls of all their attempts.
+    """
+    path = os.path.join(results_path, USAGE_DIR)
+    if not _has_parts(path):
+        return pd.DataFrame(columns=USAGE_SCHEMA.names)
+
+    return pd.read_parquet(path)
@@ -1,7 +1,6 @@
 from pydantic import BaseModel
 import os
 from loguru import logger
-import lxml.html.clean
 import markitdown
 from typing import List, Optional
 import io
@@ -13,27 +12,32 @@ import fake_news_detector.debug as debug
 import fake_news_detector.utils as utils
 from fake_news_detector.datatypes import *
 import fake_news_detector.parser as parser
-
-TEXT_MAX = 2200000  # 2.2 million characters
+import fake_news_detector.budget as budget
 
 class AIUtil:
     llm: "llm.LLM"
+    budget: "budget.TokenBudget"
     
     def __init__(self, llm: "llm.LLM"):
         self.llm = llm
+        self.budget = budget.TokenBudget(
+            context_window=llm.get_context_window(),
+            model=llm.get_model(),
+        )
 
 # ========== Article Classification
 class ArticleClassifier(AIUtil):
-    def is_article(self, pdf_b64: str) -> bool:
+    def is_article(self, pdf: bytes) -> bool:
         """
         Classify the PDF as an article or not.
         """
         logger.debug(f"Classifying article...")
         
         msgs = llm.ChatBuilder()
+        msgs.system(prompts.ARTICLE_CLASSIFICATION.system)
         msgs.user(
             prompt=prompts.ARTICLE_CLASSIFICATION.user,
-            pdf_uri=pdf_b64,
+            pdf=pdf,
             pdf_name="webpage.pdf",
         )
         
@@ -47,43 +51,36 @@ class ArticleClassifier(AIUtil):
         return result.is_article
     
 # ========== Article Parsing
+PDF_RESERVE = 8 * 1024  # tokens kept for the PDF of the article, a few pages
+
 class ArticleParser(AIUtil):
-    cleaner: lxml.html.clean.Cleaner
     llm: "llm.LLM"
     
     def __init__(self, llm: "llm.LLM"):
-        self.html_cleaner = lxml.html.clean.Cleaner(
-            style=False,
-            scripts=False,
-            comments=False,
-            links=False,
-            meta=False,
-            page_structure=False,
-            processing_instructions=False,
-            embedded=False,
-            frames=False,
-            forms=False,
-            annoying_tags=False,
-            remove_unknown_tags=False,
-        )
-        
-        self.llm = llm
+        super().__init__(llm)
         
-        self.html_parser = parser.Parser()
+        self.html_parser = parser.get_parser()
             
-    def parse(self, html: str, pdf: str) -> ConvertedArticle:
+    def parse(self, html: str, pdf: bytes) -> ConvertedArticle:
         """
         Parse the HTML content and return a structured article.
         """
         logger.debug(f"Parsing article...")
         
         md = self.html_parser.html_to_md(html)
+        md = self.budget.fit(
+            md,
+            prompts.PDF_HTML_TO_STRUCTURED.system,
+            prompts.PDF_HTML_TO_STRUCTURED.user.format(markdown=""),
+            reserve=min(PDF_RESERVE, self.budget.context_window // 4),
+        )
         
+        # Same system prompt as the classifier, so the PDF is read from the same cache
         msgs = llm.ChatBuilder()
         msgs.system(prompts.PDF_HTML_TO_STRUCTURED.system)
         msgs.user(
-            prompt=md,
-            pdf_uri=pdf,
+            prompt=prompts.PDF_HTML_TO_STRUCTURED.user.format(markdown=md),
+            pdf=pdf,
             pdf_name="article.pdf",
         )
         
@@ -102,6 +99,8 @@ class QuestionGenerator(AIUtil):
         """
         logger.debug(f"Generating question...")
         
+        context = self.budget.fit(context, prompts.QUESTION_GENERATION.system)
+        
         msgs = llm.ChatBuilder()
         msgs.system(prompts.QUESTION_GENERATION.system)
         msgs.user(
@@ -112,33 +111,58 @@ class QuestionGenerator(AIUtil):
             messages=msgs,
         )
         
-        logger.trace(f"Generated question: {result}")
+        logger.trace("Generated question: {}", result)
         
         return result
 
 # ========== Comparison
+SOURCE_RESERVE = 1024  # tokens kept for the source summary when fitting the article
+
 class Comparer(AIUtil):
+    def __init__(self, llm: "llm.LLM"):
+        super().__init__(llm)
+        
+        # Last fitted article: the same one is compared with every source
+        self.fitted: tuple = (None, None)
+    
     def compare(self, text1: str, text2: str) -> str:
         """
         Compare two texts and return the differences.
         """
         logger.debug(f"Comparing texts...")
         
-        msgs = llm.ChatBuilder()
-        msgs.system(prompts.COMPARISON.system)
-        msgs.user(
-            prompts.COMPARISON.user.format(
-                text1=text1,
-                text2=text2,
+        # The article is cut to the same size for every source, so the system
+        # prompt and article are an identical prefix that the provider can cache
+        original, fitted = self.fitted
+        if original != text1:
+            fitted = self.budget.fit(
+                text1,
+                prompts.COMPARISON.system,
+                prompts.COMPARISON.user[1].format(text2=""),
+                reserve=SOURCE_RESERVE,
             )
+            self.fitted = (text1, fitted)
+        text1 = fitted
+        
+        text2 = self.budget.fit(
+            text2,
+            prompts.COMPARISON.system,
+            prompts.COMPARISON.user[0].format(text1=text1),
+            prompts.COMPARISON.user[1].format(text2=""),
         )
         
+        # Variable part last
+        msgs = llm.ChatBuilder()
+        msgs.system(prompts.COMPARISON.system)
+        msgs.user(prompts.COMPARISON.user[0].format(text1=text1))
+        msgs.user(prompts.COMPARISON.user[1].format(text2=text2))
+        
         result = self.llm.call(
             messages=msgs,
             structure=VeredictClassification,
         )
         
-        logger.trace(f"Comparison result:\n{result}")
+        logger.trace("Comparison result:\n{}", result)
         
         return result.veredict
     
@@ -149,9 +173,7 @@ class ArticleSummarizer(AIUtil):
         """
         logger.debug(f"Summarizing article...")
         
-        if len(md) > TEXT_MAX:
-            logger.warning(f"Text is too long ({len(md)} characters), truncating to 2.5 million characters.")
-            md = md[:TEXT_MAX]  # Truncate to 2.5 million characters
+        md = self.budget.fit(md, prompts.ARTICLE_SUMMARIZATION.system)
         
         msgs = llm.ChatBuilder()
         msgs.system(prompts.ARTICLE_SUMMARIZATION.system)
@@ -163,14 +185,14 @@ class ArticleSummarizer(AIUtil):
             messages=msgs,
         )
         
-        logger.trace(f"Article summary:\n{result}")
+        logger.trace("Article summary:\n{}", result)
         
         return result
     
 class WebPageSummarizer(AIUtil):
     def __init__(self, llm: "llm.LLM"):
         super().__init__(llm)
-        self.html_parser = parser.Parser()
+        self.html_parser = parser.get_parser()
         
     def summarize(self, text: str) -> str:
         """
@@ -179,23 +201,26 @@ class WebPageSummarizer(AIUtil):
         logger.debug(f"Summarizing webpage...")
         
         md = self.html_parser.html_to_md(text)
+        md = self.budget.fit(md, prompts.WEBPAGE_SUMMARIZATION.system)
         
-        logger.trace(f"Converted HTML to Markdown:\n{md}")
+        logger.trace("Converted HTML to Markdown:\n{}", md)
         
         msgs = llm.ChatBuilder()
         msgs.system(prompts.WEBPAGE_SUMMARIZATION.system)
         msgs.user(
-            prompt=text,
+            prompt=md,
         )
         
         result = self.llm.call(
             messages=msgs,
         )
         
-        logger.trace(f"WebPage summary:\n{result}")
+        logger.trace("WebPage summary:\n{}", result)
         
         return result
     
+CONCLUSION_SOURCES_RESERVE = 4 * 1024  # tokens kept for the source summaries when fitting the article
+
 class ConclusionGenerator(AIUtil):
     def generate(self, article: str, top_sources: List[WebPage]) -> str:
         """
@@ -208,28 +233,37 @@ class ConclusionGenerator(AIUtil):
             sources += f"[{i+1}] {source.domain_name}\n"
             sources += f"{source.summary}\n\n"
         
-        # Add system and user messages
+        # The second call also carries the first answer
+        fixed = [
+            prompts.CONCLUSION_GENERATION.system,
+            prompts.CONCLUSION_GENERATION.user[0].format(article=""),
+            prompts.CONCLUSION_GENERATION.user[1].format(sources=""),
+            prompts.CONCLUSION_GENERATION.user[2],
+        ]
+        article = self.budget.fit(article, *fixed, reserve=self.budget.output_reserve + min(CONCLUSION_SOURCES_RESERVE, self.budget.context_window // 4))
+        sources = self.budget.fit(sources, *fixed, article, reserve=self.budget.output_reserve)
+        
+        # Add system and user messages. The article goes before the sources,
+        # and the second call extends the first chat, so both share a cacheable prefix
         msgs = llm.ChatBuilder()
         msgs.system(prompts.CONCLUSION_GENERATION.system)
         msgs.user(
-            prompt=prompts.CONCLUSION_GENERATION.user[0].format(
-                article=article,
-                sources=sources,
-                temperature=prompts.CONCLUSION_GENERATION.temperature
-            )
+            prompt=prompts.CONCLUSION_GENERATION.user[0].format(article=article)
+        )
+        msgs.user(
+            prompt=prompts.CONCLUSION_GENERATION.user[1].format(sources=sources)
         )
-        
         
         long_conclusion = self.llm.call(
             messages=msgs,
         )
         
-        logger.trace(f"Conclusion (long):\n{long_conclusion}")
+        logger.trace("Conclusion (long):\n{}", long_conclusion)
         
         # Add response as assistant message
         msgs.assistant(long_conclusion)
         msgs.user(
-            prompt=prompts.CONCLUSION_GENERATION.user[1],
+            prompt=prompts.CONCLUSION_GENERATION.user[2],
         )
         
         short_conclusion_raw = self.llm.call(
@@ -240,7 +274,7 @@ class ConclusionGenerator(AIUtil):
         # Replace source placeholders with actual URLs
         short_conclusion = self.replace_sources(short_conclusion_raw, top_sources)  
         
-        logger.trace(f"Conclusion (short):\n{short_conclusion}")
+        logger.trace("Conclusion (short):\n{}", short_conclusion)
         
         return short_conclusion
     
@@ -278,15 +312,19 @@ class ConclusionGenerator(AIUtil):
         return res
     
 class GrammarClassifier(AIUtil):
-    def classify(self, text: str) -> GrammarClassification:
+    def __init__(self, llm: "llm.LLM"):
+        super().__init__(llm)
+        self.html_parser = parser.get_parser()
+        
+    def classify(self, html: str) -> GrammarClassification:
         """
-        Classify the text for grammar issues.
+        Classify the text of the HTML page for grammar issues.
         """
-        logger.debug(f"Classifying if grammar issues... Text length: {len(text)}")
+        logger.debug(f"Classifying if grammar issues... HTML length: {len(html)}")
         
-        if len(text) > TEXT_MAX:
-            logger.warning(f"Text is too long ({len(text)} characters), truncating to 2.5 million characters.")
-            text = text[:TEXT_MAX]  # Truncate to 2.5 million characters
+        # Only the page's text is checked, not the markup
+        text = self.html_parser.html_to_md(html)
+        text = self.budget.fit(text, prompts.GRAMMAR_CLASSIFICATION.system)
         
         msgs = llm.ChatBuilder()
         msgs.system(prompts.GRAMMAR_CLASSIFICATION.system)
@@ -302,7 +340,7 @@ class GrammarClassifier(AIUtil):
         
         logger.trace(f"Has grammar issues?: {result.has_grammar_issues}")
         if result.has_grammar_issues:
-            logger.trace(f"Grammar issues found: {result.where}")
+            logger.trace("Grammar issues found: {}", result.where)
         
         return result
         
@@ -315,7 +353,7 @@ if __name__ == "__main__":
         parser = ArticleParser(client)
         
         html = utils.load("dummy/noticia.html")
-        pdf = utils.load_b64("dummy/noticia.pdf")
+        pdf = utils.load_binary("dummy/noticia.pdf")
         
         result = parser.parse(html, pdf)
         
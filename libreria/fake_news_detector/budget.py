@@ -0,0 +1,197 @@
+from loguru import logger
+from typing import List
+import re
+import tiktoken
+
+import fake_news_detector.debug as debug
+
+DEFAULT_ENCODING = "o200k_base"
+
+OUTPUT_RESERVE = 2048  # tokens kept free for the response
+MESSAGE_OVERHEAD = 8  # tokens added by the chat template per message
+SAFETY_MARGIN = 0.9  # tiktoken only approximates non-OpenAI tokenizers
+
+LINK_DENSITY_MAX = 0.5  # blocks with more link text than this are boilerplate
+CHARS_PER_TOKEN = 4  # estimate when the tokenizer can't be loaded
+
+LINK_PATTERN = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+
+def get_encoding(model: str = None) -> "tiktoken.Encoding | None":
+    """
+    Get the tokenizer for the given model, falling back to a generic one.
+
+    Args:
+        model (str): The model name, with or without a provider prefix (openai/gpt-4.1).
+
+    Returns:
+        tiktoken.Encoding | None: The tokenizer, or None if it can't be loaded
+            (tiktoken downloads it on first use, which fails offline).
+    """
+    try:
+        if model:
+            try:
+                return tiktoken.encoding_for_model(model.split("/")[-1])
+            except KeyError:
+                pass
+
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logger.warning(f"Could not load the tokenizer, estimating {CHARS_PER_TOKEN} characters per token: {e}")
+        return None
+
+def is_boilerplate(block: str) -> bool:
+    """
+    Check if a Markdown block looks like navigation, link lists or image-only content.
+
+    Args:
+        block (str): The block to check.
+
+    Returns:
+        bool: True if the block should be dropped.
+    """
+    text = block.strip()
+    if not text:
+        return True
+
+    # Share of the visible text that belongs to links
+    link_chars = sum(len(m.group(0)) for m in LINK_PATTERN.finditer(text))
+    if link_chars / len(text) > LINK_DENSITY_MAX:
+        return True
+
+    return False
+
+class TokenBudget:
+    """
+    Fits prompts into the context window of the target model, so the server never
+    silently truncates them.
+    """
+    def __init__(self, context_window: int, model: str = None, output_reserve: int = OUTPUT_RESERVE):
+        self.context_window = context_window
+        self.output_reserve = min(output_reserve, context_window // 4)
+        self.encoding = get_encoding(model)
+
+    def count(self, text: str) -> int:
+        """
+        Count the tokens of a text.
+        """
+        if not text:
+            return 0
+
+        if self.encoding is None:
+            return -(-len(text) // CHARS_PER_TOKEN)
+
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def cut(self, text: str, tokens: int) -> str:
+        """
+        Keep the first tokens of a text.
+        """
+        if self.encoding is None:
+            return text[:tokens * CHARS_PER_TOKEN]
+
+        ids = self.encoding.encode(text, disallowed_special=())
+        return self.encoding.decode(ids[:tokens])
+
+    def available(self, *fixed: str, reserve: int = 0) -> int:
+        """
+        Get the tokens left for the variable part of a prompt.
+
+        Args:
+            fixed (str): The other parts of the prompt (system prompt, templates...).
+            reserve (int): Tokens kept for a part that isn't known yet.
+
+        Returns:
+            int: The number of tokens available.
+        """
+        usable = int(self.context_window * SAFETY_MARGIN) - self.output_reserve - reserve
+        used = sum(self.count(f) + MESSAGE_OVERHEAD for f in fixed) + MESSAGE_OVERHEAD
+
+        return max(usable - used, 0)
+
+    def fit(self, text: str, *fixed: str, reserve: int = 0) -> str:
+        """
+        Cut a Markdown text to the available budget. Texts that already fit
+        are returned unchanged. Otherwise boilerplate and repeated blocks are
+        dropped first.
+
+        Blocks are kept in order until the budget runs out, so the text is never
+        cut in the middle of a paragraph unless the first one alone is too long.
+
+        Args:
+            text (str): The Markdown text to fit.
+            fixed (str): The other parts of the prompt (system prompt, templates...).
+            reserve (int): Tokens kept for a part that isn't known yet.
+
+        Returns:
+            str: The fitted text.
+        """
+        if not text:
+            return text
+
+        budget = self.available(*fixed, reserve=reserve)
+
+        if self.count(text) <= budget:
+            return text
+
+        blocks = self._main_blocks(text)
+
+        kept: List[str] = []
+        used = 0
+        for block in blocks:
+            tokens = self.count(block) + 1  # newline
+
+            if used + tokens > budget:
+                if not kept:
+                    # Not even the first block fits. Cut it by tokens
+                    kept.append(self.cut(block, budget))
+                    used = budget
+                break
+
+            kept.append(block)
+            used += tokens
+
+        if len(kept) < len(blocks):
+            logger.warning(f"Prompt doesn't fit in {self.context_window} tokens. Kept {len(kept)} of {len(blocks)} blocks ({used} tokens).")
+
+        logger.debug(f"Fitted text from {len(text)} to {sum(len(b) for b in kept)} characters ({used}/{budget} tokens).")
+
+        return "\n".join(kept)
+
+    def _main_blocks(self, text: str) -> List[str]:
+        seen = set()
+        blocks = []
+
+        for line in text.splitlines():
+            block = line.strip()
+
+            # Paragraph breaks are kept, but not runs of them
+            if not block:
+                if blocks and blocks[-1].strip():
+                    blocks.append(line)
+                continue
+
+            if block in seen or is_boilerplate(block):
+                continue
+
+            seen.add(block)
+            blocks.append(line)
+
+        return blocks
+
+if __name__ == "__main__":
+    debug.setup(skip_checks=True)
+
+    def test_fit():
+        budget = TokenBudget(context_window=4096)
+        text = "\n".join(f"Paragraph {i}. " + "word " * 100 for i in range(100))
+        text += "\n[Home](/) [News](/news) [Sports](/sports)"
+
+        fitted = budget.fit(text, "System prompt")
+        assert budget.count(fitted) <= budget.available("System prompt")
+        assert "[Home]" not in fitted
+
+        # Texts that fit are left as they are
+        short = "Title\n\nParagraph.\n\nParagraph.\n[Home](/)"
+        assert budget.fit(short, "System prompt") == short
+        logger.success("Fit test passed")
+    #test_fit()
@@ -1,5 +1,6 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
+import uuid
 from pydantic import BaseModel
 from dataclasses import dataclass, field
 from enum import Enum
@@ -9,9 +10,10 @@ from datetime import datetime
 @dataclass
 class Pipe:
     domain: "Domain"
+    id: str = None  # names its snapshots
     domain_reputation: int = None
     
-    article_pdf: str = None
+    article_pdf: bytes = None
     article_html: str = None
     
     article: "Article"  = None
@@ -39,21 +41,44 @@ class Pipe:
     has_bad_reputation: bool = None
     
     phase: str = None
+    completed_phases: List[str] = None  # to resume the analysis
     refusal: str = None
     error: str = None
     exception: str = None
     
     elapsed: int = 0
+    timings: Dict[str, float] = None  # seconds per phase
     
     pdf_input_usage: int = 0
     pdf_output_usage: int = 0
     text_input_usage: int = 0
     text_output_usage: int = 0
+    pdf_cached_usage: int = 0  # part of the input read from the provider's prompt cache
+    text_cached_usage: int = 0
+    embeddings_usage: int = 0
+    cost: float = None  # USD, None if a model has no price
+    usage: List["UsageRecord"] = None  # every LLM and embeddings call of the analysis
     
     def __init__(self, url):
         # Define sub-objects
+        self.id = uuid.uuid4().hex
         self.article = Article(url=url)
         self.domain = Domain()
+        self.timings = {}
+        self.completed_phases = []
+        self.usage = []
+
+# ==========
+
+@dataclass
+class UsageRecord: # Tokens of a single LLM or embeddings call
+    model: str
+    role: str = None  # pdf, text, embeddings
+    phase: str = None
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0  # part of input_tokens read from the provider's cache
+    cost: float = None  # USD, None if the model has no price
 
 # ==========
 
@@ -10,21 +10,59 @@ import requests
 
 from fake_news_detector.datatypes import *
 import fake_news_detector.utils as utils
+import fake_news_detector.telemetry as telemetry
+
+# Logging profiles, chosen with LOG_PROFILE. LOG_LEVEL, LOG_ROTATION and
+# SAVE_PIPES override single settings.
+#   development: everything at DEBUG, with the variables of the failing frames
+#   production: INFO, plain tracebacks and no pipe snapshots, so the debug
+#               messages of the hot path are dropped before being formatted
+LOG_PROFILES = {
+    "development": {"level": "DEBUG", "diagnose": True, "save_pipes": True},
+    "production": {"level": "INFO", "diagnose": False, "save_pipes": False},
+}
+DEFAULT_LOG_PROFILE = "development"
+LOG_ROTATION = "50 MB"  # per file
+LOG_RETENTION = 10  # files
+
+# Settings of the active profile
+settings = dict(LOG_PROFILES[DEFAULT_LOG_PROFILE])
 
 def setup(log_file: str = None, skip_checks: bool = False):
     """
-    Initialize the debug environment.    """
+    Initialize the debug environment.
+    
+    Args:
+        log_file (str): Log to this file instead of logs/{time}.log.
+        skip_checks (bool): Don't check the LLM services and MongoDB.
+    """
+    # Load environment variables from .env file
+    dotenv.load_dotenv(override=True)
+    
+    profile = os.getenv("LOG_PROFILE", DEFAULT_LOG_PROFILE)
+    assert profile in LOG_PROFILES, f"LOG_PROFILE must be one of {list(LOG_PROFILES)}"
+    
+    settings.clear()
+    settings.update(LOG_PROFILES[profile])
+    settings["level"] = os.getenv("LOG_LEVEL", settings["level"]).upper()
+    if os.getenv("SAVE_PIPES"):
+        settings["save_pipes"] = os.getenv("SAVE_PIPES").lower() in ("1", "true", "yes")
+    
     # Setup loggers
     logger.remove()
     
+    # Sinks write from a background thread, so the pipeline doesn't wait for
+    # the console or the disk
+    
     # Console
     logger.add(
         sys.stdout,
-        level="DEBUG",
+        level=settings["level"],
         colorize=True,
+        enqueue=True,
         
-        backtrace=True,
-        diagnose=True,
+        backtrace=settings["diagnose"],
+        diagnose=settings["diagnose"],
         catch=True,
         
     )
@@ -34,10 +72,13 @@ def setup(log_file: str = None, skip_checks: bool = False):
     logger.add(
         #"logs/latest_debug.log",
         log_path,
-        level="DEBUG",
+        level=settings["level"],
+        enqueue=True,
+        rotation=os.getenv("LOG_ROTATION", LOG_ROTATION),
+        retention=LOG_RETENTION,
         
-        backtrace=True,
-        diagnose=True,
+        backtrace=settings["diagnose"],
+        diagnose=settings["diagnose"],
         catch=True,
     )
     
@@ -48,14 +89,14 @@ def setup(log_file: str = None, skip_checks: bool = False):
             logs.append(os.path.join("logs", file))
             
     logs.sort(key=os.path.getmtime, reverse=True)
-    for log in logs[10:]:  # Keep the latest 10 logs
+    for log in logs[LOG_RETENTION:]:  # Keep the latest logs
         os.remove(log)
     
     #logger.add("logs/tests/{time}.log", level="TRACE")
-    logger.debug("Logger initialized.")
+    logger.debug(f"Logger initialized ({profile} profile, {settings['level']}).")
     
-    # Load environment variables from .env file
-    dotenv.load_dotenv(override=True)
+    # Export the traces (if configured)
+    telemetry.setup()
     
     if skip_checks:
         logger.debug("Skipping environment checks.")
@@ -96,18 +137,26 @@ def test_llms():
     }
 
     services = [
-        os.getenv("EMBEDDINGS_SERVICE"),
-        os.getenv("PDF_SERVICE"),
-        os.getenv("TEXT_SERVICE"),
+        (os.getenv("EMBEDDINGS_SERVICE"), None),
+        (os.getenv("PDF_SERVICE"), None),
+        (os.getenv("TEXT_SERVICE"), None),
     ]
     
+    # Routers: check every backend
+    for service, model in [(os.getenv("PDF_SERVICE"), os.getenv("PDF_MODEL")), (os.getenv("TEXT_SERVICE"), os.getenv("TEXT_MODEL"))]:
+        if service == "router":
+            from fake_news_detector.services.llm import parse_backends
+            
+            services.remove((service, None))
+            services += [(backend["service"], backend["endpoint"]) for backend in parse_backends(model)]
+    
     # Convert service to urls
     service_urls: set[str] = set()
-    for service in services:
+    for service, endpoint in services:
         assert service is not None, "Service name cannot be None."
         assert service in SERVICE_ENDPOINTS, f"Service {service} is not defined in SERVICE_ENDPOINTS."
         
-        url = SERVICE_ENDPOINTS.get(service)
+        url = endpoint or SERVICE_ENDPOINTS.get(service)
         
         assert url is not None, f"Environment variable for {service} is not set inside .env file."
         
@@ -127,6 +176,10 @@ def test_llms():
     return ok
             
 def save_pipe(pipe: Pipe, name: str = None):
+    # Snapshots of every phase are only for debugging
+    if not settings["save_pipes"]:
+        return
+    
     logger.debug(f"Saving the pipe...")
     
     now_str = utils.format_datetime(datetime.now())
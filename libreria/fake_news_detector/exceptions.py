@@ -4,4 +4,12 @@ class RefusalException(Exception):
 
 class ErrorException(Exception):
     """Custom exception for errors in the Fake News Detector application."""
-    pass
\ No newline at end of file
+    pass
+
+class CancelledException(Exception):
+    """Raised when an analysis is cancelled while running."""
+    pass
+
+class MissingFixtureError(Exception):
+    """Raised in replay mode when a call was never recorded."""
+    pass
@@ -4,6 +4,7 @@ from datetime import datetime, timezone
 import sys
 import traceback
 import time
+import uuid
 
 from fake_news_detector.datatypes import *
 import fake_news_detector.scraper as scraper
@@ -16,11 +17,15 @@ import fake_news_detector.services.domain.geolocation as geolocation
 import fake_news_detector.services.domain.reputation as reputation
 import fake_news_detector.engines as engines
 import fake_news_detector.utils as utils
+import fake_news_detector.network as network
 from fake_news_detector.mocks import *
 import fake_news_detector.debug as debug
 import fake_news_detector.services.db as db
 import fake_news_detector.services.embeddings_db as embeddings_db
 import fake_news_detector.exceptions as exceptions
+import fake_news_detector.telemetry as telemetry
+import fake_news_detector.snapshots as snapshots
+import fake_news_detector.usage as usage
 
 DISTANCE_THRESHOLD = 0.4 # 1: very similar, 0: no similarity, -1: very different
 
@@ -28,11 +33,27 @@ RAG_MAX_SOURCES_PER_TYPE = 5
 
 RECENT_THRESHOLD = 1  # days
 
+# In order, after init
+PHASES = [
+    "check_domain",
+    "download_article",
+    "parse_article",
+    "process_article",
+    "search",
+    "process_search",
+    "rank_results",
+    "compare_results",
+    "draw_conclusion",
+    "last_checks",
+]
+
 class FakeNewsDetector:
     pipe: Pipe = None
     callback: callable = None
     running: bool = False
     interrupted: bool = False
+    initialized: bool = False
+    cancel_event = None  # anything with is_set() (threading.Event, Manager().Event...)
     
     scraper: "scraper.Scraper"
     
@@ -57,7 +78,6 @@ class FakeNewsDetector:
         if not custom_logger:
             debug.setup()
     
-    @logger.catch(reraise=True)
     def run(self, url: str, mock=False):
         """
         Start the fake news detection process.
@@ -65,7 +85,41 @@ class FakeNewsDetector:
         :param url: The URL of the article to analyze.
         :return: Result object containing the analysis results.
         """
+        return self._run(Pipe(url), mock=mock) # New pipe
+    
+    def resume(self, checkpoint: Pipe | str):
+        """
+        Continue an analysis from its last completed phase, e.g. after a
+        transient failure. The completed phases are not run again.
+        
+        :param checkpoint: The pipe of a previous run, or the ID of a snapshot:
+            "<pipe id>" for its last phase, "<pipe id>:<phase>" for a given one.
+        :return: Result object containing the analysis results.
+        """
+        if isinstance(checkpoint, str):
+            pipe_id, _, phase_id = checkpoint.partition(":")
+            pipe = snapshots.load(pipe_id, phase_id or None)
+        else:
+            pipe = checkpoint
+        
+        # Pipes saved before they had IDs and tracked their phases
+        if pipe.id is None:
+            pipe.id = uuid.uuid4().hex
+        if pipe.completed_phases is None:
+            pipe.completed_phases = PHASES[:PHASES.index(pipe.phase)] if pipe.phase in PHASES else []
         
+        # Forget the previous outcome
+        pipe.refusal = None
+        pipe.error = None
+        pipe.exception = None
+        
+        logger.info(f"Resuming the analysis of {pipe.article.url} after: {', '.join(pipe.completed_phases) or 'nothing'}")
+        
+        return self._run(pipe)
+    
+    @logger.catch(reraise=True)
+    @telemetry.traced("analysis")
+    def _run(self, pipe: Pipe, mock=False):
         # ---------
         self.running = True
         self.interrupted = False
@@ -73,7 +127,7 @@ class FakeNewsDetector:
         
         start = datetime.now(timezone.utc)
         
-        self.pipe = Pipe(url) # New pipe
+        self.pipe = pipe
         
         #mock = True
         if mock:
@@ -81,76 +135,101 @@ class FakeNewsDetector:
             #self.pipe = debug.load_pipe("20250614_175519_675_last_checks.pkl")
             pass
         
-        try:
-            self.init(self.pipe)
-            
-            # ---------
-            self.check_domain(self.pipe)
-            self.download_article(self.pipe)
-            self.parse_article(self.pipe)
-            self.process_article(self.pipe)
-            self.search(self.pipe)
-            self.process_search(self.pipe)
-            self.rank_results(self.pipe)
-            self.compare_results(self.pipe)
-            self.draw_conclusion(self.pipe)
-            self.last_checks(self.pipe)
-            # ---------
-            
-            logger.success("Detection completed successfully.")
-            
-            # Set the state to finished
-            self.pipe.phase = "finished"
-            
-        except exceptions.RefusalException as e:
-            self.pipe.refusal = str(e)
-            logger.error(f"Refusal: {e}")
-        except exceptions.ErrorException as e:
-            self.pipe.error = str(e)
-            logger.error(f"Error: {e}")
-        except KeyboardInterrupt:
-            logger.warning(f"Interrupted.")
-            self.interrupted = True
-            return None
-        except Exception as e:
-            e_str = str(traceback.format_exc())
-            
-            self.pipe.exception = f"Unexpected Exception: {e_str}"
-            logger.error(f"Unexpected Exception: {e_str}")
-            
-            ex, tb = e, sys.exc_info()[2]
-        finally:
-            # Raise any exception
-            # if ex:
-            #     raise ex.with_traceback(tb)
-        
-            if self.interrupted:
+        # Usage records of this analysis (and of the previous attempts, if resumed)
+        if self.pipe.usage is None:
+            self.pipe.usage = []
+        
+        with usage.track(self.pipe.usage):
+            try:
+                self.init(self.pipe)
+                
+                # Sources found before resuming
+                for webpage in self.pipe.search_webpages or []:
+                    if webpage.summary_embeddings:
+                        self.embeddings_db.add(webpage.url, webpage.summary_embeddings)
+                
+                # ---------
+                for phase_id in PHASES:
+                    if phase_id in self.pipe.completed_phases:
+                        logger.debug(f"Skipping completed phase: {phase_id}")
+                        continue
+                
+                    getattr(self, phase_id)(self.pipe)
+                # ---------
+                
+                logger.success("Detection completed successfully.")
+                
+                # Set the state to finished
+                self.pipe.phase = "finished"
+                
+            except exceptions.RefusalException as e:
+                self.pipe.refusal = str(e)
+                logger.error(f"Refusal: {e}")
+            except exceptions.ErrorException as e:
+                self.pipe.error = str(e)
+                logger.error(f"Error: {e}")
+            except KeyboardInterrupt:
+                logger.warning(f"Interrupted.")
+                self.interrupted = True
                 return None
+            except exceptions.CancelledException:
+                logger.warning(f"Cancelled.")
+                self.interrupted = True
+                return None
+            except Exception as e:
+                e_str = str(traceback.format_exc())
+                
+                self.pipe.exception = f"Unexpected Exception: {e_str}"
+                logger.error(f"Unexpected Exception: {e_str}")
+                
+                ex, tb = e, sys.exc_info()[2]
+            finally:
+                # Raise any exception
+                # if ex:
+                #     raise ex.with_traceback(tb)
+                
+                if debug.settings["save_pipes"]:
+                    snapshots.get_writer().close(self.pipe.id)
             
-            self.running = False
-            
-            # Calculate elapsed time
-            now = datetime.now(timezone.utc)
-            now_str = utils.format_datetime(now)
-            
-            elapsed = now - start
-            self.pipe.elapsed = elapsed.total_seconds()
-            
-            # Convert the pipe to AnalysisResult
-            analysis = self.pipe_to_analysis(self.pipe)  # Convert the pipe to AnalysisResult
-            
-            # Save the analysis to a file
-            utils.save_obj(f"logs/analysis/{now_str}_analysis.pkl", analysis)
-            
-            logger.success(f"Analysis finished. Time taken: {elapsed}")
+                if self.interrupted:
+                    return None
+                
+                self.running = False
+                
+                # Calculate elapsed time
+                now = datetime.now(timezone.utc)
+                now_str = utils.format_datetime(now)
+                
+                elapsed = now - start
+                self.pipe.elapsed = (self.pipe.elapsed or 0) + elapsed.total_seconds()  # resumed runs add up
+                
+                # Tokens and cost of this analysis
+                self.update_usage(self.pipe)
+                
+                # Convert the pipe to AnalysisResult
+                analysis = self.pipe_to_analysis(self.pipe)  # Convert the pipe to AnalysisResult
+                
+                # Save the analysis to a file (debugging only, in the background)
+                if debug.settings["save_pipes"]:
+                    snapshots.get_writer().save_obj(f"logs/analysis/{now_str}_analysis.pkl", analysis)
+                
+                logger.success(f"Analysis finished. Time taken: {elapsed}")
+                
+                # Report the final status (if callback is set)
+                self.run_callback()
             
-            # Report the final status (if callback is set)
-            self.run_callback()
-        
-            return analysis
+                return analysis
     
     @phase(id="init")
-    def init(self, pipe: Pipe):
+    def init(self, pipe: Pipe = None):
+        # Per-analysis state
+        self.embeddings_db = embeddings_db.FaissEmbeddingsDatabase()
+        
+        # Clients are created once and reused by the next analyses
+        if self.initialized:
+            logger.debug(f"Reusing the initialized clients.")
+            return
+        
         # Initialize web stuff
         self.scraper = scraper.Scraper([
             scrape.RequestsScraper(),
@@ -158,15 +237,32 @@ class FakeNewsDetector:
         ])
         
         # Initialize domain stuff
-        self.domain_geolocation = geolocation.IpInfoGeolocation()
+        if os.getenv("GEOLOCATION_DB_PATH"):
+            # Local IP-range database, with ipinfo.io for the misses
+            self.domain_geolocation = geolocation.IpRangeGeolocation(
+                fallback=geolocation.IpInfoGeolocation()
+            )
+        else:
+            self.domain_geolocation = geolocation.IpInfoGeolocation()
         
         self.domain_reputation = reputation.VirusTotalReputation()
         
         # Initialize LLM stuff
         self.embeddings = llm.GenericLLM.choose(os.getenv("EMBEDDINGS_MODEL"), os.getenv("EMBEDDINGS_SERVICE"))
         
-        self.llm_pdf = llm.GenericLLM.choose(os.getenv("PDF_MODEL"), os.getenv("PDF_SERVICE")) # LLM with PDF capabilities
-        self.llm_text = llm.GenericLLM.choose(os.getenv("TEXT_MODEL"), os.getenv("TEXT_SERVICE")) # Text-only capabilities (including structured outputs)
+        # Optional fallbacks, used when the main model is rate limited or down
+        self.llm_pdf = llm.GenericLLM.choose(
+            os.getenv("PDF_MODEL"), os.getenv("PDF_SERVICE"),
+            fallback_model=os.getenv("PDF_FALLBACK_MODEL"), fallback_service=os.getenv("PDF_FALLBACK_SERVICE"),
+        ) # LLM with PDF capabilities
+        self.llm_text = llm.GenericLLM.choose(
+            os.getenv("TEXT_MODEL"), os.getenv("TEXT_SERVICE"),
+            fallback_model=os.getenv("TEXT_FALLBACK_MODEL"), fallback_service=os.getenv("TEXT_FALLBACK_SERVICE"),
+        ) # Text-only capabilities (including structured outputs)
+        
+        llm.set_role(self.embeddings, "embeddings")
+        llm.set_role(self.llm_pdf, "pdf")
+        llm.set_role(self.llm_text, "text")
         
         self.article_classifier = ai.ArticleClassifier(llm=self.llm_pdf)
         self.article_parser = ai.ArticleParser(llm=self.llm_pdf)
@@ -184,7 +280,8 @@ class FakeNewsDetector:
         
         # Initialize database
         self.db = db.MongoDatabase()
-        self.embeddings_db = embeddings_db.FaissEmbeddingsDatabase()
+        
+        self.initialized = True
         
         logger.debug(f"Everything initialized successfully.")
     
@@ -202,6 +299,9 @@ class FakeNewsDetector:
         pipe.domain.name = utils.get_domain(pipe.article.url)
         pipe.domain.ip = utils.domain_to_ip(pipe.domain.name)
         
+        if not pipe.domain.ip:
+            raise exceptions.ErrorException("Could not resolve the article's domain.")
+        
         logger.info(f"Domain IP: {pipe.domain.ip}")
         
         # Get geolocation data for the domain
@@ -310,8 +410,16 @@ class FakeNewsDetector:
         
         pipe.search_webpages = []
         
+        # Resolve every domain up front, concurrently, so dead domains can be
+        # skipped before trying to scrape them
+        resolved = network.RESOLVER.resolve_many_sync(
+            utils.get_domain(r.url) for r in pipe.search_results
+        )
+        
         # Process search results
         for i, search_result in enumerate(pipe.search_results):
+            self.check_cancelled()
+            
             # Clean the URL
             url = utils.clean_url(search_result.url)
             search_result.url = url
@@ -326,6 +434,7 @@ class FakeNewsDetector:
             wp = self.db.get_webpage(
                 url=search_result.url,
             )
+            telemetry.cache_lookup("webpages", wp is not None)
             
             if wp:
                 # Found in cache, skip processing
@@ -340,6 +449,10 @@ class FakeNewsDetector:
             # Not found. Process the search result
             search_result.domain_name = utils.get_domain(search_result.url)
             
+            if not resolved.get(search_result.domain_name):
+                logger.warning(f"Domain {search_result.domain_name} does not resolve. Skipping...")
+                continue
+            
             # Download the page content
             scrape_result = self.scraper.scrape(search_result.url, format=scraper.Format.HTML)
             
@@ -511,17 +624,26 @@ class FakeNewsDetector:
         # Check the domain's reputation
         pipe.has_bad_reputation = pipe.domain_reputation <= -3
         
-        # Get total token usage
-        pdf_input_usage, pdf_output_usage = self.llm_pdf.get_usage()
-        text_input_usage, text_output_usage = self.llm_text.get_usage()
-        
-        pipe.pdf_input_usage = pdf_input_usage
-        pipe.pdf_output_usage = pdf_output_usage
-        pipe.text_input_usage = text_input_usage
-        pipe.text_output_usage = text_output_usage
-        
-        logger.debug(f"Multimodal model {self.llm_pdf.get_model()} used {pdf_input_usage} input tokens and {pdf_output_usage} output tokens.")
-        logger.debug(f"Text-only model {self.llm_text.get_model()} used {text_input_usage} input tokens and {text_output_usage} output tokens.")
+    def update_usage(self, pipe: Pipe):
+        """
+        Add up the usage records of an analysis into its token and cost totals.
+        """
+        pdf = usage.summarize(pipe.usage, role="pdf")
+        text = usage.summarize(pipe.usage, role="text")
+        embeddings = usage.summarize(pipe.usage, role="embeddings")
+        
+        pipe.pdf_input_usage = pdf["input_tokens"]
+        pipe.pdf_output_usage = pdf["output_tokens"]
+        pipe.pdf_cached_usage = pdf["cached_tokens"]
+        pipe.text_input_usage = text["input_tokens"]
+        pipe.text_output_usage = text["output_tokens"]
+        pipe.text_cached_usage = text["cached_tokens"]
+        pipe.embeddings_usage = embeddings["input_tokens"]
+        pipe.cost = usage.summarize(pipe.usage)["cost"]
+        
+        logger.debug(f"Multimodal model used {pipe.pdf_input_usage} input tokens ({pipe.pdf_cached_usage} cached) and {pipe.pdf_output_usage} output tokens.")
+        logger.debug(f"Text-only model used {pipe.text_input_usage} input tokens ({pipe.text_cached_usage} cached) and {pipe.text_output_usage} output tokens.")
+        logger.debug(f"Embeddings used {pipe.embeddings_usage} tokens. Estimated cost: {'-' if pipe.cost is None else f'${pipe.cost:.4f}'}")
         
     def pipe_to_analysis(self, pipe: Pipe) -> AnalysisResult:
         assert pipe.phase, "The pipe phase is not set. Please run the detection process first."
@@ -598,6 +720,23 @@ class FakeNewsDetector:
         """
         return self.running
     
+    def set_cancel_event(self, event):
+        """
+        Set an event that cancels the detection when set.
+        
+        :param event: The event, checked before every phase and search result.
+        """
+        self.cancel_event = event
+        
+    def check_cancelled(self):
+        """
+        Stop the detection if it has been cancelled.
+        
+        :raises CancelledException: If the cancel event is set.
+        """
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise exceptions.CancelledException("The analysis was cancelled.")
+    
     def register_callback(self, callback: callable):
         """
         Set a callback function to be called when the detection is finished.
@@ -610,12 +749,9 @@ class FakeNewsDetector:
         """
         Run the callback function with the serialized pipe.
         """
-        if self.callback:
-            if self.pipe:
-                serialized_analysis = self.get_serialized_analysis(self.pipe)
-                self.callback(serialized_analysis)
-                
-            self.callback(None)  
+        if self.callback and self.pipe:
+            serialized_analysis = self.get_serialized_analysis(self.pipe)
+            self.callback(serialized_analysis)
             
     def get_pipe(self) -> Pipe:
         """
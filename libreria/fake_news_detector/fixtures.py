@@ -0,0 +1,321 @@
+from typing import Any, Callable, Dict
+from loguru import logger
+from datetime import date, datetime
+from enum import Enum
+from pydantic import BaseModel
+import dataclasses
+import functools
+import threading
+import hashlib
+import inspect
+import pickle
+import types
+import json
+import time
+import os
+
+import fake_news_detector.exceptions as exceptions
+import fake_news_detector.telemetry as telemetry
+import fake_news_detector.usage as usage
+
+# Record every external interaction of an analysis (scrapes, LLM responses,
+# embeddings, search, DNS, domain services, cache) and serve them back later,
+# so FakeNewsDetector.run can be benchmarked without network.
+#
+#   FIXTURES_MODE=record  Call the services and store their answers
+#   FIXTURES_MODE=replay  Answer from the store only. Unknown calls fail
+#   FIXTURES_MODE=off     Default
+#
+#   FIXTURES_PATH=fixtures/
+#   FIXTURES_LATENCY=0.2 | llm=1.5,scrape=0.3,*=0.1 | recorded
+#       Artificial latency of the replayed calls, in seconds, for all the
+#       services or per service. "recorded" waits as long as the original call.
+
+FIXTURES_MODES = ["off", "record", "replay"]
+DEFAULT_FIXTURES_PATH = "fixtures/"
+RECORDED_LATENCY = "recorded"
+
+def _canonical(obj: Any) -> Any:
+    """
+    Turn the arguments of a call into stable JSON-like data, so the same call
+    gets the same key in every run.
+    """
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, bytes):
+        return hashlib.sha256(obj).hexdigest()
+    if isinstance(obj, Enum):
+        return f"{type(obj).__qualname__}.{obj.value}"
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, type):
+        return f"{obj.__module__}.{obj.__qualname__}"
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if isinstance(obj, (set, frozenset)):
+        return sorted((_canonical(v) for v in obj), key=json.dumps)
+    if isinstance(obj, BaseModel):
+        return _canonical(obj.model_dump())
+    if dataclasses.is_dataclass(obj):
+        return _canonical(dataclasses.asdict(obj))
+    if callable(obj) and hasattr(obj, "__qualname__"):
+        return obj.__qualname__
+    if hasattr(obj, "__dict__"):
+        return {"type": type(obj).__qualname__, **_canonical(vars(obj))}
+    return repr(obj)
+
+def fingerprint(name: str, instance: Any, arguments: Dict[str, Any]) -> str:
+    """
+    Get the key of a call.
+
+    Args:
+        name (str): The qualified name of the called method.
+        instance (Any): The service object. Only its model (if any) is part of the key.
+        arguments (Dict[str, Any]): The bound arguments, without self.
+
+    Returns:
+        str: A SHA-256 hex digest.
+    """
+    call = {
+        "name": name,
+        "model": getattr(instance, "model", None),
+        "arguments": _canonical(arguments),
+    }
+    data = json.dumps(call, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def parse_latency(value: str) -> Dict[str, Any]:
+    """
+    Parse FIXTURES_LATENCY.
+
+    Returns:
+        Dict[str, Any]: Seconds (or RECORDED_LATENCY) per service, "*" for the rest.
+    """
+    latency = {}
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+
+        service, _, seconds = item.rpartition("=")
+        seconds = seconds.strip()
+        latency[service.strip() or "*"] = seconds if seconds == RECORDED_LATENCY else float(seconds)
+
+    return latency
+
+class FixtureStore:
+    """
+    Content-addressed store of recorded calls: <path>/<service>/<key>.pkl.
+
+    Each file keeps the result (or the raised exception), the time the real
+    call took, the token usage it added to its LLM and its usage records.
+    """
+    def __init__(self, mode: str = "off", path: str = DEFAULT_FIXTURES_PATH, latency: str = None):
+        assert mode in FIXTURES_MODES, f"FIXTURES_MODE must be one of {FIXTURES_MODES}"
+
+        self.mode = mode
+        self.path = path
+        self.latency = parse_latency(latency)
+
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+        if self.mode != "off":
+            logger.info(f"Fixtures in {self.mode} mode at {self.path}")
+
+    def filepath(self, service: str, key: str) -> str:
+        return os.path.join(self.path, service, f"{key}.pkl")
+
+    def load(self, service: str, key: str) -> Dict | None:
+        try:
+            with open(self.filepath(service, key), "rb") as f:
+                fixture = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return fixture
+
+    def save(self, service: str, key: str, fixture: Dict):
+        path = self.filepath(service, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Batch workers may record the same call at once
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(fixture, f)
+        os.replace(tmp, path)
+
+        self.recorded += 1
+
+    def delay(self, service: str, fixture: Dict):
+        """
+        Wait the artificial latency of a replayed call.
+        """
+        latency = self.latency.get(service, self.latency.get("*", 0))
+        if latency == RECORDED_LATENCY:
+            latency = fixture.get("elapsed", 0)
+
+        if latency:
+            time.sleep(latency)
+
+_store: FixtureStore = None
+_store_lock = threading.Lock()
+
+def get_store() -> FixtureStore:
+    """
+    Get the fixture store configured by the environment. It is created on
+    first use, after debug.setup() has loaded the .env file.
+    """
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            _store = FixtureStore(
+                mode=os.getenv("FIXTURES_MODE", "off").strip().lower() or "off",
+                path=os.getenv("FIXTURES_PATH", DEFAULT_FIXTURES_PATH),
+                latency=os.getenv("FIXTURES_LATENCY"),
+            )
+        return _store
+
+def set_store(store: FixtureStore):
+    """
+    Replace the fixture store (e.g. to record a benchmark from code).
+    """
+    global _store
+    with _store_lock:
+        _store = store
+
+def _usage(instance: Any) -> tuple | None:
+    if hasattr(instance, "input_usage") and hasattr(instance, "output_usage"):
+        return instance.input_usage, instance.output_usage
+    return None
+
+def recorded(service: str) -> Callable:
+    """
+    Record or replay the calls of a method that talks to an external service.
+
+    It must be above the retry decorators, so retries and waits are skipped
+    in replay mode.
+
+    Args:
+        service (str): The folder of the fixtures, and the name used by FIXTURES_LATENCY.
+    """
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            store = get_store()
+            if store.mode == "off":
+                return func(self, *args, **kwargs)
+
+            # Generators can only be read once
+            args = [list(a) if isinstance(a, types.GeneratorType) else a for a in args]
+            kwargs = {k: list(v) if isinstance(v, types.GeneratorType) else v for k, v in kwargs.items()}
+
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(list(bound.arguments.items())[1:])  # without self
+
+            key = fingerprint(func.__qualname__, self, arguments)
+
+            if store.mode == "replay":
+                fixture = store.load(service, key)
+                telemetry.cache_lookup(f"fixtures.{service}", fixture is not None)
+                if fixture is None:
+                    raise exceptions.MissingFixtureError(f"No {service} fixture for {func.__qualname__} ({key[:12]})")
+
+                store.delay(service, fixture)
+
+                if fixture["usage"] and _usage(self):
+                    input_usage, output_usage = _usage(self)
+                    self.input_usage = input_usage + fixture["usage"][0]
+                    self.output_usage = output_usage + fixture["usage"][1]
+
+                # Usage records of the call, in the current analysis and phase
+                if fixture.get("records") is not None:
+                    usage.replay(fixture["records"])
+                elif fixture["usage"]:
+                    # Recorded before the usage records
+                    usage.record(getattr(self, "model", None), getattr(self, "role", None), *fixture["usage"])
+
+                if fixture["exception"] is not None:
+                    raise fixture["exception"]
+                return fixture["result"]
+
+            # Record
+            before = _usage(self)
+            start = time.perf_counter()
+            fixture = {"name": func.__qualname__, "result": None, "exception": None}
+            try:
+                with usage.capture() as captured:
+                    fixture["result"] = func(self, *args, **kwargs)
+                return fixture["result"]
+            except Exception as e:
+                fixture["exception"] = e
+                raise
+            finally:
+                fixture["elapsed"] = time.perf_counter() - start
+                fixture["records"] = captured.records
+
+                after = _usage(self)
+                fixture["usage"] = (after[0] - before[0], after[1] - before[1]) if before else None
+
+                try:
+                    store.save(service, key, fixture)
+                except Exception as e:
+                    logger.warning(f"Could not record the {service} call {func.__qualname__}: {e}")
+
+        return wrapper
+    return decorator
+
+if __name__ == "__main__":
+    import tempfile
+
+    def test_record_replay():
+        class Service:
+            model = "test"
+            input_usage = 0
+            output_usage = 0
+
+            def __init__(self):
+                self.calls = 0
+
+            @recorded("test")
+            def call(self, prompt: str, temperature: float = None):
+                self.calls += 1
+                self.input_usage += len(prompt)
+                if prompt == "fail":
+                    raise ValueError("Failed")
+                return prompt.upper()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            set_store(FixtureStore("record", tmp))
+            service = Service()
+            assert service.call("hello") == "HELLO"
+            try:
+                service.call("fail")
+            except ValueError:
+                pass
+
+            set_store(FixtureStore("replay", tmp, latency="test=0.01"))
+            service = Service()
+            assert service.call(prompt="hello", temperature=None) == "HELLO"
+            assert service.calls == 0 and service.input_usage == 5
+            try:
+                service.call("fail")
+                assert False
+            except ValueError:
+                pass
+            try:
+                service.call("other")
+                assert False
+            except exceptions.MissingFixtureError:
+                pass
+        print("Fixtures test passed")
+    #test_record_replay()
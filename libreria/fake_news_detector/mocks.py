@@ -20,7 +20,7 @@ def set_mocks(obj):
         pipe.article.title = ARTICLE_TITLE
         
         pipe.article_html = utils.load(MOCK_BASE + "article.html")
-        pipe.article_pdf = utils.load_b64(MOCK_BASE + "article.pdf")
+        pipe.article_pdf = utils.load_binary(MOCK_BASE + "article.pdf")
     obj.mock_download_article = mock_download_article
     
     def mock_parse_article(pipe):
@@ -1,5 +1,25 @@
 import random
+import asyncio
+import ipaddress
+import threading
+import socket
+import time
+from typing import Dict, List, Iterable, Tuple
 from fake_useragent import UserAgent
+from loguru import logger
+
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+
+import fake_news_detector.fixtures as fixtures
+import fake_news_detector.telemetry as telemetry
+
+DNS_TIMEOUT = 5  # seconds
+DNS_MIN_TTL = 30  # seconds
+DNS_MAX_TTL = 60 * 60  # seconds
+DNS_NEGATIVE_TTL = 60  # seconds, for domains that don't resolve
+DNS_CONCURRENCY = 32
 
 def get_useragent() -> str:
     """
@@ -8,10 +28,194 @@ def get_useragent() -> str:
     ua = UserAgent()
     return ua.random
 
+class DnsResolver:
+    """
+    Asynchronous DNS resolver with a TTL-aware cache.
+
+    A and AAAA records are queried concurrently. Entries expire after the
+    record's TTL (clamped between DNS_MIN_TTL and DNS_MAX_TTL). Failed lookups
+    are cached for DNS_NEGATIVE_TTL seconds.
+
+    IP literals are returned as they are, and names that DNS doesn't know
+    (/etc/hosts...) go through the system resolver.
+    """
+    def __init__(self, timeout: float = DNS_TIMEOUT, concurrency: int = DNS_CONCURRENCY):
+        self.timeout = timeout
+        self.concurrency = concurrency
+
+        self.cache: Dict[str, Tuple[float, List[str]]] = {}
+        self.lock = threading.Lock()
+
+        # For the blocking calls made from a running event loop
+        self.loop: asyncio.AbstractEventLoop = None
+
+    async def resolve(self, domain: str) -> List[str]:
+        """
+        Resolve a domain to its IP addresses.
+
+        Args:
+            domain (str): The domain to resolve.
+
+        Returns:
+            List[str]: IPv4 addresses first, then IPv6. Empty if it doesn't resolve.
+        """
+        literal = ip_literal(domain)
+        if literal is not None:
+            return [literal]
+
+        cached = self._get_cached(domain)
+        if cached is not None:
+            return cached
+
+        # A new resolver per call, as they are bound to the running event loop
+        resolver = dns.asyncresolver.Resolver()
+
+        answers = await asyncio.gather(
+            self._query(resolver, domain, "A"),
+            self._query(resolver, domain, "AAAA"),
+        )
+
+        ips = [ip for addresses, _ in answers for ip in addresses]
+        ttls = [ttl for addresses, ttl in answers if addresses]
+
+        if ips:
+            ttl = min(max(min(ttls), DNS_MIN_TTL), DNS_MAX_TTL)
+        else:
+            ips = await self._system_resolve(domain)
+            ttl = DNS_MIN_TTL if ips else DNS_NEGATIVE_TTL
+
+        with self.lock:
+            self.cache[domain] = (time.monotonic() + ttl, ips)
+
+        logger.debug(f"Resolved '{domain}' to {ips} (TTL: {ttl}s)")
+
+        return ips
+
+    async def resolve_many(self, domains: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Resolve several domains concurrently.
+
+        Args:
+            domains (Iterable[str]): The domains to resolve.
+
+        Returns:
+            Dict[str, List[str]]: The IP addresses of each domain.
+        """
+        unique = list(dict.fromkeys(domains))
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def resolve_one(domain: str) -> List[str]:
+            async with semaphore:
+                return await self.resolve(domain)
+
+        results = await asyncio.gather(*(resolve_one(d) for d in unique))
+
+        return dict(zip(unique, results))
+
+    @telemetry.external("dns")
+    @fixtures.recorded("dns")
+    def resolve_sync(self, domain: str) -> List[str]:
+        """
+        Blocking version of resolve(), for code running outside an event loop.
+        """
+        literal = ip_literal(domain)
+        if literal is not None:
+            return [literal]
+
+        cached = self._get_cached(domain)
+        if cached is not None:
+            return cached
+
+        return self._run(self.resolve(domain))
+
+    @telemetry.external("dns")
+    @fixtures.recorded("dns")
+    def resolve_many_sync(self, domains: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Blocking version of resolve_many(), for code running outside an event loop.
+        """
+        return self._run(self.resolve_many(domains))
+
+    def clear(self):
+        """
+        Clear the cache.
+        """
+        with self.lock:
+            self.cache.clear()
+
+    def _run(self, coroutine):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+
+        # asyncio.run can't be nested (e.g. in the backend), use a loop of our own
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="dns-resolver", daemon=True).start()
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _system_resolve(self, domain: str) -> List[str]:
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(domain, None, type=socket.SOCK_STREAM)
+        except (socket.gaierror, UnicodeError, OSError):
+            return []
+
+        ips = list(dict.fromkeys(info[4][0] for info in infos))
+        return [ip for ip in ips if ":" not in ip] + [ip for ip in ips if ":" in ip]
+
+    def _get_cached(self, domain: str) -> List[str] | None:
+        with self.lock:
+            entry = self.cache.get(domain)
+
+        if entry is None:
+            return None
+
+        expires, ips = entry
+        if time.monotonic() >= expires:
+            return None
+
+        return ips
+
+    async def _query(self, resolver: "dns.asyncresolver.Resolver", domain: str, rdtype: str) -> Tuple[List[str], int]:
+        try:
+            answer = await resolver.resolve(domain, rdtype, lifetime=self.timeout)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, dns.resolver.NoNameservers):
+            return [], 0
+        except dns.exception.Timeout:
+            logger.warning(f"Timed out resolving {rdtype} record for '{domain}'")
+            return [], 0
+        except dns.exception.DNSException as e:
+            logger.warning(f"Could not resolve {rdtype} record for '{domain}': {e.__class__.__name__}: {e}")
+            return [], 0
+
+        return [r.address for r in answer], answer.rrset.ttl
+
+def ip_literal(host: str) -> str | None:
+    """
+    Get the address of a host that is already an IP (1.2.3.4, [::1]), or None.
+    """
+    try:
+        return str(ipaddress.ip_address(host.strip("[]")))
+    except ValueError:
+        return None
+
+# Shared by the whole process, so every caller benefits from the cache
+RESOLVER = DnsResolver()
+
 # Test
 if __name__ == "__main__":
     # useragent
     def test_useragent():
         user_agent = get_useragent()
         print(user_agent)
-    test_useragent()
\ No newline at end of file
+    test_useragent()
+
+    def test_resolve():
+        assert RESOLVER.resolve_sync("1.2.3.4") == ["1.2.3.4"]
+        assert "127.0.0.1" in RESOLVER.resolve_sync("localhost")
+        print(RESOLVER.resolve_sync("example.com"))
+        print(RESOLVER.resolve_many_sync(["elpais.com", "google.com", "doesnotexist.invalid"]))
+    #test_resolve()
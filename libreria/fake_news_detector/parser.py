@@ -1,47 +1,324 @@
 import markitdown
+from markitdown.converters import HtmlConverter
 from loguru import logger
 import io
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+import lxml.etree
+import lxml.html
+
+# Lines dropped from the converted Markdown (lists and callouts)
+SKIPPED_PREFIXES = ("*", "+", "[!")
+
+# Tags that never hold article content
+JUNK_TAGS = [
+    "script", "style", "noscript", "iframe", "svg", "canvas", "template",
+    "form", "button", "input", "select", "textarea",
+    "nav", "footer", "aside",
+]
+
+# Readability-style class/id hints
+UNLIKELY_CANDIDATES = re.compile(
+    r"banner|breadcrumb|combx|comment|community|cookie|disqus|extra|foot|header|legal|"
+    r"menu|modal|newsletter|outbrain|pager|pagination|popup|promo|related|remark|"
+    r"share|shoutbox|sidebar|social|sponsor|subscri|taboola|tags|tool|widget|ad-|ads",
+    re.IGNORECASE,
+)
+MAYBE_CANDIDATE = re.compile(r"and|article|body|column|content|main|shadow|story|text", re.IGNORECASE)
+POSITIVE_HINTS = re.compile(r"article|body|content|entry|hentry|main|page|post|story|text", re.IGNORECASE)
+NEGATIVE_HINTS = re.compile(
+    r"combx|comment|contact|foot|footer|footnote|masthead|media|meta|outbrain|promo|"
+    r"related|scroll|share|shoutbox|sidebar|skyscraper|sponsor|shopping|tags|tool|widget",
+    re.IGNORECASE,
+)
+
+SCORED_TAGS = ("p", "pre", "td", "blockquote")
+
+HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+MIN_PARAGRAPH_LENGTH = 25  # characters
+MIN_ARTICLE_LENGTH = 250  # characters, below this the whole page is converted
+SIBLING_SCORE_RATIO = 0.2
+
+MD_CACHE_SIZE = 64  # converted pages kept in memory
+
+class ContentExtractor:
+    """
+    Readability-style main content extractor.
+
+    Paragraphs are scored by their length and number of commas, and the scores
+    are propagated to their parent and grandparent. The best-scoring container,
+    weighted by its link density, is taken as the article, together with the
+    siblings that score close to it.
+    """
+
+    def extract(self, html: str) -> str:
+        """
+        Extract the main content of a webpage.
+
+        Args:
+            html (str): The full HTML of the page.
+
+        Returns:
+            str: A compact HTML document with only the article, or the original
+            HTML if no article could be found.
+        """
+        try:
+            # Encode first, as lxml refuses str input with an encoding declaration
+            doc = lxml.html.document_fromstring(html.encode("utf-8"), parser=HTML_PARSER)
+        except (lxml.etree.ParserError, ValueError) as e:
+            logger.warning(f"Could not parse the HTML: {e}")
+            return html
+
+        json_body = self._json_ld_body(doc)
+
+        title = doc.find(".//h1")
+        title_html = lxml.html.tostring(title, encoding="unicode", with_tail=False) if title is not None else ""
+
+        lxml.etree.strip_elements(doc, *JUNK_TAGS, lxml.etree.Comment, with_tail=False)
+        self._remove_unlikely(doc)
+
+        article = self._best_candidate(doc)
+        article_text = article.text_content().strip() if article is not None else ""
+
+        # Paywalled pages usually ship the full text in their JSON-LD metadata
+        if json_body and len(json_body) > len(article_text):
+            logger.debug(f"Using the JSON-LD article body ({len(json_body)} characters)")
+            paragraphs = "".join(f"<p>{self._escape(p)}</p>" for p in json_body.split("\n") if p.strip())
+            return f"<html><body>{title_html}<article>{paragraphs}</article></body></html>"
+
+        if len(article_text) < MIN_ARTICLE_LENGTH:
+            logger.debug(f"No main content found. Using the whole page.")
+            return lxml.html.tostring(doc, encoding="unicode")
+
+        article_html = lxml.html.tostring(article, encoding="unicode", with_tail=False)
+
+        # Keep the headline if it lives outside the article container
+        if title_html and article.find(".//h1") is None and article.tag != "h1":
+            article_html = title_html + article_html
+
+        logger.debug(f"Extracted {len(article_text)} characters of main content from {len(html)} characters of HTML")
+
+        return f"<html><body>{article_html}</body></html>"
+
+    def _remove_unlikely(self, doc: "lxml.html.HtmlElement"):
+        to_remove = []
+        for el in doc.iter(lxml.etree.Element):
+            if el.tag in ("html", "body", "article", "main"):
+                continue
+
+            hints = f"{el.get('class', '')} {el.get('id', '')}"
+            if not hints.strip():
+                continue
+
+            if UNLIKELY_CANDIDATES.search(hints) and not MAYBE_CANDIDATE.search(hints):
+                to_remove.append(el)
+
+        for el in to_remove:
+            # Ancestors may already have been removed
+            if el.getparent() is not None:
+                el.drop_tree()
+
+    def _best_candidate(self, doc: "lxml.html.HtmlElement") -> "lxml.html.HtmlElement":
+        scores: Dict["lxml.html.HtmlElement", float] = {}
+
+        for el in doc.iter(*SCORED_TAGS):
+            text = el.text_content().strip()
+            if len(text) < MIN_PARAGRAPH_LENGTH:
+                continue
+
+            score = 1 + text.count(",") + min(len(text) / 100, 3)
+
+            parent = el.getparent()
+            if parent is None:
+                continue
+
+            grandparent = parent.getparent()
+
+            for node, weight in ((parent, 1), (grandparent, 0.5)):
+                if node is None or not isinstance(node.tag, str):
+                    continue
+
+                if node not in scores:
+                    scores[node] = self._class_weight(node)
+
+                scores[node] += score * weight
+
+        if not scores:
+            return None
+
+        # Penalize containers made mostly of links
+        for node in scores:
+            scores[node] *= 1 - self._link_density(node)
+
+        best = max(scores, key=scores.get)
+        best_score = scores[best]
+
+        parent = best.getparent()
+        if parent is None:
+            return best
+
+        # Join the siblings that look like part of the same article
+        threshold = max(10, best_score * SIBLING_SCORE_RATIO)
+        siblings: List["lxml.html.HtmlElement"] = []
+        for sibling in parent:
+            if not isinstance(sibling.tag, str):
+                continue
+
+            if sibling == best or scores.get(sibling, 0) >= threshold:
+                siblings.append(sibling)
+            elif sibling.tag == "p":
+                text = sibling.text_content().strip()
+                if len(text) > 80 and self._link_density(sibling) < 0.25:
+                    siblings.append(sibling)
+
+        if len(siblings) == 1:
+            return best
+
+        container = lxml.html.Element("div")
+        for sibling in siblings:
+            container.append(sibling)  # moves the element
+
+        return container
+
+    def _class_weight(self, el: "lxml.html.HtmlElement") -> float:
+        weight = 0
+        for hint in (el.get("class"), el.get("id")):
+            if not hint:
+                continue
+            if NEGATIVE_HINTS.search(hint):
+                weight -= 25
+            if POSITIVE_HINTS.search(hint):
+                weight += 25
+
+        if el.tag == "article":
+            weight += 10
+
+        return weight
+
+    def _link_density(self, el: "lxml.html.HtmlElement") -> float:
+        length = len(el.text_content())
+        if length == 0:
+            return 0
+
+        link_length = sum(len(a.text_content()) for a in el.iter("a"))
+        return link_length / length
+
+    def _json_ld_body(self, doc: "lxml.html.HtmlElement") -> str | None:
+        for script in doc.iter("script"):
+            if script.get("type") != "application/ld+json" or not script.text:
+                continue
+
+            try:
+                data = json.loads(script.text)
+            except json.JSONDecodeError:
+                continue
+
+            items = data if isinstance(data, list) else [data]
+            if isinstance(data, dict) and isinstance(data.get("@graph"), list):
+                items = data["@graph"]
+
+            for item in items:
+                if isinstance(item, dict) and isinstance(item.get("articleBody"), str):
+                    return item["articleBody"].strip()
+
+        return None
+
+    @staticmethod
+    def _escape(text: str) -> str:
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
 
 class Parser:
-    def __init__(self):
+    def __init__(self, cache_size: int = MD_CACHE_SIZE):
+        # Only HTML is ever converted, so skip the other converters and plugins
         self.markitdown = markitdown.MarkItDown(
-            enable_plugins=True,
-            enable_builtins=True,
+            enable_plugins=False,
+            enable_builtins=False,
+        )
+        self.markitdown.register_converter(HtmlConverter())
+        self.stream_info = markitdown.StreamInfo(
+            mimetype="text/html",
+            extension=".html",
+            charset="utf-8",
         )
-            
+
+        self.extractor = ContentExtractor()
+
+        # HTML -> Markdown results, by content hash
+        self.cache: OrderedDict[str, str] = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
     def html_to_md(self, html: str) -> str:
         """
-        Convert HTML to Markdown using MarkItdown.
+        Convert the main content of an HTML page to Markdown using MarkItdown.
+        Results are memoized, so the same page is only converted once.
         """
+        key = hashlib.blake2b(html.encode("utf-8"), digest_size=16).hexdigest()
+
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                logger.debug(f"HTML to Markdown cache hit")
+                return self.cache[key]
+
+        md = self._convert(html)
+
+        with self.lock:
+            self.cache[key] = md
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return md
+
+    def _convert(self, html: str) -> str:
+        # Drop navigation, footers, related articles...
+        content = self.extractor.extract(html)
+
         # Convert the HTML to a fake BinaryIO object
-        html_b = io.BytesIO(html.encode("utf-8"))
-        
-        md = self.markitdown.convert(html_b)
-        
-        # Remove any line starting with *
-        processed_md = ""
-        for line in md.markdown.splitlines():
-            trimmed_line = line.strip()
-            if trimmed_line.startswith("*") or trimmed_line.startswith("+") or trimmed_line.startswith("[!"):
-                continue
-            
-            processed_md += line + "\n"
-        
-        # Remove duplicate newlines
+        html_b = io.BytesIO(content.encode("utf-8"))
+
+        md = self.markitdown.convert_stream(html_b, stream_info=self.stream_info)
+
+        # Remove lists, callouts and empty lines
         processed_md = "\n".join(
-            line for line in processed_md.splitlines() if line.strip()
+            line for line in md.markdown.splitlines()
+            if line.strip() and not line.strip().startswith(SKIPPED_PREFIXES)
         )
-        
+
         return processed_md.strip()
-    
+
+_parser: Parser = None
+_parser_lock = threading.Lock()
+
+def get_parser() -> Parser:
+    """
+    Get the shared Parser, creating it on first use.
+
+    Returns:
+        Parser: The parser shared by the whole process.
+    """
+    global _parser
+
+    if _parser is None:
+        with _parser_lock:
+            if _parser is None:
+                _parser = Parser()
+
+    return _parser
+
 if __name__ == "__main__":
     import sys
     sys.path.append(".")
-    
+
     # Example usage
     parser = Parser()
     with open("dummy/noticia.html", "r") as f:
         html_content = f.read()
     markdown_content = parser.html_to_md(html_content)
     print(markdown_content)  # Output: # Hello World\n\nThis is a test.
-    print(f"length: {len(markdown_content)}") # 72812
\ No newline at end of file
+    print(f"length: {len(markdown_content)}") # 72812
@@ -1,6 +1,18 @@
 from loguru import logger
+import time
 
 import fake_news_detector.debug as debug
+import fake_news_detector.snapshots as snapshots
+import fake_news_detector.exceptions as exceptions
+import fake_news_detector.telemetry as telemetry
+import fake_news_detector.usage as usage
+
+# Span outcome of the phases that raise
+OUTCOMES = {
+    exceptions.RefusalException: "refusal",
+    exceptions.ErrorException: "error",
+    exceptions.CancelledException: "cancelled",
+}
 
 def phase(id: str, monitor: bool = False):
     """
@@ -24,16 +36,43 @@ def phase(id: str, monitor: bool = False):
             obj = args[0]
             pipe = args[1] # pipe arg
             
+            # Stop here if the analysis was cancelled
+            obj.check_cancelled()
+            
             logger.info(f"Starting phase: {id}")
             
             pipe.phase = id
             
             # Execute the function
-            ret = func(*args, **kwargs)
+            start = time.perf_counter()
+            
+            # Usage records of the analysis, from this phase on
+            usage.set_phase(id)
+            tracker = usage.current()
+            first = len(tracker.records) if tracker else 0
+            
+            with telemetry.span("phase", phase=id, url=pipe.article.url) as span:
+                try:
+                    ret = func(*args, **kwargs)
+                except Exception as e:
+                    span.outcome = OUTCOMES.get(type(e), "exception")
+                    raise
+                finally:
+                    # Also time the phases that fail
+                    if pipe.timings is not None:
+                        pipe.timings[id] = time.perf_counter() - start
+
+                    if tracker:
+                        tokens = usage.summarize(tracker.records[first:])
+                        span.set(input_tokens=tokens["input_tokens"], output_tokens=tokens["output_tokens"], cached_tokens=tokens["cached_tokens"])
+
+            # A resumed analysis can skip this phase
+            if id != "init" and pipe.completed_phases is not None and id not in pipe.completed_phases:
+                pipe.completed_phases.append(id)
 
-            # Save the pipe state
-            if id != "init":
-                debug.save_pipe(pipe, name=id)
+            # Save the pipe state (in the background, only the changes)
+            if id != "init" and debug.settings["save_pipes"]:
+                snapshots.get_writer().capture(pipe, id)
             
             # Check if the phase returned something
             if ret:
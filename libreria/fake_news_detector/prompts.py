@@ -7,12 +7,20 @@ class Prompt():
     user: Optional[str | list[str]] = None
     temperature: float = None
 
+# Shared by every call about the PDF of an article, so they have the same
+# cacheable prefix (system prompt and PDF). The task goes in the user message
+PDF_DOCUMENT = Prompt(
+    system = "I will give you the PDF dump of a webpage, and a task about it.",
+)
+
 ARTICLE_CLASSIFICATION = Prompt(
+    system = PDF_DOCUMENT.system,
     user = "Classify this PDF dump of a webpage, to see if it's an article from a newspaper or not."
 )
 
 PDF_HTML_TO_STRUCTURED = Prompt(
-    system = """\
+    system = PDF_DOCUMENT.system,
+    user = """\
 I will give you a markdown and a PDF file. Your goal is to parse the contents of the article to the provided JSON format. Focus on the content inside the article, and discard anything else.
 Include any image present inside the article, as well as a brief description of it inside the alt text field.
 Don't explain anything, only parse the article and it's contents. Use the same language as the article.
@@ -25,8 +33,10 @@ The Markdown format must be the following:
 article content
 [Alt Text](URL)
 ![Image Alt Text](Image URL)
-> cites or tweets""",
-    #user="<place your markdown here>"
+> cites or tweets
+
+--- Markdown
+{markdown}""",
 )
 
 QUESTION_GENERATION = Prompt(
@@ -35,7 +45,8 @@ QUESTION_GENERATION = Prompt(
 
 COMPARISON = Prompt(
     system = 'I will give you two texts, and you have to compare them and indicate "verified" if both say similar information, "unverified" if they don\'t match, or "unrelated" if both text have no relation.',
-    user = "--- Text 1\n{text1}\n\n--- Text 2\n{text2}",
+    # Separate messages, article first: the comparisons of an article share a cacheable prefix
+    user = ["--- Text 1\n{text1}", "--- Text 2\n{text2}"],
     temperature=0.5
 )
 
@@ -52,13 +63,14 @@ CONCLUSION_GENERATION = Prompt(
     system= """Analiza las fuentes y compáralas con el contenido del artículo original. Escribe muy brevemente en qué partes coinciden y en cuáles difieren. Cita las fuentes únicamente con [] y el número correspondiente. No uses coletillas ni escribas conclusiones o resúmenes al final. Un solo párrafo. Pon en negrita las palabras más importantes.""",
     # user = None # Built at runtime
     user = [
-        """--- Noticia Original: {article}\n\n--- Fuentes Consultadas:\n{sources}""",
+        """--- Noticia Original: {article}""",
+        """--- Fuentes Consultadas:\n{sources}""",
         "Resumen"
     ],
     temperature=0
 )
 
 GRAMMAR_CLASSIFICATION = Prompt(
-    system = """Comprueba si el texto dentro de este archivo HTML contiene alguna falta de ortografía o algún error de gramática. No incluyas errores por tildes. Indica brévemente dónde (si las hubiera). No expliques nada.""",
+    system = """Comprueba si el texto de este artículo contiene alguna falta de ortografía o algún error de gramática. No incluyas errores por tildes. Indica brévemente dónde (si las hubiera). No expliques nada.""",
     temperature=0
 )
\ No newline at end of file
@@ -0,0 +1,417 @@
+from typing import Any, Callable, Dict, List, Tuple
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from loguru import logger
+import threading
+import random
+import time
+import re
+import os
+
+import fake_news_detector.telemetry as telemetry
+
+# Client-side rate limiting of the LLM endpoints.
+#
+# Every (endpoint, model) has a limiter shared by the threads of the process:
+#  - Calls reserve their estimated tokens in a one-minute window and wait for
+#    room, instead of being rejected by the provider
+#  - A 429 pauses the endpoint for its Retry-After (or a jittered backoff) and
+#    shrinks the budget, which grows back with every successful call
+#  - Other transient errors (5xx, timeouts) are retried with full-jitter
+#    exponential backoff
+#
+# Nothing waits on the terminal. When the retries run out, the LLM fails over
+# to its fallback model, if any (PDF_FALLBACK_MODEL, TEXT_FALLBACK_MODEL...).
+#
+#   LLM_TPM_LIMIT=200000                    Tokens per minute of every model (0: no budget)
+#   LLM_TPM_LIMITS=gpt-4.1=30000,gemma3:27b=0   Per model
+#   LLM_MAX_ATTEMPTS=6
+#
+# The budgets are per process: divide them by the number of batch workers.
+
+DEFAULT_TPM_LIMIT = 0
+DEFAULT_MAX_ATTEMPTS = 6
+
+WINDOW = 60  # seconds
+BACKOFF_BASE = 2  # seconds
+BACKOFF_CAP = 60  # seconds
+MAX_RETRY_AFTER = 300  # seconds, longer waits (e.g. daily quotas) fail over instead
+
+# Adaptive budget: multiplied on a 429, increased on every success
+ADAPTIVE_DECREASE = 0.5
+ADAPTIVE_INCREASE = 0.05
+ADAPTIVE_MIN = 0.1
+
+# Token estimate of a request, before the real usage is known
+CHARS_PER_TOKEN = 4
+ATTACHMENT_TOKENS = 3000  # images and PDFs
+OUTPUT_ESTIMATE = 1024
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+FAILOVER_STATUS = {401, 402, 403, 404}  # credits, keys or model not available at this endpoint
+
+# Connection errors of openai, httpx and requests, matched by name to avoid importing them
+TRANSIENT_ERRORS = ("APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout",
+                    "ReadTimeout", "ReadError", "RemoteProtocolError", "TimeoutException", "ConnectionError")
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+RETRY_DELAY_PATTERN = re.compile(r"retryDelay['\"]?\s*:\s*['\"](\d+(?:\.\d+)?)s")
+
+def status_code(e: Exception) -> int | None:
+    """
+    Get the HTTP status of an API error (openai APIStatusError, google.genai APIError).
+    """
+    for attr in ["status_code", "code"]:
+        value = getattr(e, attr, None)
+        if isinstance(value, int):
+            return value
+
+    response = getattr(e, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+def parse_duration(value: str) -> float | None:
+    """
+    Parse "30", "1.5s", "250ms" or "6m0s" into seconds.
+    """
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    parts = DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+def retry_after(e: Exception) -> float | None:
+    """
+    Get the wait requested by the provider, in seconds.
+
+    Reads the Retry-After headers (OpenAI, OpenRouter, Ollama proxies) and
+    the RetryInfo of Gemini errors.
+    """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+
+        if headers.get("retry-after"):
+            value = headers["retry-after"]
+            seconds = parse_duration(value)
+            if seconds is None:
+                # HTTP date
+                seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+            return max(0.0, seconds)
+
+        if headers.get("x-ratelimit-reset-tokens"):
+            return parse_duration(headers["x-ratelimit-reset-tokens"])
+    except (TypeError, ValueError) as ex:
+        logger.debug(f"Could not parse the Retry-After of {e.__class__.__name__}: {ex}")
+
+    # Gemini: {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "13s"}
+    match = RETRY_DELAY_PATTERN.search(str(getattr(e, "details", None) or e))
+    if match:
+        return float(match.group(1))
+
+    return None
+
+def is_retryable(e: Exception) -> bool:
+    """
+    Check if a failed call may work if repeated: rate limits, overloaded
+    servers, timeouts and dropped connections.
+    """
+    status = status_code(e)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(e).__mro__)
+
+def should_failover(e: Exception) -> bool:
+    """
+    Check if a failed call may work with another model or endpoint.
+    """
+    return is_retryable(e) or status_code(e) in FAILOVER_STATUS
+
+def backoff(attempt: int) -> float:
+    """
+    Full-jitter exponential backoff, so the workers don't retry in lockstep.
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    """
+    Roughly estimate the tokens of a chat request, including the response.
+
+    Args:
+        messages (List[Dict]): The built ChatBuilder messages.
+
+    Returns:
+        int: The estimated tokens.
+    """
+    chars = 0
+    attachments = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+
+        for part in content or []:
+            if part.get("type") == "text":
+                chars += len(part.get("text") or "")
+            else:
+                attachments += 1
+
+    return chars // CHARS_PER_TOKEN + attachments * ATTACHMENT_TOKENS + OUTPUT_ESTIMATE
+
+def parse_limits(value: str) -> Dict[str, int]:
+    """
+    Parse LLM_TPM_LIMITS ("model=tokens,...").
+    """
+    limits = {}
+    for item in (value or "").split(","):
+        model, _, tokens = item.strip().rpartition("=")
+        if model:
+            limits[model.strip()] = int(tokens)
+    return limits
+
+class RateLimiter:
+    """
+    Adaptive tokens-per-minute limiter of an LLM endpoint, shared by the
+    threads that call it.
+    """
+    def __init__(self, name: str, tpm: int = DEFAULT_TPM_LIMIT, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.name = name
+        self.tpm = tpm
+        self.max_attempts = max_attempts
+
+        self.factor = 1.0
+        self.paused_until = 0.0
+        self.window: List[List[float]] = []  # [time, tokens] reservations of the last minute
+        self.lock = threading.Lock()
+
+    def budget(self) -> float:
+        return self.tpm * self.factor
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        """
+        Seconds until the tokens fit. Must hold the lock.
+        """
+        self.window = [entry for entry in self.window if entry[0] > now - WINDOW]
+
+        if self.paused_until > now:
+            return self.paused_until - now
+
+        if not self.tpm or not self.window:
+            return 0
+
+        used = sum(tokens for _, tokens in self.window)
+        if used + tokens <= self.budget():
+            return 0
+
+        # Wait until enough reservations leave the window
+        for start, reserved in self.window:
+            used -= reserved
+            if used + tokens <= self.budget():
+                return start + WINDOW - now
+        return self.window[-1][0] + WINDOW - now
+
+    def acquire(self, tokens: int) -> List[float]:
+        """
+        Wait until the tokens fit in the budget, and reserve them.
+
+        Returns:
+            List[float]: The reservation, to settle with the real usage.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self._wait_time(tokens, now)
+                if wait <= 0:
+                    entry = [now, tokens]
+                    self.window.append(entry)
+                    break
+
+            logger.debug(f"Throttling {self.name} for {wait:.1f}s")
+            time.sleep(wait)
+            waited += wait
+
+        if waited:
+            telemetry.throttled(self.name, waited)
+        return entry
+
+    def settle(self, entry: List[float], tokens: int, success: bool = True):
+        """
+        Replace the estimate of a reservation with the real usage.
+        """
+        with self.lock:
+            entry[1] = tokens
+            if success:
+                self.factor = min(1.0, self.factor + ADAPTIVE_INCREASE)
+
+    def throttle(self, delay: float):
+        """
+        Pause every caller after a rate limit, and shrink the budget.
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.factor = max(ADAPTIVE_MIN, self.factor * ADAPTIVE_DECREASE)
+
+        telemetry.rate_limited(self.name)
+
+    def fits(self, tokens: int) -> bool:
+        """
+        Check if the tokens fit in the budget right now.
+        """
+        with self.lock:
+            return self._wait_time(tokens, time.monotonic()) <= 0
+
+    def paused(self) -> bool:
+        """
+        Check if the endpoint is waiting out a rate limit.
+        """
+        return self.paused_until > time.monotonic()
+
+    def call(self, func: Callable[[], Any], tokens: int, usage: Callable[[Any], int] = None, service: str = "llm", attempts: int = None) -> Any:
+        """
+        Call an endpoint within the budget, retrying the transient errors.
+
+        Args:
+            func (Callable[[], Any]): The request.
+            tokens (int): The estimated tokens of the request.
+            usage (Callable[[Any], int]): Gets the real tokens from the response.
+            service (str): The label of the retries in the metrics.
+            attempts (int): Overrides max_attempts (e.g. fewer when a router can use another endpoint).
+
+        Returns:
+            Any: The response.
+        """
+        attempts = attempts or self.max_attempts
+        for attempt in range(attempts):
+            entry = self.acquire(tokens)
+            try:
+                result = func()
+            except Exception as e:
+                self.settle(entry, 0, success=False)
+
+                status = status_code(e)
+                delay = retry_after(e)
+                if not is_retryable(e) or attempt == attempts - 1:
+                    raise
+                if delay is not None and delay > MAX_RETRY_AFTER:
+                    logger.warning(f"{self.name} asked to wait {delay:.0f}s, giving up")
+                    raise
+
+                if delay is None:
+                    delay = backoff(attempt)
+
+                logger.warning(f"{self.name} failed with {e.__class__.__name__} ({status}), retrying in {delay:.1f}s "
+                               f"(attempt {attempt + 1}/{attempts})")
+                telemetry.retried(service, attempt + 1)
+
+                if status == 429:
+                    # The next acquire() waits, along with every other caller
+                    self.throttle(delay)
+                else:
+                    time.sleep(delay)
+                continue
+
+            try:
+                self.settle(entry, usage(result) if usage else tokens)
+            except Exception as e:
+                logger.debug(f"Could not read the usage of {self.name}: {e}")
+                self.settle(entry, tokens)
+            return result
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(endpoint: str, model: str) -> RateLimiter:
+    """
+    Get the limiter of an endpoint and model, configured by the environment.
+    """
+    key = (endpoint or "", model or "")
+
+    with _limiters_lock:
+        if key not in _limiters:
+            limits = parse_limits(os.getenv("LLM_TPM_LIMITS"))
+            tpm = limits.get(model, int(os.getenv("LLM_TPM_LIMIT", DEFAULT_TPM_LIMIT)))
+
+            _limiters[key] = RateLimiter(
+                name=f"{model}@{endpoint or 'default'}",
+                tpm=tpm,
+                max_attempts=int(os.getenv("LLM_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+            )
+        return _limiters[key]
+
+if __name__ == "__main__":
+    def test_limiter():
+        class RateLimitError(Exception):
+            status_code = 429
+
+            class response:
+                headers = {"retry-after-ms": "50"}
+
+        limiter = RateLimiter("test", tpm=1000)
+        calls = []
+
+        def func():
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                raise RateLimitError("Too many requests")
+            return "ok"
+
+        assert limiter.call(func, tokens=100, usage=lambda r: 200) == "ok"
+        assert calls[1] - calls[0] >= 0.05
+        assert limiter.factor == ADAPTIVE_DECREASE + ADAPTIVE_INCREASE
+        assert sum(tokens for _, tokens in limiter.window) == 200
+
+        # A 429 from the OpenAI client must reach the limiter, not be retried by the SDK
+        import openai
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                requests.append(self.path)
+                self.rfile.read(int(self.headers["Content-Length"]))
+                self.send_response(429)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                self.wfile.write(b'{"error": {"message": "Too many requests"}}')
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        client = openai.Client(api_key="dummy", base_url=f"http://127.0.0.1:{server.server_port}/v1", max_retries=0)
+        limiter = RateLimiter("test-429", tpm=1000)
+        try:
+            limiter.call(lambda: client.chat.completions.create(model="test", messages=[{"role": "user", "content": "Hi"}]),
+                         tokens=10, attempts=2)
+            assert False, "The 429 wasn't raised"
+        except openai.RateLimitError:
+            pass
+        finally:
+            server.shutdown()
+
+        # One request per limiter attempt, and the limiter slowed down
+        assert len(requests) == 2
+        assert limiter.factor < 1
+
+        assert parse_duration("6m0s") == 360 and parse_duration("250ms") == 0.25
+        assert retry_after(Exception("{'retryDelay': '13s'}")) == 13
+        assert not is_retryable(ValueError("Bad request"))
+        print("Rate limiter test passed")
+    #test_limiter()
@@ -8,8 +8,11 @@ import fake_news_detector.services.web.archive as archive
 import fake_news_detector.services.web.scrape as scrape
 from fake_news_detector.services.web.scrape import Format
 import fake_news_detector.utils as utils
+import fake_news_detector.fixtures as fixtures
+import fake_news_detector.telemetry as telemetry
 
 SCRAPED_SIZE_LIMIT = 6000000  # ~4 MB limit for scraped content
+PDF_SIZE_LIMIT = SCRAPED_SIZE_LIMIT * 3 // 4  # raw bytes, as large as the base64 PDFs that were allowed
 
 class Scraper:
     archive: "archive.Archive"
@@ -19,8 +22,11 @@ class Scraper:
         self.archive = archive.Archive()
         self.scrapers = scrapers
         
+    @telemetry.scrape
+    @fixtures.recorded("scrape")
     @retry(stop=stop_after_attempt(3), wait=wait_fixed(1),
            retry=retry_if_result(lambda result: result is None),
+           before_sleep=telemetry.on_retry("scrape"),
            retry_error_callback=lambda retry_state: logger.error(f"Scraping failed after {retry_state.attempt_number} attempts."))
     def scrape(self, url: str, format: Format = Format.HTML) -> any:
         """
@@ -76,7 +82,7 @@ class Scraper:
                     logger.debug(f"HTML size: {html_size if html_size != -1 else 'N/A'}")
                     logger.debug(f"PDF size: {pdf_size if pdf_size != -1 else 'N/A'}")
                     
-                    if html_size > SCRAPED_SIZE_LIMIT or pdf_size > SCRAPED_SIZE_LIMIT:
+                    if html_size > SCRAPED_SIZE_LIMIT or pdf_size > PDF_SIZE_LIMIT:
                         logger.warning(f"Scraped content size exceeds limit")
                         return False
                     
@@ -10,6 +10,8 @@ from fake_news_detector.datatypes import WebPage
 import fake_news_detector.debug as debug
 import fake_news_detector.services.llm as llm
 import fake_news_detector.utils as utils
+import fake_news_detector.fixtures as fixtures
+import fake_news_detector.telemetry as telemetry
 
 # -----------------
 CHROMADB_DEFAULT_PATH = "database/chromadb"
@@ -68,6 +70,8 @@ class MongoDatabase(Database):
     def clear(self):
         self.webpage_collection.delete_many({})
     
+    @telemetry.external("db")
+    @fixtures.recorded("db")
     def add_webpage(self, webpage: WebPage):
         logger.debug(f"Saving to cache")
         
@@ -78,6 +82,8 @@ class MongoDatabase(Database):
             )
         )
     
+    @telemetry.external("db")
+    @fixtures.recorded("db")
     def get_webpage(self, url: str) -> WebPage | None:
         data = self.webpage_collection.find_one({"url": url})
         if data:
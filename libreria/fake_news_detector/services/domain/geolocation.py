@@ -1,9 +1,24 @@
 from abc import ABC, abstractmethod
 import requests
 from loguru import logger
-from typing import Union
+from typing import Union, Tuple, List
+import bisect
+import csv
+import ipaddress
+import os
+import numpy as np
 
 import fake_news_detector.datatypes as datatypes
+import fake_news_detector.fixtures as fixtures
+import fake_news_detector.telemetry as telemetry
+
+IPINFO_TIMEOUT = 5  # seconds
+
+IPV4_MAX = 2**32 - 1
+
+# dbip-city-lite CSV layout: ip_start,ip_end,continent,country,stateprov,city,...
+CSV_COUNTRY_COLUMN = 3
+CSV_REGION_COLUMN = 4
 
 class DomainGeolocation(ABC):
     """
@@ -29,21 +44,208 @@ class DomainGeolocation(ABC):
     
 class IpInfoGeolocation(DomainGeolocation):
 
-    def __init__(self):
-        pass
+    def __init__(self, timeout: int = IPINFO_TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
     
+    @telemetry.external("geolocation")
+    @fixtures.recorded("geolocation")
     def locate(self, ip: str) -> Union[str, str]:
-        resp = requests.get(f"https://ipinfo.io/{ip}/json")
+        try:
+            resp = self.session.get(f"https://ipinfo.io/{ip}/json", timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.error(f"Failed to get geolocation data for '{ip}': {e}")
+            return None, None
         
         if resp.status_code != 200:
             logger.error(f"Failed to get geolocation data for '{ip}': {resp.status_code}")
-            return None
+            return None, None
         
         data = resp.json()
-        return data["country"], data["region"]
+        return data.get("country"), data.get("region")
+
+class IpRangeGeolocation(DomainGeolocation):
+    """
+    Offline geolocation backed by a local IP-range database (CSV or MMDB).
+
+    IPv4 ranges are kept in sorted NumPy arrays and looked up with a binary
+    search. IPv6 ranges use the same layout on plain Python ints, as NumPy
+    has no 128-bit integer type.
+    """
+    _index_cache: dict = {}
+
+    def __init__(self, path: str = None, fallback: DomainGeolocation = None,
+                 country_column: int = CSV_COUNTRY_COLUMN, region_column: int = CSV_REGION_COLUMN):
+        """
+        Load the database into memory.
+
+        Args:
+            path (str): Path to the .csv or .mmdb database. Defaults to GEOLOCATION_DB_PATH.
+            fallback (DomainGeolocation): Provider used when an IP is not in the database.
+            country_column (int): Column holding the country (CSV only).
+            region_column (int): Column holding the region (CSV only).
+        """
+        self.path = path or os.getenv("GEOLOCATION_DB_PATH")
+        self.fallback = fallback
+        self.country_column = country_column
+        self.region_column = region_column
+
+        assert self.path, "GEOLOCATION_DB_PATH environment variable is not set"
+
+        # The detector re-initializes its clients on every run, so keep the
+        # parsed index around instead of reading the file again
+        key = (self.path, country_column, region_column)
+        if key not in self._index_cache:
+            if self.path.endswith(".mmdb"):
+                ranges = self._read_mmdb(self.path)
+            else:
+                ranges = self._read_csv(self.path)
+
+            self._index_cache[key] = self._build_index(ranges)
+
+        (self.locations,
+         self.v4_starts, self.v4_ends, self.v4_locations,
+         self.v6_starts, self.v6_ends, self.v6_locations) = self._index_cache[key]
+
+        logger.debug(f"Loaded {len(self.v4_starts)} IPv4 and {len(self.v6_starts)} IPv6 ranges from '{self.path}'")
+
+    def locate(self, ip: str) -> Union[str, str]:
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            logger.error(f"Invalid IP address: '{ip}'")
+            return None, None
+
+        value = int(addr)
+
+        if addr.version == 4:
+            i = int(np.searchsorted(self.v4_starts, value, side="right")) - 1
+            found = i >= 0 and value <= self.v4_ends[i]
+            j = self.v4_locations[i] if found else None
+        else:
+            i = bisect.bisect_right(self.v6_starts, value) - 1
+            found = i >= 0 and value <= self.v6_ends[i]
+            j = self.v6_locations[i] if found else None
+
+        if j is not None:
+            return self.locations[j]
+
+        if self.fallback:
+            logger.debug(f"IP '{ip}' not found in the local database. Using fallback.")
+            return self.fallback.locate(ip)
+
+        return None, None
+
+    @staticmethod
+    def _build_index(ranges: List[Tuple[int, int, int, Tuple[str, str]]]) -> tuple:
+        """
+        Sort the ranges and split them by IP version.
+
+        Integer ranges (ip2location IPv6) may start in the IPv4 space and end past
+        it. They are split, as the IPv4 arrays can't hold the end.
+
+        Args:
+            ranges (list): Tuples of (version, start, end, (country, region)).
+
+        Returns:
+            tuple: Locations, followed by the IPv4 and IPv6 (starts, ends, location ids).
+        """
+        # Deduplicate (country, region) pairs so each range only stores an index
+        locations: List[Tuple[str, str]] = []
+        location_ids = {}
+
+        v4, v6 = [], []
+        for version, start, end, location in ranges:
+            if end < start:
+                logger.warning(f"Skipping invalid IP range {start}-{end}")
+                continue
+
+            if location not in location_ids:
+                location_ids[location] = len(locations)
+                locations.append(location)
+            location_id = location_ids[location]
+
+            if version == 6:
+                v6.append((start, end, location_id))
+            elif end <= IPV4_MAX:
+                v4.append((start, end, location_id))
+            else:
+                v4.append((start, IPV4_MAX, location_id))
+                v6.append((IPV4_MAX + 1, end, location_id))
+
+        v4.sort()
+        v6.sort()
+
+        return (
+            locations,
+            np.array([r[0] for r in v4], dtype=np.uint32),
+            np.array([r[1] for r in v4], dtype=np.uint32),
+            np.array([r[2] for r in v4], dtype=np.int32),
+            [r[0] for r in v6],
+            [r[1] for r in v6],
+            [r[2] for r in v6],
+        )
+
+    def _read_csv(self, path: str) -> List[Tuple[int, int, int, Tuple[str, str]]]:
+        ranges = []
+
+        with open(path, "r", encoding="utf-8", newline="") as file:
+            for row in csv.reader(file):
+                try:
+                    start = self._parse_ip(row[0])
+                    end = self._parse_ip(row[1])
+                except (ValueError, IndexError):
+                    # Header or malformed line
+                    continue
+
+                country = row[self.country_column] if len(row) > self.country_column else None
+                region = row[self.region_column] if len(row) > self.region_column else None
+
+                ranges.append((start.version, int(start), int(end), (country or None, region or None)))
+
+        return ranges
+
+    def _read_mmdb(self, path: str) -> List[Tuple[int, int, int, Tuple[str, str]]]:
+        # Optional dependency, only needed for MaxMind databases
+        import maxminddb
+
+        ranges = []
+
+        with maxminddb.open_database(path) as reader:
+            for network, record in reader:
+                if not record:
+                    continue
+
+                country = (record.get("country") or {}).get("iso_code")
+                subdivisions = record.get("subdivisions") or [{}]
+                region = (subdivisions[0].get("names") or {}).get("en")
+
+                ranges.append((
+                    network.version,
+                    int(network.network_address),
+                    int(network.broadcast_address),
+                    (country, region),
+                ))
+
+        return ranges
+
+    @staticmethod
+    def _parse_ip(value: str) -> Union[ipaddress.IPv4Address, ipaddress.IPv6Address]:
+        value = value.strip()
+
+        # Some databases (ip2location) store ranges as plain integers
+        if value.isdigit():
+            return ipaddress.ip_address(int(value))
+
+        return ipaddress.ip_address(value)
     
 if __name__ == "__main__":
     geo = IpInfoGeolocation()
     ip = "23.192.228.80"
     data = geo.locate(ip)
-    print(data)
\ No newline at end of file
+    print(data)
+
+    def test_ip_range():
+        geo = IpRangeGeolocation(fallback=IpInfoGeolocation())
+        print(geo.locate(ip))
+    #test_ip_range()
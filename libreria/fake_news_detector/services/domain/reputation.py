@@ -12,6 +12,8 @@ import requests
 
 sys.path.append("libreria/") 
 import fake_news_detector.debug as debug
+import fake_news_detector.fixtures as fixtures
+import fake_news_detector.telemetry as telemetry
 
 class DomainReputatuion:
     @abstractmethod
@@ -44,7 +46,10 @@ class VirusTotalReputation(DomainReputatuion):
 
         self.api_url = self.api_url
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=2, min=10, max=60*5))
+    @telemetry.external("reputation")
+    @fixtures.recorded("reputation")
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=2, min=10, max=60*5),
+           before_sleep=telemetry.on_retry("reputation"))
     def get_reputation(self, domain: str) -> int:
         """
         Get the reputation of a domain using VirusTotal API via synchronous HTTP.
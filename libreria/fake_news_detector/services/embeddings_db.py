@@ -51,12 +51,15 @@ class EmbeddingsDatabase(ABC):
 OLLAMA_ALLMINILM_EMBEDDING_SIZE = 384
 
 class FaissEmbeddingsDatabase(EmbeddingsDatabase):
-    id_dict: Dict[int, str] = {}
+    id_dict: Dict[int, str]
     
     def __init__(self):
         basic_index = faiss.IndexFlatL2(OLLAMA_ALLMINILM_EMBEDDING_SIZE)
         self.index = faiss.IndexIDMap(basic_index)
         
+        # Per instance, so concurrent detectors don't overwrite each other's IDs
+        self.id_dict = {}
+        
     def count(self) -> int:
         """
         Get the number of embeddings in the database.
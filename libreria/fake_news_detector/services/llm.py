@@ -3,16 +3,24 @@ import openai
 import os
 from loguru import logger
 from pydantic import BaseModel
-from tenacity import retry, stop_after_attempt, wait_exponential
 from abc import ABC, abstractmethod
 import sys
 from google import genai
 from google.genai import types
+import threading
+import hashlib
+import random
 import base64
+import time
+import io
 
 sys.path.append("libreria/")
 import fake_news_detector.utils as utils
 import fake_news_detector.debug as debug
+import fake_news_detector.fixtures as fixtures
+import fake_news_detector.telemetry as telemetry
+import fake_news_detector.ratelimit as ratelimit
+import fake_news_detector.usage as usage
 
 # ========= Default models
 
@@ -36,17 +44,43 @@ OPENAI_GPT41 = "gpt-4.1"
 
 MAX_TOKENS = 32 * 1024  # 32k tokens
 OLLAMA_NUM_CTX = 8 * 1024  # Ollama context size
+DEFAULT_CONTEXT_WINDOW = 128 * 1024  # OpenAI / OpenRouter models
+GOOGLE_CONTEXT_WINDOW = 1024 * 1024  # Gemini models
+
+# Gemini explicit context caching of the documents (GEMINI_CONTEXT_CACHE=on|off)
+CONTEXT_CACHE_TTL = 600  # seconds
+CONTEXT_CACHE_MARGIN = 30  # seconds, caches about to expire are not reused
+CONTEXT_CACHE_MIN_BYTES = 32 * 1024  # smaller PDFs are usually under the minimum tokens of a cache
+
+# Gemini Files API: documents are uploaded once and referenced by the calls about them
+FILE_UPLOAD_TTL = 47 * 3600  # seconds, uploads are kept for 48 hours
+FILE_UPLOAD_RETRY = 600  # seconds before trying again a document that couldn't be uploaded
+FILE_UPLOAD_TIMEOUT = 60  # seconds waiting for an upload to be processed
+FILE_UPLOAD_POLL = 1  # seconds
+FILE_UPLOAD_MAX_FILES = 256  # remembered uploads, the oldest ones are deleted
+
+PDF_MIME = "application/pdf"
 
 # =========
     
 class LLM:
-    input_usage: int = 0
-    output_usage: int = 0
+    # Lifetime totals of this client. The usage of an analysis is in its UsageRecords
+    input_usage: int
+    output_usage: int
+    cached_usage: int  # Part of the input read from the provider's prompt cache
+    role: Optional[str] = None  # pdf, text... Set by the detector, for the usage records
+    fallback: Optional["LLM | GoogleLLM"] = None  # Used when this model fails or is rate limited
+    max_attempts: Optional[int] = None  # Retries of the limiter, LLM_MAX_ATTEMPTS by default
     
-    def __init__(self, model: str, endpoint: str = None, api_key: str = None, extra_body: Optional[Dict[str, Any]] = None):
+    def __init__(self, model: str, endpoint: str = None, api_key: str = None, extra_body: Optional[Dict[str, Any]] = None, context_window: int = DEFAULT_CONTEXT_WINDOW):
         self.model = model
         self.api_key = api_key
         self.endpoint = endpoint
+        self.context_window = context_window
+        
+        self.input_usage = 0
+        self.output_usage = 0
+        self.cached_usage = 0
         
         secret_api_key = api_key
         if api_key:
@@ -54,13 +88,19 @@ class LLM:
         
         logger.debug(f"Using model {self.model} with API key {secret_api_key} at endpoint {self.endpoint}")
 
+        # The limiter retries (and shares the Retry-After of a 429 with the other
+        # threads), the SDK shouldn't retry on its own first
         self.client = openai.Client(
             api_key=self.api_key or "dummy",
             base_url=self.endpoint,
+            max_retries=0,
         )
         
         self.extra_body = extra_body
+        self.limiter = ratelimit.get_limiter(self.endpoint, self.model)
 
+    @telemetry.llm_call
+    @fixtures.recorded("llm")
     def call(self,
              messages: "ChatBuilder",
              temperature: float = None,
@@ -95,33 +135,41 @@ class LLM:
         assert isinstance(self.api_key, str), "API key must be a string"
         assert isinstance(self.endpoint, (str, type(None))), "Endpoint must be a string or None"
         
-        logger.trace(f"Messages: {messages.build()}")
+        # Formatted only if TRACE is enabled (the messages may hold whole PDFs)
+        logger.trace("Messages: {}", messages.build())
         
-        resp = self._call(
-            func=func,
-            messages=messages,
-            temperature=temperature,
-            structure=structure
-        )
+        try:
+            resp = self._call(
+                func=func,
+                messages=messages,
+                temperature=temperature,
+                structure=structure
+            )
+        except Exception as e:
+            if self.fallback is None or not ratelimit.should_failover(e):
+                raise
+            return failover(self, e, messages=messages, temperature=temperature, structure=structure)
         
         input_tokens = resp.usage.prompt_tokens
         output_tokens = resp.usage.completion_tokens
+        cached_tokens = getattr(getattr(resp.usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
         
         self.input_usage += input_tokens
         self.output_usage += output_tokens
+        self.cached_usage += cached_tokens
+        usage.record(self.model, self.role, input_tokens, output_tokens, cached_tokens)
         
-        logger.debug(f"Recieved response. Input tokens: {input_tokens}, Output tokens: {output_tokens}")
+        logger.debug(f"Recieved response. Input tokens: {input_tokens} ({cached_tokens} cached), Output tokens: {output_tokens}")
         
         if structure:
             result = resp.choices[0].message.parsed
-            logger.trace(utils.short(str(result)))
+            logger.opt(lazy=True).trace("{}", lambda: utils.short(str(result)))
         else:
             result = resp.choices[0].message.content
-            logger.trace(utils.short(result))
+            logger.opt(lazy=True).trace("{}", lambda: utils.short(result))
         
         return result
     
-    @retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=2, min=2, max=30))
     def _call(
         self,
         func: Callable,
@@ -129,35 +177,54 @@ class LLM:
         temperature: float = None,
         structure: Any = None
     ):
-        try:
-            return func(
+        # Encoded once, and reused by the retries
+        encoded = messages.encode()
+        
+        # Retries, Retry-After and the token budget are handled by the limiter
+        return self.limiter.call(
+            lambda: func(
                 model=self.model,
-                messages=messages.build(),
+                messages=encoded,
                 temperature=temperature,
                 response_format=structure,
                 extra_body=self.extra_body,
                 max_tokens=MAX_TOKENS,
-            )
-        except (openai.RateLimitError, openai.APIStatusError) as e:
-            logger.error(f"Rate limit error: {e}")
-            utils.wait_input(f"Analysis paused to wait for funds refill dor: {self.endpoint}")
-            raise
+            ),
+            tokens=ratelimit.estimate_tokens(messages.build()),
+            usage=lambda resp: resp.usage.total_tokens,
+            attempts=self.max_attempts,
+        )
 
-    def models(self):
+    def models(self, timeout: float = None):
         """
         Get all available models.
         """
-        return self.client.models.list()
+        client = self.client.with_options(timeout=timeout) if timeout else self.client
+        return client.models.list()
     
     def get_usage(self) -> Tuple[int, int]:
         """
         Get the usage of the LLM.
         
         Returns:
-            Tuple[int, int]: A tuple containing the input and output token usage.
+            Tuple[int, int]: A tuple containing the input and output token usage, including the fallback model.
         """
+        if self.fallback is not None:
+            fallback_input, fallback_output = self.fallback.get_usage()
+            return self.input_usage + fallback_input, self.output_usage + fallback_output
         return self.input_usage, self.output_usage
     
+    def get_cached_usage(self) -> int:
+        """
+        Get the input tokens read from the provider's prompt cache.
+        
+        Returns:
+            int: The cached input tokens, including the fallback model.
+        """
+        if self.fallback is not None:
+            return self.cached_usage + self.fallback.get_cached_usage()
+        return self.cached_usage
+    
     def get_model(self) -> str:
         """
         Get the model name.
@@ -176,16 +243,35 @@ class LLM:
         """
         return self.endpoint
     
+    def get_context_window(self) -> int:
+        """
+        Get the context window size of the model.
+        
+        Returns:
+            int: The context window size in tokens.
+        """
+        return self.context_window
+    
 
     
 class GoogleLLM:
-    input_usage: int = 0
-    output_usage: int = 0
+    # Lifetime totals of this client. The usage of an analysis is in its UsageRecords
+    input_usage: int
+    output_usage: int
+    cached_usage: int  # Part of the input read from the provider's prompt cache
+    role: Optional[str] = None  # pdf, text... Set by the detector, for the usage records
+    fallback: Optional["LLM | GoogleLLM"] = None  # Used when this model fails or is rate limited
+    max_attempts: Optional[int] = None  # Retries of the limiter, LLM_MAX_ATTEMPTS by default
     
-    def __init__(self, model: str, endpoint: str = None, api_key: str = None, extra_body: Optional[Dict[str, Any]] = None):
+    def __init__(self, model: str, endpoint: str = None, api_key: str = None, extra_body: Optional[Dict[str, Any]] = None, context_window: int = GOOGLE_CONTEXT_WINDOW):
         self.model = model
         self.api_key = api_key
         self.endpoint = endpoint
+        self.context_window = context_window
+        
+        self.input_usage = 0
+        self.output_usage = 0
+        self.cached_usage = 0
         
         secret_api_key = api_key
         if api_key:
@@ -198,7 +284,20 @@ class GoogleLLM:
         )
         
         self.extra_body = extra_body
+        self.limiter = ratelimit.get_limiter(self.endpoint, self.model)
+        
+        # Explicit context caches of the documents and their system prompts: sha256 -> (name or None, expiry)
+        self.context_cache = os.getenv("GEMINI_CONTEXT_CACHE", "on").strip().lower() not in ["off", "0", "false"]
+        self.context_caches: Dict[str, Tuple[Optional[str], float]] = {}
+        self.context_caches_lock = threading.Lock()
+        
+        # Documents uploaded to the Files API: sha256 -> (file or None, expiry)
+        self.file_upload = os.getenv("GEMINI_FILE_UPLOAD", "on").strip().lower() not in ["off", "0", "false"]
+        self.files: Dict[str, Tuple[Optional[types.File], float]] = {}
+        self.files_lock = threading.Lock()
 
+    @telemetry.llm_call
+    @fixtures.recorded("llm")
     def call(self,
              messages: "ChatBuilder",
              temperature: float = None,
@@ -228,32 +327,40 @@ class GoogleLLM:
         assert isinstance(self.api_key, str), "API key must be a string"
         assert isinstance(self.endpoint, (str, type(None))), "Endpoint must be a string or None"
         
-        logger.trace(f"Messages: {messages.build()}")
+        # Formatted only if TRACE is enabled (the messages may hold whole PDFs)
+        logger.trace("Messages: {}", messages.build())
         
-        resp = self._call(
-            messages=messages,
-            temperature=temperature,
-            structure=structure
-        )
+        try:
+            resp = self._call(
+                messages=messages,
+                temperature=temperature,
+                structure=structure
+            )
+        except Exception as e:
+            if self.fallback is None or not ratelimit.should_failover(e):
+                raise
+            return failover(self, e, messages=messages, temperature=temperature, structure=structure)
         
         input_tokens = resp.usage_metadata.prompt_token_count or 0
         output_tokens = resp.usage_metadata.candidates_token_count or 0
+        cached_tokens = resp.usage_metadata.cached_content_token_count or 0
         
         self.input_usage += input_tokens
         self.output_usage += output_tokens
+        self.cached_usage += cached_tokens
+        usage.record(self.model, self.role, input_tokens, output_tokens, cached_tokens)
         
-        logger.debug(f"Recieved response. Input tokens: {input_tokens}, Output tokens: {output_tokens}")
+        logger.debug(f"Recieved response. Input tokens: {input_tokens} ({cached_tokens} cached), Output tokens: {output_tokens}")
         
         if structure:
             result = resp.parsed
-            logger.trace(utils.short(str(result)))
+            logger.opt(lazy=True).trace("{}", lambda: utils.short(str(result)))
         else:
             result = resp.text
-            logger.trace(utils.short(result))
+            logger.opt(lazy=True).trace("{}", lambda: utils.short(result))
         
         return result
     
-    #@retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=2, min=2, max=30))
     def _call(
         self,
         messages: "ChatBuilder",
@@ -268,6 +375,7 @@ class GoogleLLM:
         # Convert contents
         system = None
         contents = []
+        documents = []  # (sha256, size, index in contents)
         for msg in messages.build():
             if msg["role"] == "system":
                 system = msg["content"]
@@ -309,30 +417,39 @@ class GoogleLLM:
                                 )
                             )
                             
-                        # Documents
+                        # Documents, as raw bytes
                         elif content["type"] == "file":
-                            # Convert base 64 file to bytes
-                            file_b64 = content["file"]["file_data"]
+                            file_b = content["file"]["file_data"]
                             
-                            mime = "application/pdf"
+                            mime = PDF_MIME
                             
-                            # Remove the prefix
-                            if file_b64.startswith("data:"):
-                                file_b64 = file_b64.split(",")[1]
-
-                            file_b = base64.b64decode(file_b64)
-
-                            logger.debug(f"Converted file with mime type {mime} to bytes: {file_b[:10]}...")
-
+                            if isinstance(file_b, str):
+                                file_b = utils.b64_to_bytes(file_b)
+                            
+                            key = hashlib.sha256(file_b).hexdigest()
+                            
+                            documents.append((key, len(file_b), len(contents)))
                             contents.append(
-                                types.Part.from_bytes(
-                                    data=file_b,
-                                    mime_type=mime,
-                                )
+                                self._document_part(key, file_b, mime)
                             )
                             
-        try:
-            resp = self.client.models.generate_content(
+        # Read the document from a context cache, shared by the calls about the same PDF
+        cached_content = None
+        if self.context_cache and len(documents) == 1 and documents[0][1] >= CONTEXT_CACHE_MIN_BYTES:
+            # Gemini doesn't allow a system instruction next to a cache, so it goes in the
+            # cache. Calls about the same PDF share it (see prompts.PDF_DOCUMENT)
+            key, _, index = documents[0]
+            cached_content = self._context_cache(key, contents[index], system)
+            
+            if cached_content:
+                contents.pop(index)
+                
+                # The cache has the system instruction, it can't be set again
+                system = None
+        
+        # Retries, Retry-After and the token budget are handled by the limiter
+        return self.limiter.call(
+            lambda: self.client.models.generate_content(
                 model=self.model,
                 contents=contents,
                 config=types.GenerateContentConfig(
@@ -342,30 +459,161 @@ class GoogleLLM:
                     temperature=temperature,
                     system_instruction=system,
                     max_output_tokens=MAX_TOKENS,
+                    cached_content=cached_content,
                 )
-            )
+            ),
+            tokens=ratelimit.estimate_tokens(messages.build()),
+            usage=lambda resp: resp.usage_metadata.total_token_count or 0,
+            attempts=self.max_attempts,
+        )
+
+    def _document_part(self, key: str, data: bytes, mime: str) -> "types.Part":
+        """
+        Get the part of a document: a reference to its upload in the Files API,
+        or its bytes inline if it can't be uploaded.
+        
+        Args:
+            key (str): The sha256 of the document.
+            data (bytes): The document.
+            mime (str): Its mime type.
+        
+        Returns:
+            types.Part: The part.
+        """
+        if self.file_upload:
+            file = self._upload(key, data, mime)
+            if file is not None:
+                return types.Part.from_uri(file_uri=file.uri, mime_type=mime)
+        
+        return types.Part.from_bytes(data=bytes(data), mime_type=mime)
+    
+    def _upload(self, key: str, data: bytes, mime: str) -> Optional["types.File"]:
+        """
+        Get the upload of a document, uploading it on first use.
+        
+        Args:
+            key (str): The sha256 of the document.
+            data (bytes): The document.
+            mime (str): Its mime type.
+        
+        Returns:
+            Optional[types.File]: The uploaded file, or None if it couldn't be uploaded.
+        """
+        now = time.monotonic()
+        
+        with self.files_lock:
+            self.files = {k: v for k, v in self.files.items() if v[1] > now}
+            if key in self.files:
+                return self.files[key][0]
+        
+        try:
+            file = self.client.files.upload(file=io.BytesIO(data), config=types.UploadFileConfig(mime_type=mime))
+            
+            deadline = now + FILE_UPLOAD_TIMEOUT
+            while file.state == types.FileState.PROCESSING:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{file.name} is still being processed")
+                time.sleep(FILE_UPLOAD_POLL)
+                file = self.client.files.get(name=file.name)
             
-            return resp
+            if file.state == types.FileState.FAILED:
+                raise RuntimeError(f"{file.name} could not be processed")
+            
+            logger.debug(f"Uploaded a {len(data)} bytes document to {file.name}")
         except Exception as e:
-            logger.error(f"Error: {e}")
-            utils.wait_input(f"Analysis paused. Endpoint: {self.endpoint}")
-            raise
-
-    def models(self):
+            # Also remembered for a while, so it isn't tried again for every call
+            logger.debug(f"Could not upload the document: {e}")
+            file = None
+        
+        evicted = []
+        with self.files_lock:
+            self.files[key] = (file, now + (FILE_UPLOAD_TTL if file else FILE_UPLOAD_RETRY))
+            while len(self.files) > FILE_UPLOAD_MAX_FILES:
+                oldest = min(self.files, key=lambda k: self.files[k][1])
+                evicted.append(self.files.pop(oldest)[0])
+        
+        for old in evicted:
+            if old is None:
+                continue
+            try:
+                self.client.files.delete(name=old.name)
+            except Exception as e:
+                logger.debug(f"Could not delete {old.name}: {e}")
+        
+        return file
+    
+    def _context_cache(self, key: str, part: "types.Part", system: str = None) -> Optional[str]:
+        """
+        Get the context cache of a document and system instruction, creating it on first use.
+        
+        Args:
+            key (str): The sha256 of the document.
+            part (types.Part): The document, uploaded or inline.
+            system (str): The system instruction of the calls.
+        
+        Returns:
+            Optional[str]: The name of the cache, or None if it can't be cached (too small, unsupported...).
+        """
+        key = hashlib.sha256(f"{key}\n{system or ''}".encode("utf-8")).hexdigest()
+        now = time.monotonic()
+        
+        with self.context_caches_lock:
+            self.context_caches = {k: v for k, v in self.context_caches.items() if v[1] > now}
+            if key in self.context_caches:
+                return self.context_caches[key][0]
+        
+        try:
+            cache = self.client.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    contents=[types.Content(role="user", parts=[part])],
+                    system_instruction=system,
+                    ttl=f"{CONTEXT_CACHE_TTL}s",
+                )
+            )
+            name = cache.name
+            logger.debug(f"Cached document {key[:12]} in {name}")
+        except Exception as e:
+            # Also remembered, so it isn't tried again for every call
+            logger.debug(f"Could not cache the document in {self.model}: {e}")
+            name = None
+        
+        with self.context_caches_lock:
+            self.context_caches[key] = (name, now + CONTEXT_CACHE_TTL - CONTEXT_CACHE_MARGIN)
+        return name
+    
+    def models(self, timeout: float = None):
         """
         Get all available models.
         """
-        return self.client.models.list()
+        config = None
+        if timeout:
+            config = types.ListModelsConfig(http_options=types.HttpOptions(timeout=int(timeout * 1000)))
+        return self.client.models.list(config=config)
     
     def get_usage(self) -> Tuple[int, int]:
         """
         Get the usage of the LLM.
         
         Returns:
-            Tuple[int, int]: A tuple containing the input and output token usage.
+            Tuple[int, int]: A tuple containing the input and output token usage, including the fallback model.
         """
+        if self.fallback is not None:
+            fallback_input, fallback_output = self.fallback.get_usage()
+            return self.input_usage + fallback_input, self.output_usage + fallback_output
         return self.input_usage, self.output_usage
     
+    def get_cached_usage(self) -> int:
+        """
+        Get the input tokens read from the provider's prompt cache.
+        
+        Returns:
+            int: The cached input tokens, including the fallback model.
+        """
+        if self.fallback is not None:
+            return self.cached_usage + self.fallback.get_cached_usage()
+        return self.cached_usage
+    
     def get_model(self) -> str:
         """
         Get the model name.
@@ -383,21 +631,41 @@ class GoogleLLM:
             str: The endpoint URL.
         """
         return self.endpoint
+    
+    def get_context_window(self) -> int:
+        """
+        Get the context window size of the model.
+        
+        Returns:
+            int: The context window size in tokens.
+        """
+        return self.context_window
         
+def failover(llm: "LLM | GoogleLLM | RouterLLM", e: Exception, **kwargs) -> Any:
+    """
+    Send a failed call to the fallback model of an LLM.
+    """
+    fallback = llm.fallback
+    logger.warning(f"{llm.get_model()} at {llm.get_endpoint()} failed ({e.__class__.__name__}: {e}), "
+                   f"using {fallback.get_model()} at {fallback.get_endpoint()}")
+    telemetry.failover(llm.get_model(), fallback.get_model())
+
+    return fallback.call(**kwargs)
+
 class OpenAI(LLM):
-    def __init__(self, model: str):
+    def __init__(self, model: str, endpoint: str = None):
         super().__init__(
             model=model,
             api_key=os.getenv("OPENAI_API_KEY"),
-            endpoint=os.getenv("OPENAI_BASE_URL")
+            endpoint=endpoint or os.getenv("OPENAI_BASE_URL")
         )
 
 class OpenRouter(LLM):
-    def __init__(self, model: str):
+    def __init__(self, model: str, endpoint: str = None):
         super().__init__(
             model=model,
             api_key=os.getenv("OPENROUTER_API_KEY"),
-            endpoint=os.getenv("OPENROUTER_BASE_URL"),
+            endpoint=endpoint or os.getenv("OPENROUTER_BASE_URL"),
             extra_body={
                 # OpenRouter-specific params
                 "data_collection": "deny",
@@ -407,19 +675,345 @@ class OpenRouter(LLM):
         )
         
 class Ollama(LLM):
-    def __init__(self, model: str):
+    def __init__(self, model: str, endpoint: str = None):
         super().__init__(
             model=model,
             api_key=os.getenv("OPENAI_API_KEY"),
-            endpoint=os.getenv("OLLAMA_BASE_URL"),
+            endpoint=endpoint or os.getenv("OLLAMA_BASE_URL"),
             extra_body={
                 # Ollama-specific params
                 "options":{
                     "num_ctx": OLLAMA_NUM_CTX,
                 }
-            }
+            },
+            context_window=OLLAMA_NUM_CTX,
         )
         
+# Router
+#
+#   PDF_SERVICE=router
+#   PDF_MODEL=gemma3:27b@ollama, gemma3:27b@ollama=http://gpu2:11434/v1;max=2, google/gemma-3-27b-it@openrouter;tpm=200000
+#
+# Every backend is <model>@<service>[=<endpoint>][;max=<concurrent calls>][;tpm=<tokens per minute>].
+#
+#   ROUTER_STRATEGY=least-outstanding | latency
+#   ROUTER_HEALTH_INTERVAL=30       Seconds between health checks (0: only passive checks)
+#   ROUTER_FAILURE_THRESHOLD=3      Consecutive failures before a backend is taken out
+#   ROUTER_COOLDOWN=30              Seconds a failed backend stays out, unless a health check passes
+
+ROUTER_STRATEGIES = ["least-outstanding", "latency"]
+DEFAULT_ROUTER_STRATEGY = "least-outstanding"
+DEFAULT_ROUTER_HEALTH_INTERVAL = 30  # seconds
+DEFAULT_ROUTER_FAILURE_THRESHOLD = 3
+DEFAULT_ROUTER_COOLDOWN = 30  # seconds
+
+ROUTER_BACKEND_ATTEMPTS = 2  # retries in a backend before trying the next one
+ROUTER_HEALTH_TIMEOUT = 5  # seconds
+LATENCY_EWMA_ALPHA = 0.3
+
+def parse_backends(spec: str) -> List[Dict[str, Any]]:
+    """
+    Parse the backends of a router.
+
+    Args:
+        spec (str): "<model>@<service>[=<endpoint>][;max=N][;tpm=N], ..."
+
+    Returns:
+        List[Dict[str, Any]]: The model, service, endpoint, max and tpm of every backend.
+    """
+    backends = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+
+        target, *options = [part.strip() for part in item.split(";")]
+        model, _, service = target.rpartition("@")
+        service, _, endpoint = service.partition("=")
+        assert model and service, f"Router backends must be <model>@<service>: {item}"
+
+        backend = {"model": model, "service": service.strip(), "endpoint": endpoint.strip() or None, "max": None, "tpm": None}
+        for option in options:
+            key, _, value = option.partition("=")
+            assert key in ["max", "tpm"], f"Unknown router option {key} in {item}"
+            backend[key] = int(value)
+
+        backends.append(backend)
+    return backends
+
+class RouterBackend:
+    """
+    An LLM behind a router, with its load and health.
+    """
+    def __init__(self, llm: "LLM | GoogleLLM", max_concurrent: int = None, tpm: int = None):
+        self.llm = llm
+        self.name = f"{llm.get_model()}@{llm.get_endpoint() or 'default'}"
+        self.max_concurrent = max_concurrent
+
+        # Quota of this router only. The endpoint's shared limiter still applies
+        self.limiter = ratelimit.RateLimiter(f"router:{self.name}", tpm=tpm) if tpm else None
+
+        self.outstanding = 0
+        self.latency: float = None  # EWMA of the call latency, in seconds
+        self.failures = 0
+        self.unhealthy_until = 0.0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.unhealthy_until and not self.llm.limiter.paused()
+
+    def has_capacity(self, tokens: int = 0) -> bool:
+        if self.max_concurrent and self.outstanding >= self.max_concurrent:
+            return False
+        return self.limiter is None or self.limiter.fits(tokens)
+
+    def quota(self) -> bool:
+        return bool(self.max_concurrent or self.limiter)
+
+class RouterLLM:
+    """
+    Spreads the calls of a role over several LLM endpoints, for example
+    several Ollama instances or OpenRouter plus a local model.
+
+    Calls go to the healthy backend with the fewest outstanding requests
+    (or the lowest expected latency), within its concurrency quota. A failed
+    backend is skipped for the rest of the call and taken out after repeated
+    failures, until its cooldown ends or a health check passes.
+    """
+    fallback: Optional["LLM | GoogleLLM"] = None
+    role: Optional[str] = None
+    
+    def __init__(self, backends: List[RouterBackend], strategy: str = None):
+        assert backends, "The router needs at least one backend"
+
+        self.backends = backends
+        self.strategy = strategy or os.getenv("ROUTER_STRATEGY", DEFAULT_ROUTER_STRATEGY)
+        assert self.strategy in ROUTER_STRATEGIES, f"ROUTER_STRATEGY must be one of {ROUTER_STRATEGIES}"
+
+        self.failure_threshold = int(os.getenv("ROUTER_FAILURE_THRESHOLD", DEFAULT_ROUTER_FAILURE_THRESHOLD))
+        self.cooldown = float(os.getenv("ROUTER_COOLDOWN", DEFAULT_ROUTER_COOLDOWN))
+        self.health_interval = float(os.getenv("ROUTER_HEALTH_INTERVAL", DEFAULT_ROUTER_HEALTH_INTERVAL))
+
+        self.condition = threading.Condition()
+
+        for backend in self.backends:
+            # Move on to another backend instead of retrying for long
+            backend.llm.max_attempts = ROUTER_BACKEND_ATTEMPTS
+
+        logger.debug(f"Routing ({self.strategy}) over: {', '.join(b.name for b in self.backends)}")
+
+        if self.health_interval > 0 and len(self.backends) > 1:
+            threading.Thread(target=self._health_loop, name="llm-router-health", daemon=True).start()
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "RouterLLM":
+        """
+        Build a router from its backends (see parse_backends).
+        """
+        backends = []
+        for config in parse_backends(spec):
+            llm = GenericLLM.choose(config["model"], config["service"], endpoint=config["endpoint"])
+            assert not isinstance(llm, (Embeddings, RouterLLM)), f"Service {config['service']} can't be routed"
+
+            backends.append(RouterBackend(llm, max_concurrent=config["max"], tpm=config["tpm"]))
+        return cls(backends)
+
+    def _score(self, backend: RouterBackend) -> float:
+        if self.strategy == "latency":
+            known = [b.latency for b in self.backends if b.latency is not None]
+            latency = backend.latency if backend.latency is not None else (min(known) if known else 1.0)
+            return latency * (backend.outstanding + 1)
+
+        return backend.outstanding / (backend.max_concurrent or 1)
+
+    def _acquire(self, tried: List[RouterBackend], tokens: int = 0) -> RouterBackend | None:
+        """
+        Pick a backend and count the call as outstanding. Waits while the
+        healthy backends are at their quota.
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                untried = [b for b in self.backends if b not in tried]
+                if not untried:
+                    return None
+
+                healthy = [b for b in untried if b.healthy(now)]
+                candidates = [b for b in healthy if b.has_capacity(tokens)]
+
+                if not candidates and not healthy:
+                    # Probe the unhealthy ones rather than failing the call
+                    candidates = [b for b in untried if b.has_capacity(tokens)]
+                    if not candidates and not any(b.quota() for b in untried):
+                        candidates = untried
+
+                if candidates:
+                    best = min(self._score(b) for b in candidates)
+                    backend = random.choice([b for b in candidates if self._score(b) == best])
+                    backend.outstanding += 1
+                    telemetry.router_load(backend.name, backend.outstanding)
+                    return backend
+
+                self.condition.wait(timeout=1)
+
+    def _release(self, backend: RouterBackend, elapsed: float = None, error: Exception = None):
+        with self.condition:
+            backend.outstanding -= 1
+            telemetry.router_load(backend.name, backend.outstanding)
+
+            if error is None:
+                backend.failures = 0
+                backend.unhealthy_until = 0.0
+                if elapsed is not None:
+                    backend.latency = elapsed if backend.latency is None else \
+                        LATENCY_EWMA_ALPHA * elapsed + (1 - LATENCY_EWMA_ALPHA) * backend.latency
+            else:
+                backend.failures += 1
+                if backend.failures >= self.failure_threshold:
+                    backend.unhealthy_until = time.monotonic() + self.cooldown
+                    logger.warning(f"Router backend {backend.name} failed {backend.failures} times, out for {self.cooldown:.0f}s")
+
+            self.condition.notify_all()
+
+    def call(self,
+             messages: "ChatBuilder",
+             temperature: float = None,
+             structure: Any = None
+             ) -> Any:
+        """
+        Call one of the backends, trying the others if it fails.
+
+        Args:
+            messages (ChatBuilder): The messages.
+            temperature (float): Sampling temperature for the model.
+            structure (Any): Structure of the response.
+        """
+        tokens = ratelimit.estimate_tokens(messages.build())
+        
+        tried = []
+        error = None
+        while True:
+            backend = self._acquire(tried, tokens)
+            if backend is None:
+                break
+            tried.append(backend)
+
+            entry = backend.limiter.acquire(tokens) if backend.limiter else None
+            start = time.perf_counter()
+            try:
+                with usage.capture() as captured:
+                    result = backend.llm.call(messages=messages, temperature=temperature, structure=structure)
+            except Exception as e:
+                if entry is not None:
+                    backend.limiter.settle(entry, 0, success=False)
+                
+                if not ratelimit.should_failover(e):
+                    # Not the backend's fault (bad request, parsing...)
+                    self._release(backend, elapsed=time.perf_counter() - start)
+                    raise
+
+                self._release(backend, error=e)
+                telemetry.routed(backend.name, "failed")
+                logger.warning(f"Router backend {backend.name} failed ({e.__class__.__name__}: {e}), trying another one")
+                error = e
+                continue
+
+            if entry is not None:
+                backend.limiter.settle(entry, sum(r.input_tokens + r.output_tokens for r in captured.records) or tokens)
+            
+            self._release(backend, elapsed=time.perf_counter() - start)
+            telemetry.routed(backend.name, "ok")
+            return result
+
+        if self.fallback is not None:
+            return failover(self, error, messages=messages, temperature=temperature, structure=structure)
+        raise error
+
+    def _health_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            for backend in self.backends:
+                self.check(backend)
+
+    def check(self, backend: RouterBackend) -> bool:
+        """
+        Health check of a backend: list its models.
+        """
+        try:
+            backend.llm.models(timeout=ROUTER_HEALTH_TIMEOUT)
+        except Exception as e:
+            with self.condition:
+                if backend.unhealthy_until <= time.monotonic():
+                    logger.warning(f"Router backend {backend.name} failed its health check: {e}")
+                backend.unhealthy_until = time.monotonic() + self.cooldown
+            telemetry.router_health(backend.name, False)
+            return False
+
+        with self.condition:
+            if backend.unhealthy_until > time.monotonic():
+                logger.info(f"Router backend {backend.name} is healthy again")
+            backend.failures = 0
+            backend.unhealthy_until = 0.0
+            self.condition.notify_all()
+        telemetry.router_health(backend.name, True)
+        return True
+
+    def models(self, timeout: float = None):
+        """
+        Get the models of the first healthy backend.
+        """
+        now = time.monotonic()
+        backends = sorted(self.backends, key=lambda b: not b.healthy(now))
+        return backends[0].llm.models(timeout=timeout)
+
+    def get_usage(self) -> Tuple[int, int]:
+        """
+        Get the usage of all the backends.
+        
+        Returns:
+            Tuple[int, int]: A tuple containing the input and output token usage.
+        """
+        usages = [b.llm.get_usage() for b in self.backends]
+        if self.fallback is not None:
+            usages.append(self.fallback.get_usage())
+        return sum(i for i, _ in usages), sum(o for _, o in usages)
+    
+    def get_cached_usage(self) -> int:
+        """
+        Get the cached input tokens of all the backends.
+        
+        Returns:
+            int: The cached input tokens.
+        """
+        llms = [b.llm for b in self.backends] + ([self.fallback] if self.fallback is not None else [])
+        return sum(llm.get_cached_usage() for llm in llms)
+
+    def get_model(self) -> str:
+        """
+        Get the model names of the backends.
+        
+        Returns:
+            str: The distinct models, comma separated.
+        """
+        return ",".join(dict.fromkeys(b.llm.get_model() for b in self.backends))
+
+    def get_endpoint(self) -> str:
+        """
+        Get the endpoint URLs of the backends.
+        
+        Returns:
+            str: The endpoints, comma separated.
+        """
+        return ",".join(str(b.llm.get_endpoint()) for b in self.backends)
+
+    def get_context_window(self) -> int:
+        """
+        Get the smallest context window of the backends, so prompts fit in any of them.
+        
+        Returns:
+            int: The context window size in tokens.
+        """
+        return min(b.llm.get_context_window() for b in self.backends)
+
 # Embeddings
 class Embeddings(ABC):
     @abstractmethod
@@ -440,6 +1034,8 @@ class Embeddings(ABC):
         pass
     
 class OllamaEmbeddings(Embeddings):
+    role: Optional[str] = None
+    
     def __init__(self, model:str, endpoint: str = None, api_key: str = None):
         
         llm = Ollama(model=model)
@@ -448,6 +1044,10 @@ class OllamaEmbeddings(Embeddings):
         self.endpoint = llm.endpoint
         self.model = model
         
+        self.input_usage = 0
+        
+    @telemetry.external("embeddings")
+    @fixtures.recorded("embeddings")
     def get_embeddings(self, text: str) -> list[float]:
         logger.debug(f"Generating embeddings with model {self.model} at {self.endpoint}")
         
@@ -456,8 +1056,23 @@ class OllamaEmbeddings(Embeddings):
             input=text,
         )
         
+        input_tokens = getattr(resp.usage, "prompt_tokens", None) or 0
+        self.input_usage += input_tokens
+        usage.record(self.model, self.role, input_tokens)
+        
         return resp.data[0].embedding
 
+def set_role(llm: Any, role: str):
+    """
+    Set what an LLM (and its fallback or router backends) is used for, for the usage records.
+    """
+    llm.role = role
+    
+    if getattr(llm, "fallback", None) is not None:
+        set_role(llm.fallback, role)
+    for backend in getattr(llm, "backends", None) or []:
+        set_role(backend.llm, role)
+
 # Define the generic services       
 GENERIC_SERVICES = [
     "openai",
@@ -466,25 +1081,35 @@ GENERIC_SERVICES = [
     "ollama-embeddings",
     "custom",
     "custom-google",
+    "router",
 ] 
 
 class GenericLLM():
     @classmethod
-    def choose(cls, model: str, service: str):
+    def choose(cls, model: str, service: str, fallback_model: str = None, fallback_service: str = None, endpoint: str = None):
         assert service in GENERIC_SERVICES, f"Service must be one of {GENERIC_SERVICES}"
         
         if service == "openai":
-            return OpenAI(model=model)
+            result = OpenAI(model=model, endpoint=endpoint)
         elif service == "openrouter":
-            return OpenRouter(model=model)
+            result = OpenRouter(model=model, endpoint=endpoint)
         elif service == "ollama":
-            return Ollama(model=model)
+            result = Ollama(model=model, endpoint=endpoint)
         elif service == "ollama-embeddings":
             return OllamaEmbeddings(model=model)
         elif service == "custom":
-            return LLM(model=model, endpoint=os.getenv("CUSTOM_BASE_URL"), api_key=os.getenv("CUSTOM_API_KEY"))
+            result = LLM(model=model, endpoint=endpoint or os.getenv("CUSTOM_BASE_URL"), api_key=os.getenv("CUSTOM_API_KEY"))
         elif service == "custom-google":
-            return GoogleLLM(model=model, endpoint=os.getenv("CUSTOM_BASE_URL"), api_key=os.getenv("CUSTOM_API_KEY"))
+            result = GoogleLLM(model=model, endpoint=endpoint or os.getenv("CUSTOM_BASE_URL"), api_key=os.getenv("CUSTOM_API_KEY"))
+        elif service == "router":
+            # The model lists the backends
+            result = RouterLLM.from_spec(model)
+        
+        # Alternate model or endpoint for failover (e.g. PDF_FALLBACK_MODEL / PDF_FALLBACK_SERVICE)
+        if fallback_model and fallback_service:
+            result.fallback = cls.choose(fallback_model, fallback_service)
+        
+        return result
 
 API_FORMATS = [
     "default",
@@ -508,10 +1133,17 @@ class ChatBuilder:
         self.messages.append({"role": "assistant", "content": prompt})
         return self
 
-    def user(self, prompt: str = None, image_uri = None, pdf_uri = None, pdf_name = None):
+    def user(self, prompt: str = None, image_uri = None, pdf_uri = None, pdf_name = None, pdf: bytes = None):
         content = prompt
         
-        attachment = image_uri or pdf_uri
+        # The PDF is kept as raw bytes, and only encoded when a request needs it
+        if pdf is None and pdf_uri is not None:
+            pdf = pdf_uri
+        if isinstance(pdf, str):
+            # Data URIs (also found in old snapshots and fixtures)
+            pdf = utils.b64_to_bytes(pdf)
+        
+        attachment = image_uri or pdf
         if attachment:
             content = []
             
@@ -526,14 +1158,14 @@ class ChatBuilder:
                     }
                 })
             # Include a pdf
-            if pdf_uri or pdf_name:
-                assert pdf_uri, "PDF URI must be provided if PDF name is given"
-                assert pdf_name, "PDF name must be provided if PDF URI is given"
+            if pdf or pdf_name:
+                assert pdf, "PDF must be provided if PDF name is given"
+                assert pdf_name, "PDF name must be provided if PDF is given"
                 
                 content.append({
                     "type": "file",
                     "file": {
-                        "file_data": pdf_uri,
+                        "file_data": pdf,
                         "filename": pdf_name or "file.pdf",
                     }
                 })
@@ -547,6 +1179,23 @@ class ChatBuilder:
     
     def build(self):
         return self.messages
+    
+    def encode(self) -> List[Dict]:
+        """
+        Get the messages in the Chat Completions format, with the files as
+        base64 data URIs. Called once per request.
+        """
+        messages = []
+        for msg in self.messages:
+            content = msg["content"]
+            if isinstance(content, list):
+                content = [
+                    {**part, "file": {**part["file"], "file_data": utils.bytes_to_b64(part["file"]["file_data"], PDF_MIME)}}
+                    if part["type"] == "file" and not isinstance(part["file"]["file_data"], str) else part
+                    for part in content
+                ]
+            messages.append({**msg, "content": content})
+        return messages
 
 # Test
 if __name__ == "__main__":
@@ -772,10 +1421,10 @@ if __name__ == "__main__":
             service="custom-google"
         )
         
-        pdf_b64 = utils.load_b64("libreria/dummy/elpais.pdf")
+        pdf = utils.load_binary("libreria/dummy/elpais.pdf")
         msgs = ChatBuilder()
         msgs.system("Extract the following fields from the PDF: title, author, num_pages. Respond in JSON.")
-        msgs.user("Extract info from this PDF.", pdf_name="test.pdf", pdf_uri=pdf_b64)
+        msgs.user("Extract info from this PDF.", pdf_name="test.pdf", pdf=pdf)
 
         response = google_llm.call(
             messages=msgs,
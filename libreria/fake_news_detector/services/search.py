@@ -14,6 +14,8 @@ import brave_search_python_client
 
 import fake_news_detector.debug as debug
 import fake_news_detector.utils as utils
+import fake_news_detector.fixtures as fixtures
+import fake_news_detector.telemetry as telemetry
 from fake_news_detector.datatypes import *
 
 FULL_SEARCH = True
@@ -31,8 +33,11 @@ class BraveSearchEngine(SearchEngine):
         self.client = brave_search_python_client.BraveSearch(api_key=os.getenv("BRAVE_SEARCH_API_KEY"))
     
     #TODO: Retry only in page error
+    @telemetry.external("search")
+    @fixtures.recorded("search")
     @retry(stop=stop_after_attempt(3),wait=wait_fixed(2), \
-           retry=retry_if_result(lambda results: results is []))
+           retry=retry_if_result(lambda results: results is []),
+           before_sleep=telemetry.on_retry("search"))
     def search(self, query: str, max_results: int = None):
         results = []
         
@@ -81,7 +86,7 @@ class BraveSearchEngine(SearchEngine):
                     dt = dateparser.parse(result.age)
                     dt.replace(hour=0, minute=0, second=0, microsecond=0) # Remove time (unknown)
                     
-                logger.trace(f"[{len(results)}] ({utils.readable_datetime(dt)}) {result.title}")
+                logger.opt(lazy=True).trace("[{}] ({}) {}", lambda: len(results), lambda: utils.readable_datetime(dt), lambda: result.title)
                 
                 # Append the result to the list
                 results.append(SearchResult(
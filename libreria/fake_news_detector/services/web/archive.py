@@ -4,11 +4,15 @@ from loguru import logger
 import fake_news_detector.debug as debug
 import fake_news_detector.network as network
 import fake_news_detector.utils as utils
+import fake_news_detector.fixtures as fixtures
+import fake_news_detector.telemetry as telemetry
 
 class Archive:
     def __init__(self):
         pass
     
+    @telemetry.external("archive")
+    @fixtures.recorded("archive")
     def get_archive(self, url: str) -> str | None:
         """
         Get the archive URL for a given URL using the Wayback Machine CDX Server API.
@@ -22,7 +26,7 @@ class Archive:
         cdx_api = WaybackMachineCDXServerAPI(url, network.get_useragent())
         oldest = cdx_api.oldest()
         
-        logger.trace(oldest)
+        logger.trace("{}", oldest)
         
         logger.debug(f"Recovered URL on {utils.readable_datetime(oldest.datetime_timestamp)}: {oldest.archive_url}")
         
@@ -26,7 +26,7 @@ class ScrapeResult:
     content_type: str = None
     
     html: str = None
-    pdf: str = None # in base64 format
+    pdf: bytes = None # raw PDF
         
 class Scraper(ABC):
     supports: Format
@@ -130,13 +130,12 @@ class PlaywrightScraper(Scraper):
                 # Log the resulting HTML
                 utils.save(f"logs/files/{url_filepath}", html)
             
-            pdf_b64 = None
+            pdf = None
             if Format.PDF in format:
                 pdf = page.pdf(
                     print_background=True, # to include images
                     #format="A4",
                 )
-                pdf_b64 = utils.bytes_to_b64(pdf, "application/pdf")
                 
                 # Log the resulting PDF
                 utils.save_binary(f"logs/files/{url_filepath}.pdf", pdf)
@@ -145,7 +144,7 @@ class PlaywrightScraper(Scraper):
                 status=status,
                 title=title,
                 html=html,
-                pdf=pdf_b64,
+                pdf=pdf,
                 content_type=content_type,
             )
         
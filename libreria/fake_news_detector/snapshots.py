@@ -0,0 +1,260 @@
+from typing import Any, Dict, List, Tuple
+from loguru import logger
+from datetime import datetime, timezone
+import multiprocessing.util
+import threading
+import hashlib
+import pickle
+import queue
+import os
+
+from fake_news_detector.datatypes import Pipe
+
+# Snapshots of the pipe after every phase, for debugging and resuming.
+#
+# Only the fields that changed since the previous phase are stored, and the
+# large ones (PDF, HTML, article, webpages...) go to content-addressed blobs
+# that are written once:
+#
+#   <PIPE_PATH>/blobs/<hh>/<sha256>.pkl
+#   <PIPE_PATH>/<pipe id>/<nn>_<phase>.pkl   {"phase", "time", "inline", "blobs"}
+#
+# The pipeline only pickles the fields that may have changed. Hashing and
+# disk I/O happen on a background thread.
+
+DEFAULT_PIPE_PATH = "logs/pipes/"
+BLOB_MIN_SIZE = 4 * 1024  # bytes, smaller fields are stored in the delta
+BLOBS_DIR = "blobs"
+
+# Immutable values can be compared by identity, without pickling them
+IMMUTABLE = (str, bytes, int, float, bool, type(None), datetime)
+
+def _write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+class SnapshotWriter:
+    """
+    Stores pipe snapshots as per-phase deltas, from a background thread.
+    """
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("PIPE_PATH") or DEFAULT_PIPE_PATH
+
+        # Caller side: last value of every field, by pipe
+        self.last: Dict[str, Dict[str, Any]] = {}
+        self.sequence: Dict[str, int] = {}
+
+        # Writer side: last hash of every field, by pipe
+        self.hashes: Dict[str, Dict[str, str]] = {}
+
+        self.queue: "queue.Queue[tuple]" = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+        self.thread.start()
+
+        # Also runs when worker processes exit, unlike atexit
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def capture(self, pipe: Pipe, phase: str):
+        """
+        Queue a snapshot of the pipe after a phase.
+        """
+        pipe_id = pipe.id
+        last = self.last.setdefault(pipe_id, {})
+
+        fields = {}
+        for name, value in vars(pipe).items():
+            if isinstance(value, IMMUTABLE) and name in last and last[name] is value:
+                continue
+
+            last[name] = value
+            fields[name] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Resumed pipes go on after their previous snapshots
+        if pipe_id not in self.sequence:
+            found = checkpoints(pipe_id, self.path)
+            self.sequence[pipe_id] = found[-1][0] + 1 if found else 0
+
+        sequence = self.sequence[pipe_id]
+        self.sequence[pipe_id] = sequence + 1
+
+        self.queue.put(("snapshot", pipe_id, sequence, phase, fields))
+
+    def close(self, pipe_id: str):
+        """
+        Forget a finished pipe. Its pending snapshots are still written.
+        """
+        self.last.pop(pipe_id, None)
+        self.sequence.pop(pipe_id, None)
+        self.queue.put(("close", pipe_id))
+
+    def save_obj(self, path: str, obj: object):
+        """
+        Pickle an object now, and write it in the background.
+        """
+        self.queue.put(("file", path, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def flush(self):
+        """
+        Wait until everything queued is written.
+        """
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item[0] == "snapshot":
+                    self._write_snapshot(*item[1:])
+                elif item[0] == "close":
+                    self.hashes.pop(item[1], None)
+                elif item[0] == "file":
+                    _write(item[1], item[2])
+            except Exception as e:
+                logger.error(f"Could not write the snapshot: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _write_snapshot(self, pipe_id: str, sequence: int, phase: str, fields: Dict[str, bytes]):
+        hashes = self.hashes.setdefault(pipe_id, {})
+
+        inline = {}
+        blobs = {}
+        for name, data in fields.items():
+            digest = hashlib.sha256(data).hexdigest()
+            if hashes.get(name) == digest:
+                continue
+            hashes[name] = digest
+
+            if len(data) < BLOB_MIN_SIZE:
+                inline[name] = data
+                continue
+
+            blobs[name] = digest
+            path = blob_path(self.path, digest)
+            if not os.path.exists(path):
+                _write(path, data)
+
+        delta = {
+            "phase": phase,
+            "time": datetime.now(timezone.utc),
+            "inline": inline,
+            "blobs": blobs,
+        }
+        _write(os.path.join(self.path, pipe_id, f"{sequence:02d}_{phase}.pkl"), pickle.dumps(delta))
+
+        logger.trace(f"Snapshot {pipe_id}/{phase}: {len(inline)} inline, {len(blobs)} blob fields")
+
+def blob_path(path: str, digest: str) -> str:
+    return os.path.join(path, BLOBS_DIR, digest[:2], f"{digest}.pkl")
+
+def checkpoints(pipe_id: str, path: str = None) -> List[Tuple[int, str]]:
+    """
+    Get the snapshots of a pipe.
+
+    Returns:
+        List[Tuple[int, str]]: (sequence, phase), in order.
+    """
+    folder = os.path.join(path or os.getenv("PIPE_PATH") or DEFAULT_PIPE_PATH, pipe_id)
+    if not os.path.isdir(folder):
+        return []
+
+    result = []
+    for filename in os.listdir(folder):
+        if filename.endswith(".pkl"):
+            sequence, _, phase = filename[:-len(".pkl")].partition("_")
+            result.append((int(sequence), phase))
+    return sorted(result)
+
+def load(pipe_id: str, phase: str = None, path: str = None) -> Pipe:
+    """
+    Rebuild a pipe from its snapshots.
+
+    Args:
+        pipe_id (str): The ID of the pipe.
+        phase (str): Stop after the snapshot of this phase. Defaults to the last one.
+        path (str): The snapshots folder. Defaults to PIPE_PATH.
+
+    Returns:
+        Pipe: The pipe as it was after the phase.
+    """
+    path = path or os.getenv("PIPE_PATH") or DEFAULT_PIPE_PATH
+
+    found = checkpoints(pipe_id, path)
+    if not found:
+        raise FileNotFoundError(f"No snapshots for pipe {pipe_id}")
+    if phase and phase not in [p for _, p in found]:
+        raise FileNotFoundError(f"No snapshot of phase {phase} for pipe {pipe_id}")
+
+    pipe = Pipe.__new__(Pipe)
+    for sequence, name in found:
+        with open(os.path.join(path, pipe_id, f"{sequence:02d}_{name}.pkl"), "rb") as f:
+            delta = pickle.load(f)
+
+        for field, data in delta["inline"].items():
+            setattr(pipe, field, pickle.loads(data))
+
+        for field, digest in delta["blobs"].items():
+            with open(blob_path(path, digest), "rb") as f:
+                setattr(pipe, field, pickle.load(f))
+
+        if name == phase:
+            break
+
+    return pipe
+
+_writer: SnapshotWriter = None
+_writer_lock = threading.Lock()
+
+def get_writer() -> SnapshotWriter:
+    """
+    Get the snapshot writer of this process, started on first use.
+    """
+    global _writer
+
+    with _writer_lock:
+        if _writer is None:
+            _writer = SnapshotWriter()
+        return _writer
+
+if __name__ == "__main__":
+    import tempfile
+
+    def test_snapshots():
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = SnapshotWriter(tmp)
+
+            pipe = Pipe("https://example.com/article")
+            pipe.article_pdf = b"x" * 100000
+            writer.capture(pipe, "download_article")
+
+            pipe.question = "Why?"
+            writer.capture(pipe, "process_article")
+            writer.close(pipe.id)
+            writer.flush()
+
+            assert [p for _, p in checkpoints(pipe.id, tmp)] == ["download_article", "process_article"]
+
+            # The PDF is only stored once
+            blobs = [f for _, _, files in os.walk(os.path.join(tmp, BLOBS_DIR)) for f in files]
+            assert len(blobs) == 1
+
+            loaded = load(pipe.id, "download_article", tmp)
+            assert loaded.article_pdf == pipe.article_pdf and loaded.question is None
+            assert load(pipe.id, path=tmp).question == "Why?"
+
+            # Resumed by another writer: its snapshots come after the previous ones
+            writer = SnapshotWriter(tmp)
+            resumed = load(pipe.id, path=tmp)
+            resumed.question = "Why not?"
+            writer.capture(resumed, "search")
+            writer.close(resumed.id)
+            writer.flush()
+
+            assert [p for _, p in checkpoints(pipe.id, tmp)] == ["download_article", "process_article", "search"]
+            assert load(pipe.id, path=tmp).question == "Why not?"
+        print("Snapshots test passed")
+    #test_snapshots()
@@ -0,0 +1,348 @@
+from typing import Any, Callable, Dict
+from contextlib import contextmanager
+from loguru import logger
+import functools
+import time
+import os
+
+from opentelemetry import trace
+from opentelemetry.trace import Status, StatusCode
+import prometheus_client as prom
+
+# Spans of the phases, LLM calls and scrapes, exported as OpenTelemetry
+# traces (when OTEL_EXPORTER_OTLP_ENDPOINT is set) and Prometheus metrics
+# (in the default registry, served by the backend's /metrics).
+
+TRACER_NAME = "fake_news_detector"
+SERVICE_NAME = "fake-news-detector"
+
+# Buckets, in seconds
+PHASE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+CALL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+PHASE_DURATION = prom.Histogram(
+    "fnd_phase_duration_seconds", "Wall time of the pipeline phases.",
+    ["phase"], buckets=PHASE_BUCKETS,
+)
+PHASE_CPU = prom.Histogram(
+    "fnd_phase_cpu_seconds", "CPU time of the pipeline phases, in their thread.",
+    ["phase"], buckets=PHASE_BUCKETS,
+)
+PHASE_OUTCOMES = prom.Counter(
+    "fnd_phase_outcomes", "Finished phases, by outcome (ok, refusal, error, exception, cancelled).",
+    ["phase", "outcome"],
+)
+LLM_DURATION = prom.Histogram(
+    "fnd_llm_call_duration_seconds", "Latency of the LLM calls.",
+    ["model"], buckets=CALL_BUCKETS,
+)
+LLM_TOKENS = prom.Counter(
+    "fnd_llm_tokens", "Tokens used by the LLM and embeddings calls (cached: the part of the input read from the provider's cache).",
+    ["model", "direction"],
+)
+LLM_COST = prom.Counter(
+    "fnd_llm_cost_usd", "Estimated cost of the LLM and embeddings calls, for the models with a price.",
+    ["model"],
+)
+SCRAPE_DURATION = prom.Histogram(
+    "fnd_scrape_duration_seconds", "Latency of the scrapes.",
+    ["format"], buckets=CALL_BUCKETS,
+)
+SCRAPE_BYTES = prom.Counter(
+    "fnd_scrape_bytes", "Size of the scraped HTML and PDFs.",
+    ["format"],
+)
+SCRAPE_OUTCOMES = prom.Counter(
+    "fnd_scrapes", "Scrapes, by outcome (ok, rejected, failed, exception).",
+    ["format", "outcome"],
+)
+EXTERNAL_CALL_DURATION = prom.Histogram(
+    "fnd_external_call_duration_seconds", "Latency of the calls to external services (llm, scrape, search, dns...).",
+    ["service", "outcome"], buckets=CALL_BUCKETS,
+)
+RETRIES = prom.Counter(
+    "fnd_retries", "Retried external calls.",
+    ["service"],
+)
+RATE_LIMITS = prom.Counter(
+    "fnd_rate_limits", "Rate-limited (429) LLM calls, by endpoint.",
+    ["endpoint"],
+)
+THROTTLE_SECONDS = prom.Counter(
+    "fnd_throttle_seconds", "Time the LLM calls waited for the rate limiter.",
+    ["endpoint"],
+)
+FAILOVERS = prom.Counter(
+    "fnd_llm_failovers", "LLM calls sent to the fallback model.",
+    ["model", "fallback"],
+)
+ROUTED_CALLS = prom.Counter(
+    "fnd_router_calls", "LLM calls sent by the router, by backend and outcome.",
+    ["backend", "outcome"],
+)
+ROUTER_OUTSTANDING = prom.Gauge(
+    "fnd_router_outstanding", "LLM calls running in every router backend.",
+    ["backend"], multiprocess_mode="livesum",
+)
+ROUTER_HEALTHY = prom.Gauge(
+    "fnd_router_healthy", "Result of the last health check of every router backend (1: healthy).",
+    ["backend"], multiprocess_mode="liveall",
+)
+CACHE_LOOKUPS = prom.Counter(
+    "fnd_cache_lookups", "Cache lookups, by result (hit, miss).",
+    ["cache", "result"],
+)
+
+tracer = trace.get_tracer(TRACER_NAME)
+
+def setup():
+    """
+    Export the traces with OTLP if OTEL_EXPORTER_OTLP_ENDPOINT is set. The
+    standard OTEL_* variables configure the exporter.
+    """
+    if not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return
+
+    if not isinstance(trace.get_tracer_provider(), trace.ProxyTracerProvider):
+        return  # Already configured
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+
+    provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", SERVICE_NAME)}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+    logger.debug(f"Exporting traces to {os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT')}")
+
+class Span:
+    """
+    The measures of a running span. Attributes set with set() are exported
+    with the trace, and used for the metrics when it ends.
+    """
+    def __init__(self, name: str, otel_span: "trace.Span", attributes: Dict[str, Any]):
+        self.name = name
+        self.otel_span = otel_span
+        self.attributes = dict(attributes)
+
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.outcome = "ok"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def event(self, name: str, **attributes):
+        self.otel_span.add_event(name, {k: v for k, v in attributes.items() if v is not None})
+
+def _observe(span: Span):
+    """
+    Turn a finished span into Prometheus metrics.
+    """
+    attrs = span.attributes
+
+    if span.name == "phase":
+        PHASE_DURATION.labels(attrs["phase"]).observe(span.wall)
+        PHASE_CPU.labels(attrs["phase"]).observe(span.cpu)
+        PHASE_OUTCOMES.labels(attrs["phase"], span.outcome).inc()
+
+    elif span.name == "llm.call":
+        model = attrs.get("model") or "unknown"
+        LLM_DURATION.labels(model).observe(span.wall)
+        EXTERNAL_CALL_DURATION.labels("llm", span.outcome).observe(span.wall)
+
+    elif span.name == "scrape":
+        fmt = attrs.get("format") or "unknown"
+        SCRAPE_DURATION.labels(fmt).observe(span.wall)
+        SCRAPE_BYTES.labels(fmt).inc(attrs.get("bytes", 0))
+        SCRAPE_OUTCOMES.labels(fmt, span.outcome).inc()
+        EXTERNAL_CALL_DURATION.labels("scrape", span.outcome).observe(span.wall)
+
+    elif span.name == "external":
+        EXTERNAL_CALL_DURATION.labels(attrs["service"], span.outcome).observe(span.wall)
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Measure a block as a span: wall time, CPU time of the thread, and the
+    attributes set on it (bytes, tokens, cache...).
+
+    Args:
+        name (str): "phase", "llm.call", "scrape"... Other names are only traced.
+        **attributes: Initial attributes.
+
+    Yields:
+        Span: The running span.
+    """
+    with tracer.start_as_current_span(name, record_exception=False, set_status_on_exception=False) as otel_span:
+        current = Span(name, otel_span, attributes)
+
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield current
+        except BaseException as e:
+            if current.outcome == "ok":
+                current.outcome = "exception"
+            otel_span.record_exception(e)
+            otel_span.set_status(Status(StatusCode.ERROR, str(e)))
+            raise
+        finally:
+            current.wall = time.perf_counter() - wall
+            current.cpu = time.thread_time() - cpu
+
+            otel_span.set_attributes({
+                **{k: v for k, v in current.attributes.items() if isinstance(v, (str, bool, int, float))},
+                "wall_time": current.wall,
+                "cpu_time": current.cpu,
+                "outcome": current.outcome,
+            })
+
+            try:
+                _observe(current)
+            except Exception as e:
+                logger.warning(f"Could not record the metrics of span {name}: {e}")
+
+def traced(name: str) -> Callable:
+    """
+    Decorator to run a whole function in a span.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def llm_call(func: Callable) -> Callable:
+    """
+    Decorator for LLM.call: a span with the latency of the call. Its tokens
+    are added by llm_tokens().
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with span("llm.call", model=self.get_model(), service=type(self).__name__):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+def llm_tokens(model: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0, cost: float = None):
+    """
+    Count the tokens (and cost) of an LLM or embeddings call, and note them in the current span.
+    """
+    model = model or "unknown"
+    LLM_TOKENS.labels(model, "input").inc(input_tokens)
+    LLM_TOKENS.labels(model, "output").inc(output_tokens)
+    LLM_TOKENS.labels(model, "cached").inc(cached_tokens)
+    if cost is not None:
+        LLM_COST.labels(model).inc(cost)
+
+    trace.get_current_span().set_attributes({
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cached_tokens": cached_tokens,
+        **({"cost": cost} if cost is not None else {}),
+    })
+
+def scrape(func: Callable) -> Callable:
+    """
+    Decorator for Scraper.scrape: a span with the latency, outcome and size of the scrape.
+    """
+    @functools.wraps(func)
+    def wrapper(self, url: str, *args, **kwargs):
+        fmt = kwargs.get("format", args[0] if args else None)
+        with span("scrape", url=url, format=str(fmt.name) if fmt is not None else "HTML") as current:
+            result = func(self, url, *args, **kwargs)
+
+            if result is None:
+                current.outcome = "failed"
+            elif result is False:
+                current.outcome = "rejected"
+            else:
+                current.set(
+                    status=result.status,
+                    bytes=len(result.html or "") + len(result.pdf or ""),
+                )
+            return result
+    return wrapper
+
+def external(service: str) -> Callable:
+    """
+    Decorator for the other calls to external services: a span with their latency.
+
+    Args:
+        service (str): The label of the service in the metrics (search, dns, geolocation...).
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span("external", service=service):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def on_retry(service: str) -> Callable:
+    """
+    Get a tenacity before_sleep callback that counts the retries of a service.
+    """
+    def before_sleep(retry_state):
+        retried(service, retry_state.attempt_number)
+    return before_sleep
+
+def retried(service: str, attempt: int):
+    """
+    Count a retry of a service, and note it in the current span.
+    """
+    RETRIES.labels(service).inc()
+    trace.get_current_span().add_event("retry", {"service": service, "attempt": attempt})
+    logger.debug(f"Retrying {service} (attempt {attempt})")
+
+def rate_limited(endpoint: str):
+    RATE_LIMITS.labels(endpoint).inc()
+    trace.get_current_span().add_event("rate_limit", {"endpoint": endpoint})
+
+def throttled(endpoint: str, seconds: float):
+    THROTTLE_SECONDS.labels(endpoint).inc(seconds)
+    trace.get_current_span().add_event("throttle", {"endpoint": endpoint, "seconds": seconds})
+
+def failover(model: str, fallback: str):
+    FAILOVERS.labels(model, fallback).inc()
+    trace.get_current_span().add_event("failover", {"model": model, "fallback": fallback})
+
+def routed(backend: str, outcome: str):
+    ROUTED_CALLS.labels(backend, outcome).inc()
+
+def router_load(backend: str, outstanding: int):
+    ROUTER_OUTSTANDING.labels(backend).set(outstanding)
+
+def router_health(backend: str, healthy: bool):
+    ROUTER_HEALTHY.labels(backend).set(1 if healthy else 0)
+
+def cache_lookup(cache: str, hit: bool):
+    """
+    Count a cache lookup, and note it in the current span.
+    """
+    result = "hit" if hit else "miss"
+    CACHE_LOOKUPS.labels(cache, result).inc()
+    trace.get_current_span().add_event("cache", {"cache": cache, "result": result})
+
+if __name__ == "__main__":
+    def test_span():
+        with span("phase", phase="test") as s:
+            s.set(input_tokens=10)
+            time.sleep(0.01)
+
+        try:
+            with span("phase", phase="test") as s:
+                s.outcome = "refusal"
+                raise ValueError("Refused")
+        except ValueError:
+            pass
+
+        assert PHASE_OUTCOMES.labels("test", "ok")._value.get() == 1
+        assert PHASE_OUTCOMES.labels("test", "refusal")._value.get() == 1
+        assert PHASE_DURATION.labels("test")._sum.get() >= 0.01
+        print(prom.generate_latest().decode())
+    #test_span()
@@ -0,0 +1,258 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from loguru import logger
+import dataclasses
+import threading
+import os
+
+import fake_news_detector.telemetry as telemetry
+from fake_news_detector.datatypes import UsageRecord
+
+# Token usage of every LLM and embeddings call, by analysis and phase.
+#
+# The LLM clients are shared by the analyses of a detector (and by the
+# threads of the backend), so their counters can't tell analyses apart.
+# Instead every call records a UsageRecord in the tracker of the analysis
+# that runs in the current context (FakeNewsDetector._run), which keeps them
+# in Pipe.usage.
+#
+#   LLM_PRICES=gpt-4.1=2/0.5/8,my-model=0.2/0.6   USD per million input/cached/output
+#                                                  (or input/output) tokens
+
+# USD per million tokens: (input, cached input, output). Approximate list
+# prices, check the provider's page and override them with LLM_PRICES
+PRICES: Dict[str, Tuple[float, Optional[float], float]] = {
+    # OpenAI
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    # Google
+    "gemini-2.0-flash": (0.10, 0.025, 0.40),
+    "gemini-2.5-flash": (0.30, 0.075, 2.50),
+    "gemini-2.5-pro": (1.25, 0.31, 10.00),
+    # OpenRouter
+    "gemma-3-12b-it": (0.05, None, 0.10),
+    "gemma-3-27b-it": (0.10, None, 0.20),
+    "llama-3.2-11b-vision-instruct": (0.05, None, 0.05),
+    "llama-4-scout": (0.08, None, 0.30),
+    # Ollama (local)
+    "gemma3:27b": (0.0, 0.0, 0.0),
+}
+
+ROLES = ["pdf", "text", "embeddings"]
+
+_tracker: ContextVar[Optional["UsageTracker"]] = ContextVar("usage_tracker", default=None)
+
+_unpriced = set()
+_unpriced_lock = threading.Lock()
+
+def parse_prices(value: str) -> Dict[str, Tuple[float, Optional[float], float]]:
+    """
+    Parse LLM_PRICES ("model=input/cached/output" or "model=input/output", comma separated).
+    """
+    prices = {}
+    for item in (value or "").split(","):
+        model, _, price = item.strip().rpartition("=")
+        if not model:
+            continue
+
+        parts = [float(p) for p in price.split("/")]
+        if len(parts) == 2:
+            prices[model.strip()] = (parts[0], None, parts[1])
+        elif len(parts) == 3:
+            prices[model.strip()] = (parts[0], parts[1], parts[2])
+        else:
+            raise ValueError(f"LLM_PRICES must be input/output or input/cached/output: {item}")
+    return prices
+
+def get_price(model: str) -> Optional[Tuple[float, Optional[float], float]]:
+    """
+    Get the price of a model, with or without its provider prefix (openai/gpt-4.1).
+    """
+    if not model:
+        return None
+
+    prices = {**PRICES, **parse_prices(os.getenv("LLM_PRICES"))}
+    for name in [model, model.split("/")[-1]]:
+        if name in prices:
+            return prices[name]
+
+    with _unpriced_lock:
+        if model not in _unpriced:
+            _unpriced.add(model)
+            logger.warning(f"No price for model {model}, its calls won't have a cost. Set it in LLM_PRICES.")
+    return None
+
+def cost(model: str, input_tokens: int, output_tokens: int = 0, cached_tokens: int = 0) -> Optional[float]:
+    """
+    Estimate the cost of a call.
+
+    Returns:
+        Optional[float]: USD, None if the model has no price.
+    """
+    price = get_price(model)
+    if price is None:
+        return None
+
+    input_price, cached_price, output_price = price
+    if cached_price is None:
+        cached_price = input_price
+
+    return ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price + output_tokens * output_price) / 1e6
+
+class UsageTracker:
+    """
+    The usage records of an analysis, or of a part of it.
+    """
+    def __init__(self, records: List[UsageRecord] = None, parent: "UsageTracker" = None):
+        self.records = records if records is not None else []
+        self.parent = parent
+        self.phase = parent.phase if parent else None
+
+    def add(self, record: UsageRecord):
+        self.records.append(record)
+        if self.parent is not None:
+            self.parent.add(record)
+
+def current() -> Optional[UsageTracker]:
+    """
+    Get the tracker of the analysis running in this context, if any.
+    """
+    return _tracker.get()
+
+@contextmanager
+def track(records: List[UsageRecord] = None):
+    """
+    Record the usage of the calls made inside the block.
+
+    Args:
+        records (List[UsageRecord]): Where to add the records (e.g. Pipe.usage).
+
+    Yields:
+        UsageTracker: The tracker.
+    """
+    tracker = UsageTracker(records)
+    token = _tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _tracker.reset(token)
+
+@contextmanager
+def capture():
+    """
+    Also collect the records of the calls made inside the block apart, e.g.
+    to store them with a fixture. They still reach the analysis' tracker.
+
+    Yields:
+        UsageTracker: The nested tracker.
+    """
+    tracker = UsageTracker(parent=current())
+    token = _tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _tracker.reset(token)
+
+def set_phase(phase: str):
+    """
+    Set the phase of the next records of the current analysis.
+    """
+    tracker = current()
+    if tracker is not None:
+        tracker.phase = phase
+
+def record(model: str, role: str = None, input_tokens: int = 0, output_tokens: int = 0, cached_tokens: int = 0) -> UsageRecord:
+    """
+    Record the tokens of a call in the current analysis, and in the metrics.
+
+    Args:
+        model (str): The model.
+        role (str): What the model is used for (pdf, text, embeddings).
+        input_tokens (int): Input tokens, including the cached ones.
+        output_tokens (int): Output tokens.
+        cached_tokens (int): Input tokens read from the provider's cache.
+
+    Returns:
+        UsageRecord: The record.
+    """
+    tracker = current()
+
+    usage = UsageRecord(
+        model=model,
+        role=role,
+        phase=tracker.phase if tracker else None,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cached_tokens=cached_tokens,
+        cost=cost(model, input_tokens, output_tokens, cached_tokens),
+    )
+
+    if tracker is not None:
+        tracker.add(usage)
+
+    telemetry.llm_tokens(model, input_tokens, output_tokens, cached_tokens, usage.cost)
+    return usage
+
+def replay(records: Iterable[UsageRecord]):
+    """
+    Record again the usage of a replayed call, in the current phase.
+    """
+    for r in records:
+        record(r.model, r.role, r.input_tokens, r.output_tokens, r.cached_tokens)
+
+def summarize(records: Iterable[UsageRecord], role: str = None, phase: str = None) -> Dict[str, float]:
+    """
+    Add up usage records.
+
+    Args:
+        records (Iterable[UsageRecord]): The records.
+        role (str): Only the records of this role.
+        phase (str): Only the records of this phase.
+
+    Returns:
+        Dict[str, float]: calls, input_tokens, output_tokens, cached_tokens and
+            cost (None if none of the models has a price).
+    """
+    total = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "cost": None}
+    for r in records or []:
+        if (role and r.role != role) or (phase and r.phase != phase):
+            continue
+
+        total["calls"] += 1
+        total["input_tokens"] += r.input_tokens
+        total["output_tokens"] += r.output_tokens
+        total["cached_tokens"] += r.cached_tokens
+        if r.cost is not None:
+            total["cost"] = (total["cost"] or 0) + r.cost
+
+    return total
+
+def to_dicts(records: Iterable[UsageRecord]) -> List[Dict]:
+    return [dataclasses.asdict(r) for r in records or []]
+
+if __name__ == "__main__":
+    def test_usage():
+        records = []
+        with track(records):
+            set_phase("compare_results")
+            record("openai/gpt-4.1", "pdf", input_tokens=2000, output_tokens=100, cached_tokens=1000)
+
+            with capture() as captured:
+                record("unknown-model", "embeddings", input_tokens=50)
+
+            set_phase("draw_conclusion")
+            replay(captured.records)
+
+        record("outside", "text", input_tokens=1)
+
+        assert len(records) == 3 and len(captured.records) == 1
+        assert records[2].phase == "draw_conclusion"
+
+        pdf = summarize(records, role="pdf")
+        assert abs(pdf["cost"] - (1000 * 2 + 1000 * 0.5 + 100 * 8) / 1e6) < 1e-12
+        assert summarize(records, role="embeddings")["cost"] is None
+        assert summarize(records, phase="compare_results")["calls"] == 2
+        print("Usage test passed")
+    #test_usage()
@@ -9,13 +9,14 @@ import json
 from pydantic import BaseModel
 import re
 import dataclasses
-import socket
 
 try:
     import fake_news_detector.debug
 except ImportError:
     import debug
 
+import fake_news_detector.network as network
+
 # TEXT
 def remove_newlines(text: str) -> str:
     """
@@ -101,6 +102,23 @@ def load(path: str) -> str:
         
         return text
     
+def load_binary(path: str) -> bytes:
+    """
+    Load the bytes from a file.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        bytes: The loaded bytes.
+    """
+    with open(path, "rb") as file:
+        b = file.read()
+        
+        logger.debug(f"Loaded {len(b)} bytes from '{path}'")
+        
+        return b
+    
 def load_b64(path: str, mime: str = None) -> str:
     """
     Load the bytes from a file and convert to base64.
@@ -221,21 +239,33 @@ def get_domain(url: str) -> str:
 
 def domain_to_ip(domain: str) -> str:
     """
-    Get the IP address of the domain.
+    Get the IP address of the domain. IPv4 is preferred over IPv6.
 
     Args:
         url (str): The domain to get the IP address from.
 
     Returns:
-        str: The IP address of the domain.
+        str: The IP address of the domain, or None if it doesn't resolve.
     """
+    ips = domain_to_ips(domain)
     
-    # Get the IP address
-    ip = socket.gethostbyname(domain)
-    
-    logger.debug(f"Resolved '{domain}' to '{ip}'")
+    if not ips:
+        logger.warning(f"Could not resolve '{domain}'")
+        return None
     
-    return ip
+    return ips[0]
+
+def domain_to_ips(domain: str) -> list[str]:
+    """
+    Get all the IP addresses (IPv4 and IPv6) of the domain, using the cached resolver.
+
+    Args:
+        domain (str): The domain to get the IP addresses from.
+
+    Returns:
+        list[str]: The IPv4 addresses followed by the IPv6 ones.
+    """
+    return network.RESOLVER.resolve_sync(domain)
 
 def url_to_filepath(url: str) -> str:
     """
@@ -359,6 +389,21 @@ def bytes_to_b64(b: bytes, mime: str) -> str:
     
     return uri
 
+def b64_to_bytes(uri: str) -> bytes:
+    """
+    Convert a base64 string (or data URI) back to bytes.
+
+    Args:
+        uri (str): The base64 string, with or without the "data:<mime>;base64," prefix.
+
+    Returns:
+        bytes: The decoded bytes.
+    """
+    if uri.startswith("data:"):
+        uri = uri.split(",", 1)[1]
+    
+    return base64.b64decode(uri)
+
 # LISTS
 def limit(lst: list, limit: int = 10) -> list:
     """
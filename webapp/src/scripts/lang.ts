@@ -2,6 +2,7 @@ export const TEXTS = {
     stateProgressBar: {
         unknown: "Estado desconocido.",
         connecting: "Conectando...",
+        queued: "En Cola...",
         check_domain: "Descargando el Artículo de la URL Especificada...",
         download_article: "Convirtiendo el Formato del Artículo...",
         parse_article: "Procesando el Artículo Descargado...",
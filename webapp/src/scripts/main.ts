@@ -201,11 +201,16 @@ function startWebsockets() {
 function onWebsocketMessage(event: MessageEvent) {
     console.log("WebSocket message received.");
 
-    handleMessage(event.data)
+    handleProtocolMessage(event.data)
 }
 
 function onWebsocketOpen() {
     console.log("WebSocket connection established.");
+
+    // Catch up with a job that was running before the connection dropped
+    if (jobId && !jobFinished) {
+        sendMessage({ resync: jobId });
+    }
 }
 
 let wsError = false;
@@ -350,23 +355,76 @@ function setProgressBarState(
     stateElement.textContent = state;
 }
 
-// Phase handling
-function handleMessage(data_raw: string) {
-    let data: any;
+// Progress protocol handling
+let jobId: string | null = null;
+let jobState: any = null;
+let jobVersion = 0;
+let jobFinished = false;
+
+function handleProtocolMessage(data_raw: string) {
+    let msg: any;
     try {
-        data = JSON.parse(data_raw);
+        msg = JSON.parse(data_raw);
     } catch (e) {
         console.error("Failed to parse message:", e);
         return;
     }
 
-    if (data === null){
-        console.warn("Received null data, ignoring.");
+    // Late updates of a previous job must not overwrite the current one
+    if ((msg.type === "snapshot" || msg.type === "patch") && msg.job_id !== jobId) {
+        console.debug(`Ignoring ${msg.type} of job ${msg.job_id}`);
         return;
     }
 
+    switch (msg.type) {
+        case "queued":
+            jobId = msg.job_id;
+            jobState = null;
+            jobVersion = 0;
+            jobFinished = false;
+
+            handleMessage({ url: msg.url, phase: "queued" });
+            break;
+        case "snapshot":
+            jobState = msg.data;
+            jobVersion = msg.version;
+
+            handleMessage(jobState);
+            break;
+        case "patch":
+            // Already included in a newer snapshot
+            if (msg.version <= jobVersion) {
+                return;
+            }
+
+            // Missed an update, ask for the full state
+            if (jobState === null || msg.base !== jobVersion) {
+                console.warn(`Missed progress updates (have ${jobVersion}, got ${msg.base}). Resyncing.`);
+                sendMessage({ resync: msg.job_id });
+                return;
+            }
+
+            jobState = utils.applyPatch(jobState, msg.ops);
+            jobVersion = msg.version;
+
+            handleMessage(jobState);
+            break;
+        case "error":
+            handleMessage({ url: msg.url, error: msg.error });
+            break;
+        default:
+            console.warn("Unknown message type:", msg.type);
+    }
+}
+
+// Phase handling
+function handleMessage(data: any) {
     console.log("Received data:", data);
 
+    if (data.phase === "finished" || data.error || data.refusal || data.exception) {
+        jobFinished = true;
+    }
+
     // Check for errors
     if (data.error || data.refusal || data.exception) {
         if (data.error) {
@@ -560,6 +618,8 @@ function handleMessage(data_raw: string) {
             // Unblur section
             unBlur(domainBadges);
             break;
+        case "queued":
+            break;
         default:
             console.warn("Unknown phase:", data.phase);
     }
@@ -44,4 +44,42 @@ export function removeAttributeFromSuffixes(
     elements.forEach((element) => {
         handleAttributeToSuffix(element, attribute, suffix, false);
     });
-}
\ No newline at end of file
+}
+function decodePointer(path: string): string[] {
+    return path.split("/").slice(1).map(
+        (key) => key.replace(/~1/g, "/").replace(/~0/g, "~")
+    );
+}
+
+export function applyPatch(state: any, ops: any[]): any {
+    for (const op of ops) {
+        const keys = decodePointer(op.path);
+
+        // Replacing the whole document
+        if (keys.length === 0) {
+            state = op.value;
+            continue;
+        }
+
+        const last = keys.pop() as string;
+        const parent = keys.reduce((node, key) => node[key], state);
+
+        if (Array.isArray(parent)) {
+            if (op.op === "remove") {
+                parent.splice(Number(last), 1);
+            } else if (last === "-") {
+                parent.push(op.value);
+            } else if (op.op === "add") {
+                parent.splice(Number(last), 0, op.value);
+            } else {
+                parent[Number(last)] = op.value;
+            }
+        } else if (op.op === "remove") {
+            delete parent[last];
+        } else {
+            parent[last] = op.value;
+        }
+    }
+
+    return state;
+}